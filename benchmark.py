@@ -0,0 +1,268 @@
+"""Throughput benchmarks for the ID card pipeline.
+
+Runs on synthetic fixtures (no roster or photo folder needed):
+
+    python benchmark.py resampling --repeat 20
+    python benchmark.py import-time --max-ms 250
+    python benchmark.py shared-memory --workers 4 --cards 200
+    python benchmark.py card-outputs --cards 40
+"""
+import os
+import sys
+import time
+import hashlib
+import subprocess
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from id_generator import (IDCardGenerator, RenderWorkerPool, CardOutputWriter, RESAMPLING_PRESETS,
+                          resize_for_stage, parse_output_specs)
+
+# Card layout used by the synthetic fixtures
+FIXTURE_TEMPLATE_SIZE = (638, 1012)
+FIXTURE_COORDINATES = {
+    'Photo': (319, 330), 'QR Code': (520, 880),
+    'Name': (80, 520), 'Class': (80, 570), 'Contact': (80, 620), 'Address': (80, 670),
+    'Guardian': (80, 720), 'Validity': (80, 770), 'RegNo': (80, 820),
+}
+
+
+def make_fixture_template(path, size=FIXTURE_TEMPLATE_SIZE):
+    """Write a simple two-tone card template."""
+    template = Image.new('RGB', size, (230, 240, 255))
+    draw = ImageDraw.Draw(template)
+    draw.rectangle((0, 0, size[0], 150), fill=(20, 60, 160))
+    template.save(path)
+    return path
+
+
+def make_fixture_photo(seed, size=(300, 380)):
+    """Return a synthetic portrait photo that differs per seed."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=3)
+    gradient = np.linspace(0, 1, size[1])[:, None, None] * np.linspace(0.5, 1, size[0])[None, :, None]
+    pixels = (gradient * base).astype(np.uint8)
+    photo = Image.fromarray(np.ascontiguousarray(np.broadcast_to(pixels, (size[1], size[0], 3))), 'RGB')
+    ImageDraw.Draw(photo).ellipse((size[0] // 5, size[1] // 6, size[0] * 4 // 5, size[1] * 4 // 5), fill=(240, 200, 170))
+    return photo
+
+
+def make_fixture_generator(workdir, template_size=FIXTURE_TEMPLATE_SIZE, **kwargs):
+    """Create an IDCardGenerator over a synthetic template in workdir."""
+    template_path = make_fixture_template(os.path.join(workdir, 'template.png'), template_size)
+    return IDCardGenerator(
+        template_path=template_path,
+        photos_folder=os.path.join(workdir, 'photos'),
+        qr_folder=os.path.join(workdir, 'qr'),
+        excel_path=os.path.join(workdir, 'roster.xlsx'),
+        output_folder=os.path.join(workdir, 'output'),
+        coordinates=FIXTURE_COORDINATES,
+        **kwargs
+    )
+
+
+def make_fixture_qr(modules=29, module_px=1):
+    """Return a synthetic QR-like code: a random module grid with finder squares."""
+    rng = np.random.default_rng(modules)
+    grid = rng.integers(0, 2, size=(modules, modules)).astype(np.uint8) * 255
+    for y, x in ((0, 0), (0, modules - 7), (modules - 7, 0)):
+        grid[y:y + 7, x:x + 7] = 0
+        grid[y + 1:y + 6, x + 1:x + 6] = 255
+        grid[y + 2:y + 5, x + 2:x + 5] = 0
+    qr = Image.fromarray(grid, 'L')
+    return qr.resize((modules * module_px, modules * module_px), Image.Resampling.NEAREST)
+
+
+def bench_resampling(repeat):
+    """Time each resampling preset per stage and compare its output with 'print'."""
+    stages = [
+        # (label, stage, source image, target size)
+        ("photo 2400x3200 -> 230x230", 'photo', make_fixture_photo(1, size=(2400, 3200)), (230, 230)),
+        ("QR 29 modules x10px -> 120x120", 'qr', make_fixture_qr(29, 10), (120, 120)),
+        ("QR 29 modules x1px -> 116x116 (x4)", 'qr', make_fixture_qr(29, 1), (116, 116)),
+        ("card 2022x3204 -> 641x1016 (page)", 'page', make_fixture_photo(2, size=(2022, 3204)), (641, 1016)),
+        ("template 2022x3204 -> 315x500 (preview)", 'preview', make_fixture_photo(3, size=(2022, 3204)), (315, 500)),
+    ]
+
+    print(f"Resampling presets, best of {repeat} runs per stage:")
+    for label, stage, source, size in stages:
+        print(f"  {label}")
+        reference = np.asarray(resize_for_stage(source, size, stage, 'print'), dtype=np.int16)
+        for preset in RESAMPLING_PRESETS:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                output = resize_for_stage(source, size, stage, preset)
+                best = min(best, time.perf_counter() - start)
+            diff = np.abs(np.asarray(output, dtype=np.int16) - reference)
+            print(f"    {preset:6} {best * 1000:8.2f} ms   mean diff {diff.mean():5.2f}   max diff {int(diff.max()):3}")
+    return True
+
+
+def bench_card_outputs(cards, outputs):
+    """Multi-resolution card outputs: each size from the full card, serially, vs the writer's pyramid on threads."""
+    specs = parse_output_specs(outputs)
+    sources = [make_fixture_photo(i, size=(2022, 3204)) for i in range(cards)]
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        for i, card in enumerate(sources):
+            for spec in specs:
+                image = card
+                if spec.width is not None:
+                    image = resize_for_stage(card, (spec.width, round(card.height * spec.width / card.width)), 'page', 'print')
+                path = os.path.join(workdir, f"direct_{spec.name}_{i}")
+                if spec.format == 'jpeg':
+                    image.convert('RGB').save(path, format='JPEG', quality=spec.quality)
+                else:
+                    image.save(path, format='PNG')
+        direct = time.perf_counter() - start
+
+        start = time.perf_counter()
+        writer = CardOutputWriter(workdir, specs, 'print')
+        for i, card in enumerate(sources):
+            writer.add(card, f"S{i}")
+        writer.close()
+        pyramid = time.perf_counter() - start
+
+    print(f"Card outputs {outputs}, {cards} cards of 2022x3204:")
+    print(f"  from full size, serial:  {cards / direct:7.1f} cards/s")
+    print(f"  pyramid, thread pool:    {cards / pyramid:7.1f} cards/s   ({direct / pyramid:.1f}x)")
+    return True
+
+
+def process_memory(pid):
+    """(private, shared) resident bytes of a process from /proc (Linux), or (None, None)."""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith(('RssAnon:', 'RssShmem:')):
+                    key, value = line.split(':')
+                    values[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return values.get('RssAnon'), values.get('RssShmem')
+
+
+def bench_shared_memory(cards, workers, scale):
+    """Isolated rendering (RenderWorkerPool) with the templates pickled to each worker vs shared memory."""
+    template_size = (FIXTURE_TEMPLATE_SIZE[0] * scale, FIXTURE_TEMPLATE_SIZE[1] * scale)
+    with tempfile.TemporaryDirectory() as workdir:
+        generator = make_fixture_generator(workdir, template_size=template_size, photo_frame_style="circle")
+        os.makedirs(generator.photos_folder)
+        entries = []
+        for i in range(cards):
+            photo_path = os.path.join(generator.photos_folder, f"S{i}.jpg")
+            make_fixture_photo(i).save(photo_path, quality=90)
+            entries.append(({'EXT_ID': f"S{i}", 'Name': f"Student {i}"}, photo_path, 'EXT_ID'))
+
+        runs = []
+        for label, share_images in (("pickled templates", False), ("shared memory    ", True)):
+            start = time.perf_counter()
+            pool = RenderWorkerPool(generator, workers, share_images=share_images)
+            startup = time.perf_counter() - start
+            try:
+                started_memory = [process_memory(process.pid) for process, _ in pool.workers]
+                start = time.perf_counter()
+                rendered = pool.render(entries)
+                seconds = time.perf_counter() - start
+                memory = [process_memory(process.pid) for process, _ in pool.workers]
+                payload = len(pool.payload)
+            finally:
+                pool.close()
+            checksums = [hashlib.md5(front.tobytes()).hexdigest() if front else None for front, _ in rendered]
+            runs.append((label, startup, seconds, started_memory, memory, payload, checksums))
+
+    def private_mb(memory):
+        private = [anon for anon, _ in memory if anon is not None]
+        return f"{max(private) / 2**20:.1f} MB" if private else "n/a"
+
+    print(f"Isolated rendering, {cards} cards of {template_size[0]}x{template_size[1]} on {workers} workers:")
+    for label, startup, seconds, started_memory, memory, payload, _ in runs:
+        print(f"  {label}: start {startup:.2f}s, {cards / seconds:,.0f} cards/s, {payload:,} byte payload, "
+              f"worker private RSS {private_mb(started_memory)} started, {private_mb(memory)} after rendering")
+    matching = None not in runs[0][-1] and runs[0][-1] == runs[1][-1]
+    print(f"  Identical cards: {'yes' if matching else 'NO'}")
+    return matching
+
+
+def measure_import(module):
+    """Import module in a fresh interpreter with -X importtime.
+
+    Returns (total_us, {top_level_module: cumulative_us}).
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name[1:]
+        # Direct imports of the measured module are indented by exactly one level
+        if name.startswith('  ') and not name.startswith('   '):
+            top_level[name.strip()] = int(cumulative)
+        elif name.strip() == module:
+            total = int(cumulative)
+    return total, top_level
+
+
+def bench_import_time(module, repeat, max_ms, show):
+    """Report cold import time of module and fail when it exceeds max_ms."""
+    runs = [measure_import(module) for _ in range(repeat)]
+    total, top_level = min(runs, key=lambda run: run[0])
+    print(f"Import time of '{module}', best of {repeat} fresh interpreters: {total / 1000:.1f} ms")
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:show]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+    if max_ms is not None and total / 1000 > max_ms:
+        print(f"  Over the {max_ms:.0f} ms budget")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ID card pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    resampling = subparsers.add_parser('resampling', help="Time and output difference of the draft/proof/print presets")
+    resampling.add_argument('--repeat', type=int, default=10)
+
+    import_time = subparsers.add_parser('import-time', help="Cold import time of id_generator (-X importtime)")
+    import_time.add_argument('--module', default='id_generator')
+    import_time.add_argument('--repeat', type=int, default=5)
+    import_time.add_argument('--max-ms', type=float, default=250.0,
+                             help="Exit with status 1 when the best import takes longer")
+    import_time.add_argument('--show', type=int, default=10, help="Number of slowest direct imports to list")
+
+    shared = subparsers.add_parser('shared-memory', help="Isolated rendering workers with pickled vs shared memory templates")
+    shared.add_argument('--cards', type=int, default=200)
+    shared.add_argument('--workers', type=int, default=4)
+    shared.add_argument('--scale', type=int, default=2, help="Template size as a multiple of the fixture template")
+
+    card_outputs = subparsers.add_parser('card-outputs', help="Multi-resolution card outputs: direct vs pyramid on threads")
+    card_outputs.add_argument('--cards', type=int, default=40)
+    card_outputs.add_argument('--outputs', default="print:jpeg:full,web:jpeg:600:85,thumb:jpeg:96")
+
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    if args.benchmark == 'resampling':
+        ok = bench_resampling(args.repeat)
+    elif args.benchmark == 'shared-memory':
+        ok = bench_shared_memory(args.cards, args.workers, args.scale)
+    elif args.benchmark == 'card-outputs':
+        ok = bench_card_outputs(args.cards, args.outputs)
+    elif args.benchmark == 'import-time':
+        ok = bench_import_time(args.module, args.repeat, args.max_ms, args.show)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,478 @@
+import gc
+import io
 import os
 import re
+import sys
+import csv
+import json
+import mmap
+import pickle
+import time
+import signal
+import struct
+import queue
+import tarfile
+import zipfile
+import threading
+import importlib.util
+import bisect
 import logging
-from PIL import Image, ImageDraw, ImageFont, ImageTk
-import pandas as pd
+import argparse
+import heapq
+import hashlib
+import linecache
+import tracemalloc
+import functools
+import unicodedata
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory, resource_tracker
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from tkinter.scrolledtext import ScrolledText
 
+def lazy_import(name):
+    """Return a module that is only loaded on first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# Heavy dependencies load on first use so the window (and the command line) start
+# quickly: pandas when a roster is read, PIL and NumPy when an image is opened
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+ImageFont = lazy_import('PIL.ImageFont')
+ImageTk = lazy_import('PIL.ImageTk')
+TiffImagePlugin = lazy_import('PIL.TiffImagePlugin')
+
+# ICC colour management; Pillow can be built without LittleCMS
+ImageCms = lazy_import('PIL.ImageCms') if importlib.util.find_spec('PIL._imagingcms') else None
+
+# Peak RSS for the run summary; not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Optional fast XLSX reader; pandas falls back to openpyxl when it is not installed
+EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# File extensions accepted for photos and QR codes
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Column names (lowercased) that identify the student's EXT_ID
+EXT_ID_COLUMN_NAMES = ['ext_id', 'ext-id', 'extid', 'id']
+
+# Pre-flight limits: images above these are reported as oversized
+PREFLIGHT_MAX_IMAGE_PIXELS = 40_000_000  # ~40 megapixels
+PREFLIGHT_MAX_FILE_BYTES = 25 * 1024 * 1024  # 25 MB
+
+# Fuzzy filename matching: minimum similarity to accept a match, and how close the
+# runner-up may score before the match is flagged as ambiguous
+FUZZY_MATCH_MIN_SCORE = 0.75
+FUZZY_MATCH_AMBIGUITY_MARGIN = 0.05
+
+# Resampling presets: (Image.Resampling filter name, reducing_gap) per pipeline stage.
+# reducing_gap lets Pillow shrink by an integer factor with Image.reduce first and only
+# run the filter over the last step, which is much cheaper for large downscales.
+RESAMPLING_PRESETS = {
+    'draft': {
+        'photo': ('BILINEAR', 2.0),
+        'qr': ('BILINEAR', 2.0),
+        'page': ('BILINEAR', 2.0),
+        'preview': ('BILINEAR', 2.0),
+    },
+    'proof': {
+        'photo': ('BICUBIC', 3.0),
+        'qr': ('BICUBIC', 3.0),
+        'page': ('BICUBIC', 3.0),
+        'preview': ('BILINEAR', 2.0),
+    },
+    'print': {
+        'photo': ('LANCZOS', None),
+        'qr': ('LANCZOS', None),
+        'page': ('LANCZOS', None),
+        'preview': ('LANCZOS', 3.0),
+    },
+}
+DEFAULT_RESAMPLING_PRESET = 'print'
+
+# Multi-sheet workbooks: the headings other sheets use for each roster column (matched
+# ignoring case, spaces and punctuation), the column naming each row's sheet, and the
+# workbook size above which sheets are parsed in worker processes
+COLUMN_ALIASES = {
+    'EXT_ID': EXT_ID_COLUMN_NAMES + ['student id', 'id no', 'id number'],
+    'Name': ['student name', 'full name', 'student'],
+    'Grade': ['class', 'grade level', 'standard'],
+    'PhoneNumber': ['phone', 'phone no', 'contact', 'contact number', 'mobile', 'mobile number'],
+    'Address': ['home address', 'address line'],
+    'Guardian': ['guardian name', 'parent', 'parent name'],
+    'Validity': ['valid until', 'valid till', 'expiry', 'expiry date'],
+    'RegNo': ['registration number', 'reg number'],
+}
+SHEET_COLUMN = 'Sheet'
+SHEET_PROCESS_MIN_BYTES = 1024 * 1024
+
+# Complex scripts (Hebrew/Arabic, Indic incl. Devanagari, Thai/Lao/Tibetan, Myanmar,
+# Khmer) need shaping by libraqm; shaped and rasterized text runs are cached per job
+COMPLEX_SCRIPT_RANGES = ((0x0590, 0x08FF), (0x0900, 0x0DFF), (0x0E00, 0x0FFF), (0x1000, 0x109F), (0x1780, 0x17FF))
+TEXT_RUN_CACHE_SIZE = 4096
+
+# Card labels that are drawn as text
+TEXT_FIELD_LABELS = ['Name', 'Class', 'Contact', 'Address', 'Guardian', 'Validity', 'Roll No.', 'RegNo']
+
+# Code 128 barcodes: bar/space widths (in modules) of each symbol value 0-106, where
+# 103-105 start code sets A/B/C and 106 is the stop pattern. Bars are drawn at a whole
+# number of pixels per module inside the barcode box, with a quiet zone either side.
+CODE128_PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+CODE128_START_B, CODE128_START_C, CODE128_STOP = 104, 105, 106
+CODE128_SWITCH_B, CODE128_SWITCH_C = 100, 99
+BARCODE_QUIET_ZONE = 10  # Modules of white either side, as scanners require
+DEFAULT_BARCODE_SIZE = (360, 90)
+BARCODE_CACHE_SIZE = 1024
+
+# Duplex printing: which sheet edge the printer flips on. Back-side pages are mirrored
+# to match, so every back lands behind its front.
+DUPLEX_FLIP_MODES = ('long', 'short')
+DEFAULT_DUPLEX_FLIP = 'long'
+
+# Print output: colour mode and file format of the A4 pages, and how many pages are
+# colour-converted in parallel
+OUTPUT_COLOR_MODES = ('rgb', 'cmyk')
+PAGE_FORMATS = ('pdf', 'tiff')
+OUTPUT_MAX_WORKERS = 4
+
+# Seconds between log flushes while grouped page files are written in parallel
+PAGE_GROUP_LOG_INTERVAL = 0.1
+
+# Watch mode: seconds between polls, how long a file must stay unchanged before it is
+# used (debounces partial writes), and the state file kept in the output folder
+WATCH_POLL_SECONDS = 5.0
+WATCH_SETTLE_SECONDS = 3.0
+WATCH_STATE_FILE = ".watch_state.json"
+
+
+# A4 landscape page at 300 DPI, the card grid on it and the padding around each card
+A4_PAGE_SIZE = (3508, 2480)
+A4_GRID = (5, 2)
+A4_CARD_PADDING = 30
+
+# Memory budget: share of the budget at which queued cards are rendered early and pages
+# are spilled to disk, and the largest share a single decoded image may take
+MEMORY_BUDGET_HIGH_WATER = 0.8
+MAX_DECODE_SHARE = 0.1
+
+# Memory profiling mode: cards between samples, allocation sites listed per stage and
+# traceback depth kept by tracemalloc
+PROFILE_SAMPLE_EVERY = 50
+PROFILE_TOP_ALLOCATIONS = 10
+PROFILE_TRACE_FRAMES = 1
+
+# Per-row template routing: how many routed templates are kept loaded at once
+TEMPLATE_CACHE_SIZE = 8
+
+# Per-card image archives: formats, how many encoded cards may wait for the writer,
+# and how often a ZIP's central directory is rewritten so finished entries can be read
+CARD_ARCHIVE_FORMATS = ('zip', 'tar')
+CARD_IMAGE_FORMATS = ('png', 'jpeg')
+ARCHIVE_QUEUE_SIZE = 32
+ARCHIVE_CHECKPOINT_SECONDS = 5.0
+
+# Multi-resolution card outputs: cards queued for the encoder threads at most, and the
+# default JPEG quality
+OUTPUT_QUEUE_SIZE = 32
+DEFAULT_OUTPUT_QUALITY = 90
+
+# Isolated rendering: seconds a row may take in its worker process and a worker may take
+# to start, rows queued per worker so an idle worker always has the next row, and the
+# report of quarantined rows
+ROW_TIMEOUT_SECONDS = 30.0
+WORKER_START_SECONDS = 60.0
+ISOLATED_ROWS_PER_WORKER = 4
+QUARANTINE_REPORT = "quarantine_report.csv"
+
+# Shared memory for worker processes: the image modes stored (RGB as RGBX) and the
+# alignment of each image in the block
+SHARED_IMAGE_MODES = ('L', 'RGB', 'RGBA')
+SHARED_ALIGNMENT = 64
+
+# Results gallery: card thumbnails written during a run (folder inside the output
+# folder, its index, largest thumbnail size, JPEG quality), and how many decoded
+# thumbnails the GUI keeps while scrolling
+THUMBNAIL_FOLDER = ".thumbnails"
+THUMBNAIL_INDEX = "index.json"
+THUMBNAIL_SIZE = (128, 160)
+THUMBNAIL_QUALITY = 80
+GALLERY_IMAGE_CACHE_SIZE = 300
+
+# Live GUI preview: delay after the last drag/font edit before re-rendering, and how
+# many canvas-sized templates are kept scaled
+PREVIEW_DEBOUNCE_MS = 30
+PREVIEW_TEMPLATE_CACHE_SIZE = 4
+
+def resize_for_stage(image, size, stage, preset=DEFAULT_RESAMPLING_PRESET):
+    """Resize an image with the filter the preset picks for a pipeline stage.
+
+    QR codes scaled by a whole-number factor are resized without filtering (NEAREST
+    to enlarge, Image.reduce to shrink) so module edges stay sharp in every preset.
+
+    Args:
+        image (PIL.Image): Image to resize
+        size (tuple): Target (width, height)
+        stage (str): 'photo', 'qr', 'page' or 'preview'
+        preset (str): 'draft', 'proof' or 'print'
+    """
+    size = tuple(size)
+    if image.size == size:
+        return image.copy()
+
+    if stage == 'qr':
+        (width, height), (target_width, target_height) = image.size, size
+        if target_width % width == 0 and target_height % height == 0 and target_width // width == target_height // height:
+            return image.resize(size, Image.Resampling.NEAREST)
+        if width % target_width == 0 and height % target_height == 0 and width // target_width == height // target_height:
+            if image.mode in ('1', 'P'):
+                return image.resize(size, Image.Resampling.NEAREST)
+            return image.reduce(width // target_width)
+
+    resample, reducing_gap = RESAMPLING_PRESETS[preset][stage]
+    return image.resize(size, Image.Resampling[resample], reducing_gap=reducing_gap)
+
+def parse_byte_size(text):
+    """Parse a size such as '2G', '512M' or '1500000' into bytes."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size '{text}' (use e.g. 512M or 2G)")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMGT'.index(unit.upper() or ' '))
+
+def format_bytes(size):
+    """Format a byte count for the log, e.g. '1.5 GB'."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def code128_symbols(value):
+    """Encode text as Code 128 symbol values, including start, checksum and stop.
+
+    Printable ASCII uses code set B; runs of four or more digits switch to code set C,
+    which packs two digits per symbol.
+
+    Raises:
+        ValueError: If the text is empty or has characters outside printable ASCII
+    """
+    if not value or any(not 32 <= ord(char) <= 126 for char in value):
+        raise ValueError(f"'{value}' cannot be encoded as Code 128 (printable ASCII only)")
+    symbols = []
+    code_set = None
+    i = 0
+    while i < len(value):
+        digits = len(re.match(r'\d*', value[i:]).group())
+        if digits >= 4 or (code_set != 'B' and digits >= 2 and digits == len(value) - i):
+            if digits % 2 and code_set != 'C':
+                # Odd run: the first digit goes in code set B
+                if code_set != 'B':
+                    symbols.append(CODE128_START_B if code_set is None else CODE128_SWITCH_B)
+                    code_set = 'B'
+                symbols.append(ord(value[i]) - 32)
+                i += 1
+                digits -= 1
+            if code_set != 'C':
+                symbols.append(CODE128_START_C if code_set is None else CODE128_SWITCH_C)
+                code_set = 'C'
+            for _ in range(digits // 2):
+                symbols.append(int(value[i:i + 2]))
+                i += 2
+        else:
+            if code_set != 'B':
+                symbols.append(CODE128_START_B if code_set is None else CODE128_SWITCH_B)
+                code_set = 'B'
+            symbols.append(ord(value[i]) - 32)
+            i += 1
+    checksum = (symbols[0] + sum(position * symbol for position, symbol in enumerate(symbols[1:], 1))) % 103
+    return symbols + [checksum, CODE128_STOP]
+
+@functools.lru_cache(maxsize=BARCODE_CACHE_SIZE)
+def render_code128(value, width, height, quiet_zone=BARCODE_QUIET_ZONE):
+    """Render a Code 128 barcode that fits a width x height box, cached per value.
+
+    Every module is the same whole number of pixels wide, the largest that fits, so
+    the bars are never resampled. The image is only as wide as the barcode itself.
+    The cached image is shared: paste it, do not draw on it.
+
+    Raises:
+        ValueError: If the value cannot be encoded, or needs more than width pixels
+    """
+    widths = [int(w) for symbol in code128_symbols(value) for w in CODE128_PATTERNS[symbol]]
+    modules = sum(widths) + 2 * quiet_zone
+    module_width = width // modules
+    if module_width < 1:
+        raise ValueError(f"Barcode for '{value}' needs {modules}px, wider than {width}px")
+    barcode = Image.new('L', (modules * module_width, height), 255)
+    draw = ImageDraw.Draw(barcode)
+    x = quiet_zone * module_width
+    for i, w in enumerate(widths):
+        if i % 2 == 0:  # Patterns alternate bar, space, bar...
+            draw.rectangle((x, 0, x + w * module_width - 1, height - 1), fill=0)
+        x += w * module_width
+    return barcode
+
+@functools.lru_cache(maxsize=1)
+def has_raqm():
+    """Whether Pillow can shape complex scripts (built with libraqm and its FriBiDi runtime)."""
+    from PIL import features
+    return bool(features.check('raqm'))
+
+def needs_shaping(text):
+    """Whether text contains a script that only renders correctly with libraqm shaping."""
+    return any(low <= ord(char) <= high for char in text for low, high in COMPLEX_SCRIPT_RANGES)
+
+@functools.lru_cache(maxsize=None)
+def page_sequence_class():
+    """Image class presenting a stream of pages as one multi-frame image.
+
+    Pillow's PDF writer numbers n_frames pages up front and then seeks through the
+    frames in order, so a whole file is written by one save_all call while only the
+    page being encoded is held. Defined on first use to keep PIL out of start-up.
+    """
+    class PageSequence(Image.Image):
+        def __init__(self, pages, count):
+            super().__init__()
+            self.pages = iter(pages)
+            self.n_frames = count
+            self.frame = -1
+            self.seek(0)
+
+        def seek(self, frame):
+            if frame == self.frame:
+                return
+            if frame != self.frame + 1 or frame >= self.n_frames:
+                raise EOFError("Pages can only be read once, in order")
+            page = next(self.pages)
+            page.load()
+            self.im, self._mode, self._size = page.im, page.mode, page.size
+            self.frame = frame
+
+        def tell(self):
+            return self.frame
+
+    return PageSequence
+
+@functools.lru_cache(maxsize=64)
+def load_font(font_path, size):
+    """Load a TrueType/OpenType font, reusing it for every job and preview with the same size.
+
+    Fonts use libraqm layout when it is available, so complex scripts are shaped.
+    """
+    layout_engine = ImageFont.Layout.RAQM if has_raqm() else ImageFont.Layout.BASIC
+    return ImageFont.truetype(font_path, size, layout_engine=layout_engine)
+
+def read_roster(excel_path, **kwargs):
+    """Read the Excel roster, using the calamine engine when it is available."""
+    if EXCEL_ENGINE:
+        kwargs.setdefault('engine', EXCEL_ENGINE)
+    return pd.read_excel(excel_path, **kwargs)
+
+def read_roster_sheet(excel_path, sheet_name):
+    """Read one sheet of the roster workbook (run in a worker process for large workbooks)."""
+    return read_roster(excel_path, sheet_name=sheet_name)
+
+def normalize_heading(heading):
+    """Column heading reduced to lowercase letters and digits, for alias matching."""
+    return re.sub(r'[^a-z0-9]', '', str(heading).lower())
+
+def resolve_column_aliases(df, aliases=COLUMN_ALIASES):
+    """Rename a sheet's columns that use another heading for a roster column.
+
+    Returns:
+        tuple: (renamed DataFrame, {old heading: column} of the renames)
+    """
+    renames = {}
+    for column, alternatives in aliases.items():
+        if column in df.columns:
+            continue
+        wanted = {normalize_heading(heading) for heading in [column] + list(alternatives)}
+        for heading in df.columns:
+            if heading not in renames and normalize_heading(heading) in wanted:
+                renames[heading] = column
+                break
+    return df.rename(columns=renames), renames
+
+def read_roster_sheets(excel_path, sheets=None, aliases=None, log_callback=None):
+    """Read several sheets of a workbook concurrently and merge them into one roster.
+
+    Large workbooks are parsed one sheet per worker process (XLSX parsing is
+    CPU-bound). Each sheet's headings are resolved to the roster columns, a 'Sheet'
+    column records where each row came from, and the rows are merged in sheet order.
+
+    Args:
+        sheets (list): Sheet names in the order to merge them; None for every sheet
+        aliases (dict): Extra headings per roster column, added to COLUMN_ALIASES
+    """
+    log_callback = log_callback or (lambda x: None)
+    with pd.ExcelFile(excel_path, engine=EXCEL_ENGINE) as workbook:
+        available = workbook.sheet_names
+    missing = [name for name in sheets or [] if name not in available]
+    if missing:
+        raise ValueError(f"Sheet(s) not found in {os.path.basename(excel_path)}: {', '.join(missing)} "
+                         f"(available: {', '.join(available)})")
+    names = list(sheets or available)
+    merged_aliases = {column: list(alternatives) for column, alternatives in COLUMN_ALIASES.items()}
+    for column, alternatives in (aliases or {}).items():
+        merged_aliases.setdefault(column, []).extend(alternatives)
+
+    workers = min(len(names), os.cpu_count() or 1)
+    if workers > 1 and os.path.getsize(excel_path) >= SHEET_PROCESS_MIN_BYTES:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(read_roster_sheet, [excel_path] * len(names), names))
+    else:
+        frames = [read_roster_sheet(excel_path, name) for name in names]
+
+    merged = []
+    for name, df in zip(names, frames):
+        if df.empty:
+            log_callback(f"📄 Sheet '{name}': empty, skipped")
+            continue
+        df, renames = resolve_column_aliases(df, merged_aliases)
+        if renames:
+            log_callback(f"🔀 Sheet '{name}': reading " + ", ".join(f"'{old}' as {new}" for old, new in renames.items()))
+        log_callback(f"📄 Sheet '{name}': {len(df)} rows")
+        merged.append(df.assign(**{SHEET_COLUMN: name}))
+    if not merged:
+        return pd.DataFrame()
+    return pd.concat(merged, ignore_index=True, sort=False)
+
 class IDCardGeneratorGUI:
     def __init__(self, root):
         self.root = root
@@ -30,25 +490,69 @@ class IDCardGeneratorGUI:
         self.output_folder = tk.StringVar()
         self.font_path = tk.StringVar()
         self.font_size = tk.StringVar(value="20")
+        self.shaping_font_path = tk.StringVar()  # Font for Devanagari and other complex-script values
         
         # Template customization options
         self.photo_frame_style = tk.StringVar(value="circle")
         self.font_color = tk.StringVar(value="black")
         self.border_size = tk.StringVar(value="2")  # Default border size of 2 pixels
+        self.resampling_preset = tk.StringVar(value=DEFAULT_RESAMPLING_PRESET)
+
+        # Print output: colour mode, CMYK ICC profile and page file format
+        self.output_color_mode = tk.StringVar(value="rgb")
+        self.cmyk_profile_path = tk.StringVar()
+        self.page_format = tk.StringVar(value="pdf")
+        self.memory_budget = tk.StringVar()  # e.g. "2G"; empty for no limit
+        self.template_routing_path = tk.StringVar()  # Optional per-row template routing JSON
+        self.card_archive = tk.StringVar(value="none")  # Stream card images into a zip/tar archive
+        self.archive_group_column = tk.StringVar()
+        self.page_group_column = tk.StringVar()  # One PDF per value of this column
+        self.barcode_column = tk.StringVar()  # Column the barcode encodes; empty for EXT_ID
+        self.roster_sheets = tk.StringVar()  # "all" or sheet names to merge; empty for the first sheet
+        self.card_outputs = tk.StringVar()  # name:format:width[:quality] list; empty for no extra card images
+        self.sort_keys = tk.StringVar()  # Comma-separated columns to sort cards by; empty for roster order
+        self.page_break_column = tk.StringVar()  # Column whose change starts a new A4 page
         
         # Initialize preview variables
         self.preview_image = None
         self.current_coordinate = None
-        self.coordinate_labels = ["Photo", "QR Code", "Name", "Class", "Contact", "Address", "Guardian", "Validity", "Roll No.", "RegNo"]
+        self.coordinate_labels = ["Photo", "QR Code", "Barcode", "Name", "Class", "Contact", "Address", "Guardian", "Validity", "Roll No.", "RegNo"]
         self.current_label_index = 0
-        self.coordinates = {}
         self.scale_factor = 1.0
+
+        # Live card preview of a roster row, drawn under the draggable elements
+        self.live_preview = tk.BooleanVar(value=False)
+        self.preview_row = tk.StringVar(value="1")
+        self.preview_status = tk.StringVar()
+        self.card_preview = CardPreview(self.build_preview_generator)
+        self.preview_templates = LayoutCache(self.load_scaled_template, PREVIEW_TEMPLATE_CACHE_SIZE)
+        self.preview_template = None  # Canvas-sized template image
+        self.preview_image_item = None
+        self.preview_card_image = None
+        self.preview_overrides = {}  # Label -> coordinates of an element being dragged
+        self.preview_job = None
+        self.last_generator = None
+
+        # Double-sided cards: each side keeps its own coordinates; self.coordinates is the side being edited
+        self.back_template_path = tk.StringVar()
+        self.duplex_flip = tk.StringVar(value=DEFAULT_DUPLEX_FLIP)
+        self.editing_side = tk.StringVar(value="front")
+        self.side_coordinates = {'front': {}, 'back': {}}
+        self.coordinates = self.side_coordinates['front']
         
         # Initialize paths for QR codes
         self.qr_folder = tk.StringVar()
         
         # PDF Export Option
         self.export_as_pdf = tk.BooleanVar(value=False)
+
+        # Fuzzy filename matching for photos/QR codes not named by EXT_ID
+        self.fuzzy_matching = tk.BooleanVar(value=False)
+
+        # Selective reprint: only render matching rows
+        self.reprint_ids = tk.StringVar()
+        self.reprint_query = tk.StringVar()
+        self.reprint_rows = tk.StringVar()
         
         self.create_widgets()
         
@@ -191,8 +695,21 @@ class IDCardGeneratorGUI:
         left_panel = self.create_left_panel(main_container)
         left_panel.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(0, 20))
         
+        # The right panel (preview and coordinates) is built once the window is on screen
+        self.main_container = main_container
+        self.deferred_panels_scheduled = False
+        self.root.bind('<Map>', self.on_first_map, add='+')
+
+    def on_first_map(self, event):
+        """Build the deferred panels right after the main window is first shown."""
+        if event.widget is not self.root or self.deferred_panels_scheduled:
+            return
+        self.deferred_panels_scheduled = True
+        self.root.after_idle(self.create_deferred_panels)
+
+    def create_deferred_panels(self):
         # Create right panel (preview and coordinates)
-        right_panel = self.create_right_panel(main_container)
+        right_panel = self.create_right_panel(self.main_container)
         right_panel.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S))
         
     def create_left_panel(self, parent):
@@ -211,14 +728,16 @@ class IDCardGeneratorGUI:
         ttk.Button(file_section, text="Browse", command=self.browse_template, style='Dark.TButton').grid(row=0, column=2)
         
         # Photos folder selection
-        ttk.Label(file_section, text="Photos Folder:", style='Dark.TLabel').grid(row=1, column=0, sticky=tk.W, pady=8)
+        ttk.Label(file_section, text="Photos (Folder or ZIP):", style='Dark.TLabel').grid(row=1, column=0, sticky=tk.W, pady=8)
         ttk.Entry(file_section, textvariable=self.photos_folder, style='Dark.TEntry').grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
         ttk.Button(file_section, text="Browse", command=lambda: self.browse_folder(self.photos_folder), style='Dark.TButton').grid(row=1, column=2)
+        ttk.Button(file_section, text="ZIP", command=lambda: self.browse_file(self.photos_folder, [("ZIP archives", "*.zip")]), style='Dark.TButton').grid(row=1, column=3, padx=(5, 0))
         
         # QR codes folder selection
-        ttk.Label(file_section, text="QR Codes Folder:", style='Dark.TLabel').grid(row=2, column=0, sticky=tk.W, pady=8)
+        ttk.Label(file_section, text="QR Codes (Folder or ZIP):", style='Dark.TLabel').grid(row=2, column=0, sticky=tk.W, pady=8)
         ttk.Entry(file_section, textvariable=self.qr_folder, style='Dark.TEntry').grid(row=2, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
         ttk.Button(file_section, text="Browse", command=lambda: self.browse_folder(self.qr_folder), style='Dark.TButton').grid(row=2, column=2)
+        ttk.Button(file_section, text="ZIP", command=lambda: self.browse_file(self.qr_folder, [("ZIP archives", "*.zip")]), style='Dark.TButton').grid(row=2, column=3, padx=(5, 0))
         
         # Excel file selection
         ttk.Label(file_section, text="Excel File:", style='Dark.TLabel').grid(row=3, column=0, sticky=tk.W, pady=8)
@@ -233,6 +752,49 @@ class IDCardGeneratorGUI:
         # PDF Export Option
         pdf_export_checkbox = ttk.Checkbutton(file_section, text="Export as single PDF (A4 Landscape)", variable=self.export_as_pdf, style='Dark.TLabel') # Using Dark.TLabel style for text color
         pdf_export_checkbox.grid(row=5, column=0, columnspan=3, sticky=tk.W, pady=(10, 0))
+
+        fuzzy_checkbox = ttk.Checkbutton(file_section, text="Fuzzy-match photo/QR filenames (typos, student names)", variable=self.fuzzy_matching, style='Dark.TLabel')
+        fuzzy_checkbox.grid(row=6, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
+
+        # Back side template (optional) for double-sided cards
+        ttk.Label(file_section, text="Back Template (optional):", style='Dark.TLabel').grid(row=7, column=0, sticky=tk.W, pady=8)
+        ttk.Entry(file_section, textvariable=self.back_template_path, style='Dark.TEntry').grid(row=7, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+        ttk.Button(file_section, text="Browse", command=self.browse_back_template, style='Dark.TButton').grid(row=7, column=2)
+
+        ttk.Label(file_section, text="Duplex Flip Edge:", style='Dark.TLabel').grid(row=8, column=0, sticky=tk.W, pady=5)
+        ttk.Combobox(file_section, textvariable=self.duplex_flip, values=list(DUPLEX_FLIP_MODES), state="readonly").grid(row=8, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+
+        ttk.Label(file_section, text="Memory Budget (e.g. 2G):", style='Dark.TLabel').grid(row=9, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(file_section, textvariable=self.memory_budget, width=10, style='Dark.TEntry').grid(row=9, column=1, sticky=tk.W, padx=(10, 10))
+
+        # Per-row template routing (optional)
+        ttk.Label(file_section, text="Template Routing (JSON):", style='Dark.TLabel').grid(row=10, column=0, sticky=tk.W, pady=8)
+        ttk.Entry(file_section, textvariable=self.template_routing_path, style='Dark.TEntry').grid(row=10, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+        ttk.Button(file_section, text="Browse", command=lambda: self.browse_file(self.template_routing_path, [("JSON files", "*.json")]), style='Dark.TButton').grid(row=10, column=2)
+
+        # Per-card image archive (optional)
+        ttk.Label(file_section, text="Card Images Archive:", style='Dark.TLabel').grid(row=11, column=0, sticky=tk.W, pady=5)
+        ttk.Combobox(file_section, textvariable=self.card_archive, values=["none"] + list(CARD_ARCHIVE_FORMATS), state="readonly").grid(row=11, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+        ttk.Label(file_section, text="One Archive per Column:", style='Dark.TLabel').grid(row=12, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(file_section, textvariable=self.archive_group_column, style='Dark.TEntry').grid(row=12, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+
+        # One page file per group (optional)
+        ttk.Label(file_section, text="One PDF per Column:", style='Dark.TLabel').grid(row=13, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(file_section, textvariable=self.page_group_column, style='Dark.TEntry').grid(row=13, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+
+        # Multi-sheet workbooks (optional); "One PDF per Column: Sheet" splits the output per sheet
+        ttk.Label(file_section, text="Sheets ('all' or names):", style='Dark.TLabel').grid(row=14, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(file_section, textvariable=self.roster_sheets, style='Dark.TEntry').grid(row=14, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+
+        # Extra card images per size/format (optional), e.g. web:jpeg:600:85,thumb:jpeg:96
+        ttk.Label(file_section, text="Card Outputs:", style='Dark.TLabel').grid(row=15, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(file_section, textvariable=self.card_outputs, style='Dark.TEntry').grid(row=15, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+
+        # Render order (optional), e.g. Campus, Grade, Section, Name with a page break per Section
+        ttk.Label(file_section, text="Sort Cards By:", style='Dark.TLabel').grid(row=16, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(file_section, textvariable=self.sort_keys, style='Dark.TEntry').grid(row=16, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+        ttk.Label(file_section, text="New Page per Column:", style='Dark.TLabel').grid(row=17, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(file_section, textvariable=self.page_break_column, style='Dark.TEntry').grid(row=17, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
         
         # Font Configuration Section
         font_section = ttk.LabelFrame(left_frame, text="Font Configuration", style='Dark.TLabelframe', padding="15")
@@ -247,12 +809,18 @@ class IDCardGeneratorGUI:
         # Font sizes for different fields
         self.font_sizes = {}
         for i, label in enumerate(self.coordinate_labels):
-            if label not in ['Photo', 'QR Code']:  # Skip non-text elements
+            if label not in ['Photo', 'QR Code', 'Barcode']:  # Skip non-text elements
                 ttk.Label(font_section, text=f"{label} Font Size:", style='Dark.TLabel').grid(row=i+1, column=0, sticky=tk.W, pady=5)
                 size_var = tk.StringVar(value="20")  # Default size
                 self.font_sizes[label] = size_var
                 size_entry = ttk.Entry(font_section, textvariable=size_var, width=8, style='Dark.TEntry')
                 size_entry.grid(row=i+1, column=1, sticky=tk.W, padx=(10, 0))
+
+        # Font with glyphs for Devanagari/complex-script values (shaped with libraqm when available)
+        shaping_row = len(self.coordinate_labels) + 1
+        ttk.Label(font_section, text="Devanagari Font (optional):", style='Dark.TLabel').grid(row=shaping_row, column=0, sticky=tk.W, pady=8)
+        ttk.Entry(font_section, textvariable=self.shaping_font_path, style='Dark.TEntry').grid(row=shaping_row, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+        ttk.Button(font_section, text="Browse", command=lambda: self.browse_file(self.shaping_font_path, [("Font files", "*.ttf;*.otf")]), style='Dark.TButton').grid(row=shaping_row, column=2)
         
         # Template Customization Section
         template_section = ttk.LabelFrame(left_frame, text="Template Customization", style='Dark.TLabelframe', padding="15")
@@ -283,6 +851,26 @@ class IDCardGeneratorGUI:
         border_color_options = ["black", "blue", "red", "green", "white", "#235cca"]
         border_color_dropdown = ttk.Combobox(template_section, textvariable=self.border_color, values=border_color_options, state="readonly")
         border_color_dropdown.grid(row=3, column=1, columnspan=2, sticky=(tk.W, tk.E), padx=5)
+
+        # Resampling Quality Preset
+        ttk.Label(template_section, text="Quality Preset:", style='Dark.TLabel').grid(row=4, column=0, sticky=tk.W, pady=5)
+        preset_dropdown = ttk.Combobox(template_section, textvariable=self.resampling_preset, values=list(RESAMPLING_PRESETS), state="readonly")
+        preset_dropdown.grid(row=4, column=1, columnspan=2, sticky=(tk.W, tk.E), padx=5)
+
+        # Print output colour mode and format
+        ttk.Label(template_section, text="Output Colour:", style='Dark.TLabel').grid(row=5, column=0, sticky=tk.W, pady=5)
+        ttk.Combobox(template_section, textvariable=self.output_color_mode, values=list(OUTPUT_COLOR_MODES), state="readonly").grid(row=5, column=1, columnspan=2, sticky=(tk.W, tk.E), padx=5)
+
+        ttk.Label(template_section, text="CMYK ICC Profile:", style='Dark.TLabel').grid(row=6, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(template_section, textvariable=self.cmyk_profile_path, style='Dark.TEntry').grid(row=6, column=1, sticky=(tk.W, tk.E), padx=5)
+        ttk.Button(template_section, text="Browse", command=lambda: self.browse_file(self.cmyk_profile_path, [("ICC profiles", "*.icc *.icm")]), style='Dark.TButton').grid(row=6, column=2)
+
+        ttk.Label(template_section, text="Page Format:", style='Dark.TLabel').grid(row=7, column=0, sticky=tk.W, pady=5)
+        ttk.Combobox(template_section, textvariable=self.page_format, values=list(PAGE_FORMATS), state="readonly").grid(row=7, column=1, columnspan=2, sticky=(tk.W, tk.E), padx=5)
+
+        # Code 128 barcode, placed with the "Barcode" element
+        ttk.Label(template_section, text="Barcode Column:", style='Dark.TLabel').grid(row=8, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(template_section, textvariable=self.barcode_column, style='Dark.TEntry').grid(row=8, column=1, columnspan=2, sticky=(tk.W, tk.E), padx=5)
         
         # Configure style for combobox
         style = ttk.Style()
@@ -292,11 +880,29 @@ class IDCardGeneratorGUI:
                       foreground=self.colors['fg_primary'])
         color_dropdown.configure(style='TCombobox')
         
+        # Selective Reprint Section
+        reprint_section = ttk.LabelFrame(left_frame, text="Selective Reprint (optional)", style='Dark.TLabelframe', padding="15")
+        reprint_section.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+        reprint_section.columnconfigure(1, weight=1)
+
+        ttk.Label(reprint_section, text="EXT_IDs (comma-separated):", style='Dark.TLabel').grid(row=0, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(reprint_section, textvariable=self.reprint_ids, style='Dark.TEntry').grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(10, 0))
+
+        ttk.Label(reprint_section, text="Row filter (e.g. Grade == 10):", style='Dark.TLabel').grid(row=1, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(reprint_section, textvariable=self.reprint_query, style='Dark.TEntry').grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(10, 0))
+
+        ttk.Label(reprint_section, text="Rows (e.g. 1-50,75):", style='Dark.TLabel').grid(row=2, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(reprint_section, textvariable=self.reprint_rows, style='Dark.TEntry').grid(row=2, column=1, sticky=(tk.W, tk.E), padx=(10, 0))
+
         # Generate Button
         generate_frame = ttk.Frame(left_frame, style='Dark.TFrame')
         generate_frame.grid(row=4, column=0, columnspan=3, pady=20)
-        ttk.Button(generate_frame, text="🚀 Generate ID Cards", command=self.generate_cards, 
+        ttk.Button(generate_frame, text="🚀 Generate ID Cards", command=self.generate_cards,
                   style='Success.TButton', width=25).pack()
+        ttk.Button(generate_frame, text="🔍 Pre-flight Check", command=self.run_preflight_check,
+                  style='Dark.TButton', width=25).pack(pady=(10, 0))
+        ttk.Button(generate_frame, text="🖼️ Results Gallery", command=self.open_gallery,
+                  style='Dark.TButton', width=25).pack(pady=(10, 0))
         
         # Log Section
         log_section = ttk.LabelFrame(left_frame, text="Generation Log", style='Dark.TLabelframe', padding="15")
@@ -358,6 +964,28 @@ class IDCardGeneratorGUI:
         ttk.Button(coord_info_frame, text="Create Draggable Elements", 
                   command=self.create_draggable_elements,
                   style='Dark.TButton').grid(row=0, column=1)
+
+        # Which side of a double-sided card is being laid out
+        side_frame = ttk.Frame(coord_info_frame, style='Dark.TFrame')
+        side_frame.grid(row=1, column=0, columnspan=2, pady=(10, 0))
+        ttk.Label(side_frame, text="Editing side:", style='Dark.TLabel').pack(side=tk.LEFT, padx=(0, 10))
+        for text, value in (("Front", "front"), ("Back", "back")):
+            ttk.Radiobutton(side_frame, text=text, variable=self.editing_side, value=value,
+                           command=self.switch_editing_side, style='Dark.TRadiobutton').pack(side=tk.LEFT, padx=5)
+
+        # Live preview: render a real card from a roster row behind the elements
+        live_frame = ttk.Frame(coord_info_frame, style='Dark.TFrame')
+        live_frame.grid(row=2, column=0, columnspan=2, pady=(10, 0))
+        ttk.Checkbutton(live_frame, text="Live card preview, row:", variable=self.live_preview,
+                       command=self.toggle_live_preview, style='Dark.TLabel').pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Entry(live_frame, textvariable=self.preview_row, width=6, style='Dark.TEntry').pack(side=tk.LEFT)
+        ttk.Label(live_frame, textvariable=self.preview_status, style='Dark.TLabel').pack(side=tk.LEFT, padx=(10, 0))
+
+        # Re-render when a setting that changes the card is edited
+        preview_vars = [self.preview_row, self.font_path, self.font_color, self.photo_frame_style,
+                        self.border_size, self.border_color, self.barcode_column, *self.font_sizes.values()]
+        for var in preview_vars:
+            var.trace_add('write', lambda *args: self.schedule_preview_render())
         
         # Coordinates Section
         coord_section = ttk.LabelFrame(right_frame, text="Coordinate Management", style='Dark.TLabelframe', padding="15")
@@ -449,7 +1077,39 @@ class IDCardGeneratorGUI:
         )
         if filename:
             self.template_path.set(filename)
+            self.editing_side.set("front")
+            self.coordinates = self.side_coordinates['front']
             self.load_preview_image()
+
+    def browse_back_template(self):
+        filename = filedialog.askopenfilename(
+            title="Select Back Side Template",
+            filetypes=[("PNG files", "*.png"), ("All image files", "*.png *.jpg *.jpeg")]
+        )
+        if filename:
+            self.back_template_path.set(filename)
+            self.editing_side.set("back")
+            self.coordinates = self.side_coordinates['back']
+            self.load_preview_image()
+
+    def switch_editing_side(self):
+        """Show the template and coordinates of the side selected for editing."""
+        side = self.editing_side.get()
+        self.coordinates = self.side_coordinates[side]
+        self.draggable_items.clear()
+        if self.get_editing_template_path():
+            self.load_preview_image(reset_coordinates=False)
+        else:
+            self.preview_canvas.delete("all")
+            self.preview_image = None
+            self.log_message(f"⚠️ No {side} template selected yet.")
+        self.update_coordinates_display()
+
+    def get_editing_template_path(self):
+        """Template path of the side currently being edited."""
+        if self.editing_side.get() == "back":
+            return self.back_template_path.get()
+        return self.template_path.get()
     
     def browse_file(self, string_var, file_types):
         filename = filedialog.askopenfilename(filetypes=file_types)
@@ -461,38 +1121,112 @@ class IDCardGeneratorGUI:
         if folder:
             string_var.set(folder)
             
-    def load_preview_image(self):
-        if self.template_path.get():
+    def load_preview_image(self, reset_coordinates=True):
+        template_path = self.get_editing_template_path()
+        if template_path:
             try:
-                image = Image.open(self.template_path.get())
-                # Get original size
-                original_width, original_height = image.size
+                # Scaled once per template file and preset, then reused when switching sides
+                key = (template_path, os.stat(template_path).st_mtime_ns, self.resampling_preset.get())
+                self.preview_template, self.scale_factor = self.preview_templates.get(key)
                 
-                # Calculate scale factor to fit in canvas
                 canvas_width = 400
                 canvas_height = 500
-                width_scale = canvas_width / original_width
-                height_scale = canvas_height / original_height
-                self.scale_factor = min(width_scale, height_scale)
-                
-                # Resize image
-                new_width = int(original_width * self.scale_factor)
-                new_height = int(original_height * self.scale_factor)
-                resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                self.preview_image = ImageTk.PhotoImage(resized_image)
+                self.preview_image = ImageTk.PhotoImage(self.preview_template)
                 self.preview_canvas.delete("all")
-                self.preview_canvas.create_image(canvas_width//2, canvas_height//2, image=self.preview_image)
+                self.preview_image_item = self.preview_canvas.create_image(canvas_width//2, canvas_height//2, image=self.preview_image)
                 
-                # Reset coordinates
-                self.coordinates = {}
-                self.current_label_index = 0
-                self.coordinates_text.delete(1.0, tk.END)
+                # Reset coordinates of the side being edited
+                if reset_coordinates:
+                    self.coordinates.clear()
+                    self.current_label_index = 0
+                    self.coordinates_text.delete(1.0, tk.END)
                 
-                self.log_message(f"✅ Template loaded: {os.path.basename(self.template_path.get())}")
+                self.log_message(f"✅ {self.editing_side.get().title()} template loaded: {os.path.basename(template_path)}")
+                self.schedule_preview_render()
             except Exception as e:
                 messagebox.showerror("Error", f"Error loading template: {str(e)}")
                 self.log_message(f"❌ Error loading template: {str(e)}")
+
+    def load_scaled_template(self, key):
+        """Scale a template to fit the 400x500 preview canvas; returns (image, scale factor)."""
+        template_path, _, preset = key
+        with Image.open(template_path) as image:
+            original_width, original_height = image.size
+            scale_factor = min(400 / original_width, 500 / original_height)
+            new_size = (int(original_width * scale_factor), int(original_height * scale_factor))
+            return resize_for_stage(image, new_size, 'preview', preset), scale_factor
+
+    def build_preview_generator(self):
+        """Create a quiet IDCardGenerator with only the settings that change how a card looks."""
+        return IDCardGenerator(
+            template_path=self.template_path.get(),
+            photos_folder=self.photos_folder.get(),
+            qr_folder=self.qr_folder.get(),
+            excel_path=self.excel_path.get(),
+            output_folder=self.output_folder.get(),
+            coordinates=self.side_coordinates['front'],
+            log_callback=lambda message: None,
+            photo_frame_style=self.photo_frame_style.get(),
+            font_color=self.font_color.get(),
+            border_size=int(self.border_size.get()),
+            border_color=self.border_color.get(),
+            resampling_preset=self.resampling_preset.get(),
+            back_template_path=self.back_template_path.get() or None,
+            back_coordinates=self.side_coordinates['back'],
+            barcode_column=self.barcode_column.get().strip() or None,
+            sheets=parse_sheet_list(self.roster_sheets.get()),
+            shaping_font=self.shaping_font_path.get() or None,
+            fuzzy_matching=self.fuzzy_matching.get()
+        )
+
+    def get_preview_job_key(self):
+        """Settings the preview generator is built from; a change rebuilds it."""
+        excel_path = self.excel_path.get()
+        excel_mtime = os.path.getmtime(excel_path) if os.path.exists(excel_path) else None
+        return (self.template_path.get(), self.back_template_path.get(), self.photos_folder.get(), self.qr_folder.get(),
+                excel_path, excel_mtime, self.font_path.get(), self.photo_frame_style.get(), self.font_color.get(),
+                self.border_size.get(), self.border_color.get(), self.resampling_preset.get(), self.fuzzy_matching.get(),
+                self.barcode_column.get(), self.roster_sheets.get(), self.shaping_font_path.get())
+
+    def toggle_live_preview(self):
+        """Show the rendered card, or go back to the bare template."""
+        if self.live_preview.get():
+            self.schedule_preview_render()
+        elif self.preview_image_item is not None:
+            self.preview_canvas.itemconfig(self.preview_image_item, image=self.preview_image)
+            self.preview_status.set("")
+
+    def schedule_preview_render(self):
+        """Re-render the live preview once edits pause for PREVIEW_DEBOUNCE_MS."""
+        if not self.live_preview.get():
+            return
+        if self.preview_job is not None:
+            self.root.after_cancel(self.preview_job)
+        self.preview_job = self.root.after(PREVIEW_DEBOUNCE_MS, self.render_live_preview)
+
+    def render_live_preview(self):
+        """Render the chosen roster row's card behind the draggable elements."""
+        self.preview_job = None
+        if not self.live_preview.get() or self.preview_image_item is None:
+            return
+        if not self.template_path.get() or not self.excel_path.get():
+            self.preview_status.set("⚠️ Select a template and Excel file")
+            return
+
+        coordinates = dict(self.coordinates)
+        coordinates.update(self.preview_overrides)
+        font_sizes = {field: size_var.get() for field, size_var in self.font_sizes.items()}
+        try:
+            row_number = int(self.preview_row.get())
+            self.card_preview.prepare(self.get_preview_job_key(), self.font_path.get(), font_sizes)
+            card = self.card_preview.render(row_number, self.editing_side.get(), coordinates, self.preview_template.size)
+        except Exception as e:
+            self.preview_status.set(f"⚠️ {str(e)}")
+            return
+
+        self.preview_card_image = ImageTk.PhotoImage(card)
+        self.preview_canvas.itemconfig(self.preview_image_item, image=self.preview_card_image)
+        self.preview_status.set(f"Row {row_number} ({self.card_preview.last_render_ms:.0f} ms)")
     
     def create_draggable_elements(self):
         """Create draggable elements for each coordinate label."""
@@ -517,6 +1251,8 @@ class IDCardGeneratorGUI:
                 fill_color = 'blue' # Color for Photo
             elif label == "QR Code":
                 fill_color = self.colors['success'] # Color for QR Code
+            elif label == "Barcode":
+                fill_color = self.colors['warning'] # Color for Barcode
 
             # Create the circle
             circle = self.preview_canvas.create_oval(x-15, y-15, x+15, y+15,
@@ -611,6 +1347,10 @@ class IDCardGeneratorGUI:
         # Move text
         self.preview_canvas.coords(text, new_x, new_y)
 
+        # Re-render the live preview with the element where it is being dragged
+        if self.live_preview.get() and self.preview_image:
+            self.preview_overrides = {label: self.canvas_to_template(new_x, new_y)}
+            self.schedule_preview_render()
 
     def on_drag_stop(self, event):
         """Handle the end of a drag operation."""
@@ -633,50 +1373,13 @@ class IDCardGeneratorGUI:
         final_canvas_x = (bbox[0] + bbox[2]) / 2
         final_canvas_y = (bbox[1] + bbox[3]) / 2
 
-        # Get the image position on the canvas. Assuming the image is centered,
-        # its top-left corner is at (canvas_width//2 - image_width//2, canvas_height//2 - image_height//2).
-        # However, since we scaled the image to fit, we need the *scaled* image dimensions.
-        # The image is created with its center at (canvas_width//2, canvas_height//2).
-        # So, the image origin on canvas is (canvas_width//2 - new_width//2, canvas_height//2 - new_height//2)
-        # Where new_width = original_width * scale_factor, new_height = original_height * scale_factor
-
-        # Let's calculate the image origin on the canvas
-        canvas_width = self.preview_canvas.winfo_width() # Use current canvas size
-        canvas_height = self.preview_canvas.winfo_height()
-
         if not self.preview_image:
              # Should not happen if template was loaded
              self.log_message("❌ Preview image not loaded on drag stop.")
              self.drag_data = {"item": None, "label": None, "start_x": 0, "start_y": 0, "item_start_x": 0, "item_start_y": 0} # Reset drag data
              return
 
-        # Get the *displayed* image dimensions from the PhotoImage
-        # Note: PhotoImage.width() and height() give the displayed size
-        displayed_image_width = self.preview_image.width()
-        displayed_image_height = self.preview_image.height()
-
-        # Calculate the top-left corner of the centered image on the canvas
-        image_canvas_origin_x = (canvas_width // 2) - (displayed_image_width // 2)
-        image_canvas_origin_y = (canvas_height // 2) - (displayed_image_height // 2)
-
-        # Calculate the coordinate relative to the image origin on the canvas
-        relative_image_x = final_canvas_x - image_canvas_origin_x
-        relative_image_y = final_canvas_y - image_canvas_origin_y
-
-        # Scale the relative image coordinate back to the original image size
-        if self.scale_factor > 0: # Avoid division by zero
-             actual_x = int(relative_image_x / self.scale_factor)
-             actual_y = int(relative_image_y / self.scale_factor)
-        else:
-             # Fallback if scale_factor is not valid
-             actual_x = int(final_canvas_x) # Use canvas coordinate if scaling fails
-             actual_y = int(final_canvas_y)
-             self.log_message("⚠️ Invalid scale factor on drag stop. Using canvas coordinates.")
-
-
-        # Ensure coordinates are non-negative
-        actual_x = max(0, actual_x)
-        actual_y = max(0, actual_y)
+        actual_x, actual_y = self.canvas_to_template(final_canvas_x, final_canvas_y)
 
         # Store the coordinates
         self.coordinates[label] = (actual_x, actual_y)
@@ -706,12 +1409,14 @@ class IDCardGeneratorGUI:
                  fill_color = 'blue' # Color for Photo
             elif label == "QR Code":
                  fill_color = self.colors['success'] # Use success color for QR
+            elif label == "Barcode":
+                 fill_color = self.colors['warning'] # Use warning color for Barcode
 
-            if label != "Photo" and label != "QR Code":
+            if label not in ("Photo", "QR Code", "Barcode"):
                  # For text labels, use the secondary foreground color
                  reset_color = self.colors['fg_secondary']
             else:
-                 # For Photo and QR Code, use their specific colors
+                 # For Photo, QR Code and Barcode, use their specific colors
                  reset_color = fill_color # Use the fill_color determined earlier
 
             self.preview_canvas.itemconfig(circle_item, fill=reset_color) # Reset to original color
@@ -721,6 +1426,22 @@ class IDCardGeneratorGUI:
         self.drag_data = {"item": None, "label": None, "start_x": 0, "start_y": 0, "item_start_x": 0, "item_start_y": 0}
 
         self.log_message(f"📍 Set {label} coordinate: ({actual_x}, {actual_y})")
+        self.preview_overrides = {}
+        self.schedule_preview_render()
+
+    def canvas_to_template(self, canvas_x, canvas_y):
+        """Convert a position on the canvas to (non-negative) template coordinates.
+
+        The scaled template is centred on the canvas, so the position is taken
+        relative to the image's top-left corner and scaled back to template pixels.
+        """
+        if self.scale_factor <= 0:
+            self.log_message("⚠️ Invalid scale factor. Using canvas coordinates.")
+            return max(0, int(canvas_x)), max(0, int(canvas_y))
+        image_origin_x = self.preview_canvas.winfo_width() // 2 - self.preview_image.width() // 2
+        image_origin_y = self.preview_canvas.winfo_height() // 2 - self.preview_image.height() // 2
+        return (max(0, int((canvas_x - image_origin_x) / self.scale_factor)),
+                max(0, int((canvas_y - image_origin_y) / self.scale_factor)))
 
     def move_draggable_element(self, label, x, y):
         """Move a draggable element to the specified position."""
@@ -776,6 +1497,7 @@ class IDCardGeneratorGUI:
 
             # Clear previous points drawn by manual entry (if any)
             self.preview_canvas.delete(f"point_{label}")
+            self.schedule_preview_render()
 
             # Optional: Draw a temporary visual cue at the location set by manual input on the canvas
             # This might be confusing with the draggable elements now also moving, so let's skip for now.
@@ -812,8 +1534,8 @@ class IDCardGeneratorGUI:
         self.log_text.see(tk.END)
         self.root.update()
         
-    def generate_cards(self):
-        # Validate inputs
+    def validate_inputs(self):
+        """Check that all required paths and coordinates are set. Returns True if valid."""
         required_fields = [
             (self.template_path.get(), "ID Card Template"),
             (self.photos_folder.get(), "Photos Folder"),
@@ -829,41 +1551,117 @@ class IDCardGeneratorGUI:
             messagebox.showerror("Missing Required Fields", 
                                f"Please select the following required fields:\n\n• {missing_text}")
             self.log_message(f"❌ Missing required fields: {', '.join(missing_fields)}")
-            return
-        
-        if not self.coordinates:
-            messagebox.showerror("Missing Coordinates", 
+            return False
+
+        if not self.side_coordinates['front']:
+            messagebox.showerror("Missing Coordinates",
                                "Please set coordinates for all elements by clicking on the template preview or using manual input.")
             self.log_message("❌ No coordinates set")
+            return False
+        return True
+
+    def build_generator(self):
+        """Create an IDCardGenerator from the current GUI settings."""
+        generator = IDCardGenerator(
+            template_path=self.template_path.get(),
+            photos_folder=self.photos_folder.get(),
+            qr_folder=self.qr_folder.get(),
+            excel_path=self.excel_path.get(),
+            output_folder=self.output_folder.get(),
+            coordinates=self.side_coordinates['front'],
+            log_callback=self.log_message,
+            export_as_pdf_var=self.export_as_pdf,
+            photo_frame_style=self.photo_frame_style.get(),
+            font_color=self.font_color.get(),
+            border_size=int(self.border_size.get()),
+            border_color=self.border_color.get(),
+            resampling_preset=self.resampling_preset.get(),
+            back_template_path=self.back_template_path.get() or None,
+            back_coordinates=self.side_coordinates['back'],
+            duplex_flip=self.duplex_flip.get(),
+            color_mode=self.output_color_mode.get(),
+            cmyk_profile=self.cmyk_profile_path.get() or None,
+            page_format=self.page_format.get(),
+            max_memory=parse_byte_size(self.memory_budget.get()) if self.memory_budget.get().strip() else None,
+            template_routes=load_template_routing(self.template_routing_path.get()) if self.template_routing_path.get() else None,
+            card_archive=None if self.card_archive.get() == "none" else self.card_archive.get(),
+            archive_group_column=self.archive_group_column.get().strip() or None,
+            page_group_column=self.page_group_column.get().strip() or None,
+            barcode_column=self.barcode_column.get().strip() or None,
+            thumbnails=True,
+            sheets=parse_sheet_list(self.roster_sheets.get()),
+            card_outputs=parse_output_specs(self.card_outputs.get()) if self.card_outputs.get().strip() else None,
+            sort_keys=parse_column_list(self.sort_keys.get()),
+            page_break_column=self.page_break_column.get().strip() or None,
+            shaping_font=self.shaping_font_path.get() or None,
+            fuzzy_matching=self.fuzzy_matching.get(),
+            selection=RowSelection(
+                ids=self.reprint_ids.get().split(',') if self.reprint_ids.get().strip() else None,
+                query=self.reprint_query.get(),
+                rows=self.reprint_rows.get()
+            )
+        )
+
+        # Set custom font if provided
+        if self.font_path.get():
+            try:
+                # Pass font sizes dictionary to the generator
+                generator.set_font(self.font_path.get(), self.font_sizes)
+            except Exception as e:
+                self.log_message(f"⚠️ Error setting font: {str(e)}")
+        return generator
+
+    def run_preflight_check(self):
+        """Run a dry-run scan of the job and write a JSON report to the output folder."""
+        if not self.validate_inputs():
             return
-            
+        try:
+            self.log_message("🔍 Starting pre-flight check (dry run, no cards rendered)...")
+            generator = self.build_generator()
+            report_path = os.path.join(self.output_folder.get(), "preflight_report.json")
+            report = generator.preflight_scan(report_path)
+            summary = report['summary']
+            summary_msg = (f"Rows scanned: {summary['rows_scanned']}\n"
+                           f"Rows with issues: {summary['rows_with_issues']}\n"
+                           f"Asset issues: {summary['asset_issues']}\n\n"
+                           f"Report: {report_path}")
+            if summary['rows_with_issues'] or summary['asset_issues']:
+                messagebox.showwarning("Pre-flight Check", summary_msg)
+            else:
+                messagebox.showinfo("Pre-flight Check", summary_msg)
+        except Exception as e:
+            error_msg = f"Pre-flight check failed: {str(e)}"
+            messagebox.showerror("Error", error_msg)
+            self.log_message(f"❌ {error_msg}")
+
+    def open_gallery(self):
+        """Show the thumbnails of the last run in the output folder."""
+        folder = os.path.join(self.output_folder.get(), THUMBNAIL_FOLDER)
+        if not self.output_folder.get() or not ThumbnailCache.load(folder):
+            messagebox.showwarning("Results Gallery", "No card thumbnails in the output folder yet. Generate the cards first.")
+            return
+        CardGallery(self.root, self.colors, folder, self.render_gallery_card)
+
+    def render_gallery_card(self, ext_id):
+        """Re-render a card picked in the gallery with the last run's settings."""
+        if self.last_generator is None:
+            if not self.validate_inputs():
+                raise ValueError("Set up the job to re-render cards from an earlier session")
+            self.last_generator = self.build_generator()
+        self.log_message(f"🔎 Re-rendering card {ext_id}")
+        return self.last_generator.render_card_by_id(ext_id)
+
+    def generate_cards(self):
+        if not self.validate_inputs():
+            return
+
         try:
             self.log_message("🚀 Starting ID card generation...")
-            
+
             # Create generator instance
-            generator = IDCardGenerator(
-                template_path=self.template_path.get(),
-                photos_folder=self.photos_folder.get(),
-                qr_folder=self.qr_folder.get(),
-                excel_path=self.excel_path.get(),
-                output_folder=self.output_folder.get(),
-                coordinates=self.coordinates,
-                log_callback=self.log_message,
-                export_as_pdf_var=self.export_as_pdf,
-                photo_frame_style=self.photo_frame_style.get(),
-                font_color=self.font_color.get(),
-                border_size=int(self.border_size.get()),
-                border_color=self.border_color.get()
-            )
-            
-            # Set custom font if provided
-            if self.font_path.get():
-                try:
-                    # Pass font sizes dictionary to the generator
-                    generator.set_font(self.font_path.get(), self.font_sizes)
-                except Exception as e:
-                    self.log_message(f"⚠️ Error setting font: {str(e)}")
-            
+            generator = self.build_generator()
+            self.last_generator = generator  # Re-renders cards picked in the results gallery
+
             # Generate cards
             generator.generate_all_id_cards()
             
@@ -876,110 +1674,2514 @@ class IDCardGeneratorGUI:
             messagebox.showerror("Error", error_msg)
             self.log_message(f"❌ {error_msg}")
 
-class IDCardGenerator:
-    def __init__(self, template_path, photos_folder, qr_folder, excel_path, output_folder, coordinates=None, photo_size=(230, 230), qr_size=(120, 120), log_callback=None, export_as_pdf_var=None, photo_frame_style="circle", font_color="black", border_size=2, border_color="blue"):
-        """
-        Initialize the ID Card Generator.
-        
-        Args:
-            template_path (str): Path to the ID card template PNG
-            photos_folder (str): Path to folder containing student photos
-            qr_folder (str): Path to folder containing QR code images
-            excel_path (str): Path to Excel file with student details
-            output_folder (str): Path to save generated ID cards
-            coordinates (dict): Dictionary of coordinates for text and photo placement
-            photo_size (tuple): Size of the photo (width, height)
-            qr_size (tuple): Size of the QR code (width, height)
-            log_callback (callable): Function to call for logging messages
-            photo_frame_style (str): Style of photo frame ("circle" or "square")
-            font_color (str): Color of the text
-            border_size (int): Size of the photo border in pixels
-            border_color (str): Color of the photo border
-        """
-        self.template_path = template_path
-        self.photos_folder = photos_folder
-        self.qr_folder = qr_folder
-        self.excel_path = excel_path
-        self.output_folder = output_folder
-        self.log_callback = log_callback or (lambda x: None)
-        self.export_as_pdf_var = export_as_pdf_var
-        self.photo_frame_style = photo_frame_style
-        self.font_color = font_color
-        self.border_size = border_size
-        self.border_color = border_color
-        
-        # Create output folder if it doesn't exist
-        os.makedirs(output_folder, exist_ok=True)
-        
-        # Load template and get its dimensions
-        self.template = Image.open(template_path)
-        self.template_width, self.template_height = self.template.size
-        
-        # Use provided coordinates or defaults
-        self.text_coordinates = {}
-        self.photo_coordinates = coordinates.get('Photo', (293, 270))  # default
-        self.qr_coordinates = coordinates.get('QR Code', (50, 50))  # default
-        self.photo_size = photo_size
-        self.qr_size = qr_size
-        
-        if coordinates:
-            # Set photo and QR coordinates
-            if 'Photo' in coordinates:
-                self.photo_coordinates = coordinates['Photo']
-            if 'QR Code' in coordinates:
-                self.qr_coordinates = coordinates['QR Code']
-            
-            # Set text coordinates
-            for key in ['Name', 'Class', 'Contact', 'Address', 'Guardian', 'Validity', 'Roll No.', 'RegNo']:
-                if key in coordinates:
-                    self.text_coordinates[key] = coordinates[key]
+class CardGallery:
+    """Results gallery window: a virtualized grid of card thumbnails.
 
-        # Mapping from card labels to Excel column names (case-insensitive matching will be used)
-        # Map the label on the card to the likely column name in your Excel file.
-        # Note: The keys in this dictionary are the labels shown on the card/GUI,
-        # and the values are the corresponding column names in the Excel file.
-        # For fields like Roll No. and RegNo, we provide a list of possible column names to handle variations.
-        self.label_to_excel_column_map = {
-            'Name': 'Name',
-            'Class': 'Grade', # Map Class label on card to Grade column in Excel
-            'Contact': 'PhoneNumber', # Map Contact label on card to PhoneNumber column in Excel
-            'Address': 'Address',
-            'Guardian': 'Guardian',
-            'Validity': 'Validity',
-            'Roll No.': ['Roll No.', 'Roll No', 'RollNo', 'Roll Number', 'RollNumber'], # Multiple possible column names for Roll No.
-            'RegNo': ['RegNo', 'Reg No', 'Reg-No', 'Registration No', 'RegistrationNo'] # Added multiple possible column names for RegNo
-        }
-        
-        # Initialize font variables
-        self.font_path = None
-        self.fonts = {}  # Dictionary to store fonts for different fields
-        self.default_font = ImageFont.load_default()
+    Only the cells in view have canvas items, and their thumbnails are decoded as
+    they scroll into view into a small LRU of PhotoImages, so a run of tens of
+    thousands of cards scrolls like a run of ten. Clicking a thumbnail re-renders
+    that card at full size.
+    """
 
-    def set_font(self, font_path, font_sizes):
-        """Set custom fonts for different text fields.
+    CELL_PADDING = 8
+    CAPTION_HEIGHT = 16
 
-        Args:
-            font_path (str): Path to the .ttf or .otf font file
-            font_sizes (dict): Dictionary mapping field names to font sizes
-        """
+    def __init__(self, parent, colors, folder, render_card):
+        self.folder = folder
+        self.entries = ThumbnailCache.load(folder)
+        self.render_card = render_card  # EXT_ID -> (front, back) at full size
+        self.colors = colors
+        self.images = OrderedDict()  # Entry index -> PhotoImage, least recently shown first
+        self.visible = {}  # Entry index -> canvas items of its cell
+        self.cell_width = THUMBNAIL_SIZE[0] + 2 * self.CELL_PADDING
+        self.cell_height = THUMBNAIL_SIZE[1] + self.CAPTION_HEIGHT + 2 * self.CELL_PADDING
+        self.columns = 0
+
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"Results Gallery - {len(self.entries)} cards")
+        self.window.geometry("900x700")
+        self.window.configure(bg=colors['bg_primary'])
+        self.canvas = tk.Canvas(self.window, bg=colors['bg_secondary'], highlightthickness=0,
+                                yscrollincrement=self.cell_height // 4)
+        scrollbar = ttk.Scrollbar(self.window, orient="vertical", command=self.on_scroll)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", self.on_resize)
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", lambda event: self.on_scroll('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.canvas.bind("<Button-4>", lambda event: self.on_scroll('scroll', -1, 'units'))  # X11 wheel
+        self.canvas.bind("<Button-5>", lambda event: self.on_scroll('scroll', 1, 'units'))
+
+    def on_resize(self, event):
+        """Re-flow the grid when the number of columns changes."""
+        columns = max(1, event.width // self.cell_width)
+        if columns != self.columns:
+            self.columns = columns
+            self.canvas.delete("all")
+            self.visible.clear()
+            rows = -(-len(self.entries) // columns)
+            self.canvas.configure(scrollregion=(0, 0, columns * self.cell_width, rows * self.cell_height))
+        self.refresh()
+
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def refresh(self):
+        """Draw the cells in view and drop the ones that scrolled out."""
+        if not self.columns:
+            return
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first = int(top // self.cell_height) * self.columns
+        last = min(len(self.entries), (int(bottom // self.cell_height) + 1) * self.columns)
+        for index in [index for index in self.visible if not first <= index < last]:
+            for item in self.visible.pop(index):
+                self.canvas.delete(item)
+        for index in range(first, last):
+            if index not in self.visible:
+                self.visible[index] = self.draw_cell(index)
+
+    def draw_cell(self, index):
+        row, column = divmod(index, self.columns)
+        x = column * self.cell_width + self.cell_width // 2
+        y = row * self.cell_height + self.CELL_PADDING
+        image = self.get_image(index)
+        if image is not None:
+            picture = self.canvas.create_image(x, y, image=image, anchor=tk.N)
+        else:
+            picture = self.canvas.create_rectangle(x - THUMBNAIL_SIZE[0] // 2, y, x + THUMBNAIL_SIZE[0] // 2, y + THUMBNAIL_SIZE[1],
+                                                   outline=self.colors['error'])
+        caption = self.canvas.create_text(x, y + THUMBNAIL_SIZE[1] + 2, text=self.entries[index]['ext_id'], anchor=tk.N,
+                                          fill=self.colors['fg_secondary'], font=('Segoe UI', 8))
+        return picture, caption
+
+    def get_image(self, index):
+        """Decode a thumbnail, keeping recently shown ones; None if it cannot be read."""
+        image = self.images.pop(index, None)
+        if image is None:
+            try:
+                with Image.open(os.path.join(self.folder, self.entries[index]['file'])) as thumbnail:
+                    image = ImageTk.PhotoImage(thumbnail)
+            except OSError:
+                return None
+        self.images[index] = image
+        if len(self.images) > GALLERY_IMAGE_CACHE_SIZE:
+            # Evict the least recently shown thumbnail that is not on screen
+            stale = next((key for key in self.images if key not in self.visible and key != index), None)
+            if stale is not None:
+                del self.images[stale]
+        return image
+
+    def on_click(self, event):
+        column = int(self.canvas.canvasx(event.x) // self.cell_width)
+        index = int(self.canvas.canvasy(event.y) // self.cell_height) * self.columns + column
+        if column < self.columns and 0 <= index < len(self.entries):
+            self.open_card(self.entries[index]['ext_id'])
+
+    def open_card(self, ext_id):
+        """Re-render a card and show it (both sides) at full size, scaled down only to fit the screen."""
         try:
-            self.font_path = font_path
-            # Create font objects for each field with their respective sizes
-            for field, size_var in font_sizes.items():
-                try:
-                    size = int(size_var.get())
-                    self.fonts[field] = ImageFont.truetype(font_path, size)
-                    self.log_callback(f"✅ Set font size {size} for {field}")
-                except ValueError:
-                    self.log_callback(f"⚠️ Invalid font size for {field}, using default size")
-                    self.fonts[field] = ImageFont.truetype(font_path, 20)
+            front, back = self.render_card(ext_id)
         except Exception as e:
-            self.log_callback(f"⚠️ Error loading font {font_path}: {str(e)}. Using default font.")
-            self.fonts = {field: self.default_font for field in font_sizes.keys()}
+            messagebox.showerror("Results Gallery", f"Could not re-render card {ext_id}: {str(e)}", parent=self.window)
+            return
+        if front is None:
+            messagebox.showerror("Results Gallery", f"Card {ext_id} could not be rendered; see the log.", parent=self.window)
+            return
 
-    def get_font_for_field(self, field):
-        """Get the appropriate font for a given field."""
-        return self.fonts.get(field, self.default_font)
+        window = tk.Toplevel(self.window)
+        window.title(f"Card {ext_id}")
+        window.configure(bg=self.colors['bg_primary'])
+        window.images = []  # Keep the PhotoImages alive with the window
+        max_height = self.window.winfo_screenheight() - 150
+        for side in (front, back):
+            if side is None:
+                continue
+            if side.height > max_height:
+                side = resize_for_stage(side, (side.width * max_height // side.height, max_height), 'preview', 'proof')
+            window.images.append(ImageTk.PhotoImage(side))
+            tk.Label(window, image=window.images[-1], bg=self.colors['bg_primary']).pack(side=tk.LEFT, padx=10, pady=10)
+
+class MemoryViewReader(io.RawIOBase):
+    """Seekable file over a memoryview, so Image.open can decode a mapped archive member without copying it first."""
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), len(self.view) - self.position))
+        buffer[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+class AssetIndex:
+    """Index of the image files in a photos/QR folder, built from a single directory scan.
+
+    Lookups match an EXT_ID against filenames the same way the per-row search did
+    (case-insensitive substring), but without listing the folder for every row.
+
+    The source may also be a ZIP archive. Its members are indexed by file name from
+    the central directory (subfolders are flattened) and images are decoded straight
+    from the archive, so nothing is extracted to disk. Their paths are virtual,
+    <archive>/<name>, and must be opened through open_image.
+    """
+
+    def __init__(self, folder):
+        """
+        Args:
+            folder (str): Folder or ZIP archive containing photo or QR code images
+        """
+        self.folder = folder
+        self.archive = None  # Open ZipFile when the source is an archive
+        self.members = {}  # Virtual path -> ZipInfo, for archives
+        self._mmap = None
+        self.folder_exists = bool(folder) and (os.path.isdir(folder) or self.is_archive(folder))
+        self.filenames = []  # Image filenames in directory order
+        self.tokens = {}  # Lowercased stem/token -> list of filename indexes
+        self._blob = ""  # All lowercased filenames joined by newlines, for substring fallback
+        self._offsets = []  # Start offset of each filename in the blob
+        self._fuzzy_matcher = None
+        self.fuzzy_plan = None  # EXT_ID -> FuzzyMatch, set by plan_fuzzy_matches
+
+        if not self.folder_exists:
+            return
+
+        lowered = []
+        for filename in self._open_archive() if os.path.isfile(folder) else os.listdir(folder):
+            lower = filename.lower()
+            if not lower.endswith(IMAGE_EXTENSIONS):
+                continue
+            file_index = len(self.filenames)
+            self.filenames.append(filename)
+            lowered.append(lower)
+
+            # Index the whole stem plus its separator-delimited parts so that
+            # "1001.jpg", "1001_john.png" and "john-1001.jpg" all resolve by token
+            stem = os.path.splitext(lower)[0]
+            keys = {stem}
+            keys.update(part for part in re.split(r'[\s_]+', stem) if part)
+            keys.update(part for part in re.split(r'[\s_.\-]+', stem) if part)
+            for key in keys:
+                self.tokens.setdefault(key, []).append(file_index)
+
+        offset = 0
+        for lower in lowered:
+            self._offsets.append(offset)
+            offset += len(lower) + 1
+        self._blob = "\n".join(lowered)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getstate__(self):
+        # Render workers get the index without its open archive and reopen it on arrival
+        state = self.__dict__.copy()
+        state.update(archive=None, _mmap=None, _fuzzy_matcher=None, reopen_archive=self.archive is not None)
+        return state
+
+    def __setstate__(self, state):
+        reopen_archive = state.pop('reopen_archive')
+        self.__dict__.update(state)
+        if reopen_archive:
+            self._open_archive()
+
+    @staticmethod
+    def is_archive(path):
+        return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+    def _open_archive(self):
+        """Read the archive's central directory; returns the member file names."""
+        self.archive = zipfile.ZipFile(self.folder)
+        try:
+            with open(self.folder, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._mmap = None  # Not mappable; members are read through the ZipFile
+        names = []
+        for info in self.archive.infolist():
+            filename = info.filename.rsplit('/', 1)[-1]
+            # Skip folders and the resource forks macOS adds to archives
+            if info.is_dir() or info.filename.startswith('__MACOSX/') or filename.startswith('._'):
+                continue
+            self.members.setdefault(self.path(filename), info)
+            names.append(filename)
+        return names
+
+    def path(self, filename):
+        """Return the full path of an indexed filename (a virtual path inside an archive)."""
+        return os.path.join(self.folder, filename)
+
+    def exists(self, path):
+        if self.archive is not None:
+            return path in self.members
+        return os.path.exists(path)
+
+    def getsize(self, path):
+        if self.archive is not None:
+            return self.members[path].file_size
+        return os.path.getsize(path)
+
+    def signature(self, path):
+        """Changes whenever the file does: (size, mtime) on disk, (size, CRC) in an archive."""
+        if self.archive is not None:
+            info = self.members[path]
+            return (info.file_size, info.CRC)
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def source_file(self, path):
+        """The file on disk holding an indexed path: the archive for archive members."""
+        return self.folder if self.archive is not None else path
+
+    def open_image(self, path):
+        """Open an indexed image lazily, like Image.open."""
+        if self.archive is None:
+            return Image.open(path)
+        info = self.members[path]
+        data = None
+        if self._mmap is not None and info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            # Stored (uncompressed) member: decode it through a view of the mapped archive, without copying it
+            header = self._mmap[info.header_offset:info.header_offset + 30]
+            if header[:4] == b'PK\x03\x04':
+                name_length, extra_length = struct.unpack('<HH', header[26:30])
+                start = info.header_offset + 30 + name_length + extra_length
+                data = memoryview(self._mmap)[start:start + info.compress_size]
+        if data is None:
+            return Image.open(io.BytesIO(self.archive.read(info)))
+        return Image.open(MemoryViewReader(data))
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # An image still reads from the map; it is unmapped once that image is gone
+            self._mmap = None
+        if self.archive is not None:
+            self.archive.close()
+
+    def find_indexes(self, ext_id):
+        """Return the indexes of all filenames matching an EXT_ID, best matches first.
+
+        Filenames that contain the EXT_ID as a whole token are preferred; if there are
+        none, every filename containing it as a substring is returned.
+        """
+        key = str(ext_id).strip().lower()
+        if not key:
+            return []
+
+        token_matches = self.tokens.get(key)
+        if token_matches:
+            return list(token_matches)
+
+        # Fall back to a substring search over the joined filenames
+        matches = []
+        position = self._blob.find(key)
+        while position != -1:
+            file_index = bisect.bisect_right(self._offsets, position) - 1
+            if not matches or matches[-1] != file_index:
+                matches.append(file_index)
+            # Continue after the end of this filename
+            position = self._blob.find(key, self._offsets[file_index] + len(self.filenames[file_index]) + 1)
+        return matches
+
+    def find_all(self, ext_id):
+        """Return all filenames matching an EXT_ID, best matches first."""
+        return [self.filenames[i] for i in self.find_indexes(ext_id)]
+
+    def find(self, ext_id):
+        """Return the full path of the best matching file for an EXT_ID, or None."""
+        matches = self.find_all(ext_id)
+        return self.path(matches[0]) if matches else None
+
+    def get_fuzzy_matcher(self):
+        """Return the trigram matcher over this folder, building it on first use."""
+        if self._fuzzy_matcher is None:
+            self._fuzzy_matcher = FuzzyAssetMatcher(self.filenames)
+        return self._fuzzy_matcher
+
+    def plan_fuzzy_matches(self, students):
+        """Fuzzy-match every student that has no file containing their EXT_ID.
+
+        Files that some EXT_ID matches exactly are never offered as fuzzy candidates.
+        When several students fuzzy-match the same file, the best one keeps it if it
+        wins by more than FUZZY_MATCH_AMBIGUITY_MARGIN; the others are marked ambiguous.
+
+        Args:
+            students (list): (ext_id, name) tuples for the whole roster
+
+        Returns:
+            dict: EXT_ID -> FuzzyMatch, only for students without an exact match
+        """
+        claimed = set()
+        unmatched = []
+        for ext_id, name in students:
+            exact = self.find_indexes(ext_id)
+            if exact:
+                claimed.update(exact)
+            else:
+                unmatched.append((ext_id, name))
+
+        if not unmatched:
+            self.fuzzy_plan = {}
+            return self.fuzzy_plan
+
+        matcher = self.get_fuzzy_matcher()
+        plan = {}
+        by_file = {}
+        for ext_id, name in unmatched:
+            match = matcher.match(ext_id, name, exclude=claimed)
+            if match:
+                plan[ext_id] = match
+                by_file.setdefault(match.filename, []).append(ext_id)
+
+        # Resolve students competing for the same file
+        for filename, ext_ids in by_file.items():
+            if len(ext_ids) < 2:
+                continue
+            ext_ids.sort(key=lambda ext_id: -plan[ext_id].score)
+            best_score = plan[ext_ids[0]].score
+            winner_clear = best_score - plan[ext_ids[1]].score > FUZZY_MATCH_AMBIGUITY_MARGIN
+            for position, ext_id in enumerate(ext_ids):
+                if position == 0 and winner_clear:
+                    continue
+                rivals = [(f"{filename} (also matches {other})", plan[other].score) for other in ext_ids if other != ext_id]
+                plan[ext_id] = plan[ext_id]._replace(ambiguous=True, alternatives=rivals + plan[ext_id].alternatives)
+        self.fuzzy_plan = plan
+        return plan
+
+# Result of a fuzzy filename lookup. score is the Dice similarity (0-1) of the
+# best candidate, alternatives lists (filename, score) of the runners-up.
+FuzzyMatch = namedtuple('FuzzyMatch', ['filename', 'score', 'query', 'ambiguous', 'alternatives'])
+
+class FuzzyAssetMatcher:
+    """Trigram index over normalized filenames for photos that do not contain the EXT_ID.
+
+    Catches typos in IDs ("S1O23.jpg") and photos named after the student
+    ("john_smith.jpg"). A query only visits the posting lists of its own trigrams,
+    and trigrams shared by a large share of the folder (such as a common "_photo"
+    suffix) are skipped, so lookups stay fast with 100k files.
+    """
+
+    # Trigrams appearing in more than this share of filenames carry no signal
+    MAX_POSTING_SHARE = 0.02
+    MIN_POSTING_CAP = 50
+
+    def __init__(self, filenames):
+        """
+        Args:
+            filenames (list): Image filenames, as held by AssetIndex
+        """
+        self.filenames = filenames
+        self.postings = {}  # Trigram -> list of filename indexes
+        self.trigram_counts = []  # Number of distinct trigrams per filename
+
+        for file_index, filename in enumerate(filenames):
+            grams = self.trigrams(os.path.splitext(filename)[0])
+            self.trigram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(file_index)
+
+        self.posting_cap = max(self.MIN_POSTING_CAP, int(len(filenames) * self.MAX_POSTING_SHARE))
+
+    @staticmethod
+    def normalize(text):
+        """Casefold, strip accents from Latin letters and collapse punctuation/underscores to single spaces.
+
+        Letters, digits and marks of any script are kept, so Devanagari names (whose
+        vowel signs are combining marks) still match.
+        """
+        kept = []
+        for ch in unicodedata.normalize('NFKD', str(text)):
+            if unicodedata.combining(ch) and kept and kept[-1] < '\u0250':
+                continue  # Accent on a Latin letter
+            kept.append(ch)
+        text = unicodedata.normalize('NFC', ''.join(kept)).casefold()
+        return ' '.join(''.join(ch if unicodedata.category(ch)[0] in 'LMN' else ' ' for ch in text).split())
+
+    @classmethod
+    def trigrams(cls, text):
+        """Return the set of trigrams of the normalized, space-padded text."""
+        normalized = cls.normalize(text)
+        if not normalized:
+            return set()
+        padded = f"  {normalized} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def search(self, query, limit=3, exclude=None):
+        """Return up to limit (filename, score) candidates for a query, best first.
+
+        Args:
+            exclude (set): Filename indexes that must not be returned
+        """
+        query_grams = self.trigrams(query)
+        if not query_grams:
+            return []
+
+        shared = Counter()
+        for gram in query_grams:
+            posting = self.postings.get(gram)
+            if posting and len(posting) <= self.posting_cap:
+                shared.update(posting)
+
+        # Candidates scoring well below the acceptance threshold cannot affect the result.
+        # Dice = 2c / (q + f) with f >= c, so a score of at least s needs c >= s * q / (2 - s).
+        query_size = len(query_grams)
+        floor = FUZZY_MATCH_MIN_SCORE - FUZZY_MATCH_AMBIGUITY_MARGIN
+        min_shared = floor * query_size / (2 - floor)
+
+        scored = heapq.nlargest(limit, (
+            # Dice coefficient over trigram sets; ties go to the earlier file
+            (2 * count / (query_size + self.trigram_counts[file_index]), -file_index)
+            for file_index, count in shared.items()
+            if count >= min_shared and not (exclude and file_index in exclude)
+        ))
+        return [(self.filenames[-neg_index], round(score, 3)) for score, neg_index in scored]
+
+    def match(self, ext_id, name=None, exclude=None):
+        """Return the best FuzzyMatch for an EXT_ID and/or student name, or None.
+
+        A match is ambiguous when another file scores within
+        FUZZY_MATCH_AMBIGUITY_MARGIN of the best one.
+
+        Args:
+            ext_id (str): Student EXT_ID
+            name (str): Student name from the roster, if any
+            exclude (set): Filename indexes that must not be returned
+        """
+        candidates = {}
+        for query in (ext_id, name):
+            if query is None or (isinstance(query, float) and pd.isna(query)):
+                continue
+            for filename, score in self.search(query, exclude=exclude):
+                if score > candidates.get(filename, (0, None))[0]:
+                    candidates[filename] = (score, query)
+
+        if not candidates:
+            return None
+        ranked = sorted(candidates.items(), key=lambda item: -item[1][0])
+        filename, (score, query) = ranked[0]
+        if score < FUZZY_MATCH_MIN_SCORE:
+            return None
+        alternatives = [(name, alt_score) for name, (alt_score, _) in ranked[1:]]
+        ambiguous = bool(alternatives) and score - alternatives[0][1] <= FUZZY_MATCH_AMBIGUITY_MARGIN
+        return FuzzyMatch(filename, score, query, ambiguous, alternatives)
+
+class RowSelection:
+    """Subset of roster rows to render, e.g. for reprinting lost cards.
+
+    Any combination of criteria can be given; a row must satisfy all of them.
+    The selection is applied to the roster before any asset lookup or rendering.
+    """
+
+    def __init__(self, ids=None, query=None, rows=None):
+        """
+        Args:
+            ids (list): EXT_IDs to include
+            query (str): pandas query over roster columns, e.g. "Grade == 10 and Section == 'A'".
+                         Column names with spaces need backticks: "`Roll No.` < 20"
+            rows (str): 1-based row numbers and ranges as shown in the log, e.g. "1-50,75,120-"
+        """
+        self.ids = [str(ext_id).strip() for ext_id in ids or [] if str(ext_id).strip()] or None
+        self.query = query.strip() if query and query.strip() else None
+        self.rows = self.parse_row_ranges(rows) if rows else None
+
+    @staticmethod
+    def parse_row_ranges(text):
+        """Parse "1-50,75,120-" into a list of (first, last) 1-based ranges; last may be None."""
+        ranges = []
+        for part in str(text).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            match = re.fullmatch(r'(\d+)\s*(?:-\s*(\d*))?', part)
+            if not match:
+                raise ValueError(f"Invalid row range: '{part}'")
+            first = int(match.group(1))
+            if match.group(2) is None:
+                last = first
+            else:
+                last = int(match.group(2)) if match.group(2) else None
+            if last is not None and last < first:
+                raise ValueError(f"Invalid row range: '{part}'")
+            ranges.append((first, last))
+        return ranges
+
+    def is_empty(self):
+        return self.ids is None and self.query is None and self.rows is None
+
+    def describe(self):
+        parts = []
+        if self.ids is not None:
+            parts.append(f"{len(self.ids)} ID(s)")
+        if self.query is not None:
+            parts.append(f"query [{self.query}]")
+        if self.rows is not None:
+            parts.append("rows " + ",".join(f"{first}-{'' if last is None else last}" if last != first else str(first)
+                                            for first, last in self.rows))
+        return ", ".join(parts) or "all rows"
+
+    def apply(self, df, ext_id_column):
+        """Return the selected rows of a roster DataFrame, keeping the original index.
+
+        Args:
+            df (DataFrame): Roster with its default 0-based RangeIndex
+            ext_id_column (str): Name of the EXT_ID column, or None if there is none
+        """
+        mask = pd.Series(True, index=df.index)
+        if self.rows is not None:
+            row_numbers = pd.Series(df.index + 1, index=df.index)
+            in_ranges = pd.Series(False, index=df.index)
+            for first, last in self.rows:
+                in_ranges |= (row_numbers >= first) & ((row_numbers <= last) if last is not None else True)
+            mask &= in_ranges
+        if self.ids is not None:
+            if ext_id_column is None:
+                raise ValueError("Cannot select by ID: the roster has no EXT_ID column")
+            wanted = set(self.ids)
+            mask &= df[ext_id_column].map(lambda value: pd.notna(value) and str(value).strip() in wanted)
+        if self.query is not None:
+            try:
+                matched = df.query(self.query).index
+            except Exception as e:
+                raise ValueError(f"Invalid row query '{self.query}': {e}")
+            mask &= df.index.isin(matched)
+        return df[mask]
+
+class MemoryBudget:
+    """Track in-flight cards, pages and decoded photos against a byte budget.
+
+    Usage is the larger of the tracked bytes and the process RSS, so the budget also
+    covers memory the tracking cannot see (the roster, fonts, Tk).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = Counter()  # kind ('cards', 'pages', 'photos') -> bytes
+        self.peak_in_flight = Counter()
+        self.early_flushes = 0  # Times queued cards were rendered early near the limit
+        self.spilled_pages = 0
+        self._lock = threading.Lock()  # Pages are released from the page-writer threads
+
+    @staticmethod
+    def image_bytes(image):
+        """Decoded size of an image, from its header."""
+        return image.width * image.height * len(image.getbands())
+
+    @staticmethod
+    def current_rss():
+        """Resident set size of this process in bytes, or None where it cannot be read."""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def peak_rss():
+        """Peak resident set size of this process in bytes, or None without the resource module."""
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # kilobytes on Linux
+
+    def reserve(self, kind, nbytes):
+        with self._lock:
+            self.in_flight[kind] += nbytes
+            self.peak_in_flight[kind] = max(self.peak_in_flight[kind], self.in_flight[kind])
+
+    def release(self, kind, nbytes):
+        with self._lock:
+            self.in_flight[kind] -= nbytes
+
+    def usage(self):
+        tracked = sum(self.in_flight.values())
+        return max(tracked, self.current_rss() or 0)
+
+    def near_limit(self):
+        return self.usage() >= self.max_bytes * MEMORY_BUDGET_HIGH_WATER
+
+    def check_decode(self, image, path):
+        """Refuse an image whose decoded size would take too much of the budget (decompression bombs)."""
+        nbytes = self.image_bytes(image)
+        if nbytes > self.max_bytes * MAX_DECODE_SHARE:
+            raise ValueError(f"Refusing {os.path.basename(path)}: {image.width}x{image.height} decodes to "
+                             f"{format_bytes(nbytes)}, over {MAX_DECODE_SHARE:.0%} of the {format_bytes(self.max_bytes)} memory budget")
+        return nbytes
+
+class MemoryProfiler:
+    """Sample memory during generate_all_id_cards and attribute allocations to stages.
+
+    RSS and tracemalloc's traced total are sampled every sample_every cards, together
+    with the card throughput and the pixel bytes of cards and pages held by the page
+    spools. At each stage boundary (roster, render, pages) a tracemalloc snapshot is
+    compared with the previous one to list the allocation sites that grew the most
+    during that stage. PIL keeps pixel data outside the Python allocator, so it shows
+    up in RSS and in the spooled bytes rather than in the traced total.
+    """
+
+    def __init__(self, report_path, sample_every=PROFILE_SAMPLE_EVERY, top=PROFILE_TOP_ALLOCATIONS, log_callback=None):
+        self.report_path = report_path
+        self.sample_every = max(1, sample_every)
+        self.top = top
+        self.log_callback = log_callback or (lambda x: None)
+        self.samples = []
+        self.stages = []
+        self.start_time = None
+        self.next_sample = 0
+        self._snapshot = None
+        self._stage_start = None
+        self._was_tracing = False
+
+    def start(self):
+        self._was_tracing = tracemalloc.is_tracing()
+        if not self._was_tracing:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        self.start_time = time.perf_counter()
+        self._snapshot = self.take_snapshot()
+        self._stage_start = self.sample('start', 0)
+        self.log_callback(f"🔬 Memory profiling on: sampling every {self.sample_every} cards")
+
+    @staticmethod
+    def take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),  # Source lines read for the report
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    @staticmethod
+    def spooled_bytes(spools):
+        """Pixel bytes of the queued cards and in-memory pages of the page spools."""
+        total = 0
+        for spool in (spools or {}).values():
+            for image in spool.fronts + spool.backs + spool.pages:
+                if image is not None and not isinstance(image, str):
+                    total += MemoryBudget.image_bytes(image)
+        return total
+
+    def sample(self, stage, cards, spools=None):
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        elapsed = time.perf_counter() - self.start_time
+        previous = self.samples[-1] if self.samples else None
+        rate = None
+        if previous is not None and cards > previous['cards'] and elapsed > previous['seconds']:
+            rate = (cards - previous['cards']) / (elapsed - previous['seconds'])
+        sample = {'stage': stage, 'seconds': round(elapsed, 3), 'cards': cards,
+                  'rss': MemoryBudget.current_rss(), 'traced': traced, 'traced_peak': traced_peak,
+                  'spooled_image_bytes': self.spooled_bytes(spools),
+                  'cards_per_second': round(rate, 2) if rate is not None else None}
+        self.samples.append(sample)
+        return sample
+
+    def tick(self, cards, spools=None):
+        """Take a sample once another sample_every cards are done."""
+        if cards >= self.next_sample:
+            self.sample('render', cards, spools)
+            self.next_sample = cards + self.sample_every
+
+    def stage(self, name, cards, spools=None, **details):
+        """Close a stage: sample, and list the allocation sites that grew during it."""
+        end = self.sample(name, cards, spools)
+        snapshot = self.take_snapshot()
+        top = []
+        for stat in snapshot.compare_to(self._snapshot, 'lineno')[:self.top]:
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            top.append({'location': f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                        'code': linecache.getline(frame.filename, frame.lineno).strip(),
+                        'size_diff': stat.size_diff, 'count_diff': stat.count_diff})
+        rss_delta = None
+        if end['rss'] is not None and self._stage_start['rss'] is not None:
+            rss_delta = end['rss'] - self._stage_start['rss']
+        self.stages.append(dict(details, stage=name, seconds=round(end['seconds'] - self._stage_start['seconds'], 3),
+                                rss_delta=rss_delta, traced_delta=end['traced'] - self._stage_start['traced'],
+                                traced_peak=end['traced_peak'], top_allocations=top))
+        self._snapshot = snapshot
+        self._stage_start = end
+        tracemalloc.reset_peak()
+
+    def finish(self):
+        """Stop tracing, write the JSON report and log the per-stage summary."""
+        if not self._was_tracing:
+            tracemalloc.stop()
+        report = {'sample_every': self.sample_every, 'peak_rss': MemoryBudget.peak_rss(),
+                  'stages': self.stages, 'samples': self.samples}
+        os.makedirs(os.path.dirname(os.path.abspath(self.report_path)), exist_ok=True)
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+        self.log_callback("🔬 Memory by stage:")
+        for stage in self.stages:
+            rss = f"RSS {'+' if (stage['rss_delta'] or 0) >= 0 else '-'}{format_bytes(abs(stage['rss_delta']))}" if stage['rss_delta'] is not None else "RSS n/a"
+            self.log_callback(f"  • {stage['stage']}: {stage['seconds']:.2f}s, {rss}, Python heap "
+                              f"{'+' if stage['traced_delta'] >= 0 else '-'}{format_bytes(abs(stage['traced_delta']))} "
+                              f"(peak {format_bytes(stage['traced_peak'])})")
+            for allocation in stage['top_allocations'][:3]:
+                self.log_callback(f"      {format_bytes(allocation['size_diff'])} at {allocation['location']}: {allocation['code']}")
+        self.log_callback(f"🔬 Memory profile with {len(self.samples)} samples written to: {self.report_path}")
+
+class PageSpool:
+    """Impose cards onto A4 pages as they are rendered instead of keeping every card.
+
+    A page is built as soon as a page's worth of fronts is ready, followed by its
+    mirrored back page. When a memory budget is near its limit, finished pages are
+    spilled to disk and read back one at a time when the PDF/TIFF is written.
+    """
+
+    def __init__(self, generator, spill_folder, route=None, group=None):
+        self.generator = generator
+        self.budget = generator.memory_budget
+        self.spill_folder = spill_folder
+        self.route = route  # Template route whose cards go on these pages (None for the main template)
+        self.group = group  # Value of the page group column (None when not grouping)
+        self.fronts = []
+        self.backs = []
+        self.pages = []  # Page images, or paths of pages spilled to disk
+        self.card_count = 0
+        self.ext_ids = []  # EXT_IDs of the cards on these pages
+        self.cards_per_page = A4_GRID[0] * A4_GRID[1]
+
+    def __len__(self):
+        return len(self.pages)
+
+    def add(self, front, back=None, ext_id=None):
+        """Queue a card (and its back side); impose a page once a page's worth is queued."""
+        self.fronts.append(front)
+        if back is not None:
+            self.backs.append(back)
+        self.card_count += 1
+        if ext_id is not None:
+            self.ext_ids.append(ext_id)
+        if self.budget is not None:
+            self.budget.reserve('cards', sum(MemoryBudget.image_bytes(card) for card in (front, back) if card is not None))
+        if len(self.fronts) >= self.cards_per_page:
+            self.flush()
+
+    def flush(self):
+        """Impose the queued cards onto a front page and, for double-sided jobs, a back page."""
+        if not self.fronts:
+            return
+        self.generator.log_callback(f"📄 Creating A4 page {len(self.pages) + 1} for {len(self.fronts)} cards")
+        front_layout, back_layout = self.generator.get_route_layouts(self.route)
+        pages = [self.generator.build_a4_page(self.fronts, layout=front_layout)]
+        if self.backs:
+            # The back page directly follows its front page
+            pages.append(self.generator.build_a4_page(self.backs, mirror=self.generator.duplex_flip, layout=back_layout))
+        if self.budget is not None:
+            self.budget.release('cards', sum(MemoryBudget.image_bytes(card) for card in self.fronts + self.backs))
+        self.fronts.clear()
+        self.backs.clear()
+        for page in pages:
+            self.store(page)
+
+    def store(self, page):
+        if self.budget is not None and self.budget.near_limit():
+            os.makedirs(self.spill_folder, exist_ok=True)
+            spill_path = os.path.join(self.spill_folder, f"page-{len(self.pages) + 1:05d}.png")
+            page.save(spill_path, compress_level=1)
+            self.pages.append(spill_path)
+            self.budget.spilled_pages += 1
+            return
+        if self.budget is not None:
+            self.budget.reserve('pages', MemoryBudget.image_bytes(page))
+        self.pages.append(page)
+
+    def drain(self):
+        """Yield the pages in order, dropping each one (and its spill file) once it is handed out."""
+        for i, page in enumerate(self.pages):
+            self.pages[i] = None
+            if isinstance(page, str):
+                spilled = Image.open(page)
+                spilled.load()
+                os.remove(page)
+                yield spilled
+            else:
+                if self.budget is not None:
+                    self.budget.release('pages', MemoryBudget.image_bytes(page))
+                yield page
+        self.pages = []
+        if os.path.isdir(self.spill_folder) and not os.listdir(self.spill_folder):
+            os.rmdir(self.spill_folder)
+
+class CardArchiveSink:
+    """Stream encoded card images into ZIP or TAR archives as they are rendered.
+
+    Cards are encoded on the rendering thread and handed to a single writer thread
+    through a bounded queue, so a slow network share throttles rendering instead of
+    piling up encoded cards. Entries are appended sequentially: ZIP entries are
+    stored (PNG/JPEG are already compressed) and the central directory is rewritten
+    every few seconds, TAR entries are readable as soon as they are written. Each
+    archive gets a CSV manifest, kept next to it while the job runs and added to the
+    archive when it is closed. With a group column there is one archive per value.
+    """
+
+    def __init__(self, output_folder, archive_format='zip', image_format='png', group_column=None, log_callback=None):
+        if archive_format not in CARD_ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format '{archive_format}' (choose from {', '.join(CARD_ARCHIVE_FORMATS)})")
+        if image_format not in CARD_IMAGE_FORMATS:
+            raise ValueError(f"Unknown card image format '{image_format}' (choose from {', '.join(CARD_IMAGE_FORMATS)})")
+        self.output_folder = output_folder
+        self.archive_format = archive_format
+        self.image_format = image_format
+        self.group_column = group_column
+        self.log_callback = log_callback or (lambda x: None)
+        self.archives = {}  # Group -> open archive state, used by the writer thread only
+        self.card_count = 0
+        self.bytes_written = 0
+        self.start_time = time.perf_counter()
+        self._queue = queue.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+        self._error = None
+        self._writer = threading.Thread(target=self._write_entries, name="card-archive-writer", daemon=True)
+        self._writer.start()
+
+    def get_group(self, student_data):
+        if not self.group_column:
+            return None
+        for key, value in student_data.items():
+            if str(key).lower() == self.group_column.lower():
+                return None if pd.isna(value) else str(value).strip()
+        return None
+
+    def encode(self, card):
+        buffer = io.BytesIO()
+        if self.image_format == 'jpeg':
+            card.convert('RGB').save(buffer, format='JPEG', quality=92)
+        else:
+            card.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def add(self, card, ext_id, student_data, side='front'):
+        """Encode a card and queue it for the writer; blocks while the queue is full."""
+        if self._error is not None:
+            raise self._error
+        extension = 'jpg' if self.image_format == 'jpeg' else 'png'
+        stem = re.sub(r'[^\w.-]+', '_', str(ext_id)) + ('_back' if side == 'back' else '')
+        name = student_data.get('Name', '')
+        manifest_row = {'ext_id': ext_id, 'side': side, 'name': '' if pd.isna(name) else str(name)}
+        self._queue.put((self.get_group(student_data), stem, extension, self.encode(card), manifest_row))
+
+    def _open_archive(self, group):
+        slug = re.sub(r'[^\w.-]+', '_', group) if group else None
+        base = os.path.join(self.output_folder, f"id_cards_{slug}" if slug else "id_cards")
+        path = f"{base}.{self.archive_format}"
+        manifest_path = f"{base}.manifest.csv"
+        if self.archive_format == 'zip':
+            handle = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        else:
+            handle = tarfile.open(path, 'w')
+        manifest_file = open(manifest_path, 'w', newline='', encoding='utf-8')
+        manifest = csv.DictWriter(manifest_file, fieldnames=['entry', 'ext_id', 'side', 'name', 'bytes'])
+        manifest.writeheader()
+        return {'path': path, 'handle': handle, 'manifest_path': manifest_path, 'manifest_file': manifest_file,
+                'manifest': manifest, 'entries': set(), 'checkpoint': time.perf_counter()}
+
+    def _write_entries(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._write_entry(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write_entry(self, group, stem, extension, data, manifest_row):
+        archive = self.archives.get(group)
+        if archive is None:
+            archive = self.archives[group] = self._open_archive(group)
+
+        # Keep entry names unique when an EXT_ID repeats
+        entry = f"{stem}.{extension}"
+        suffix = 2
+        while entry in archive['entries']:
+            entry = f"{stem}_{suffix}.{extension}"
+            suffix += 1
+        archive['entries'].add(entry)
+
+        if self.archive_format == 'zip':
+            info = zipfile.ZipInfo(entry, date_time=time.localtime()[:6])
+            archive['handle'].writestr(info, data)
+            if time.perf_counter() - archive['checkpoint'] >= ARCHIVE_CHECKPOINT_SECONDS:
+                # Rewrite the central directory so the entries so far can be opened
+                archive['handle'].close()
+                archive['handle'] = zipfile.ZipFile(archive['path'], 'a', compression=zipfile.ZIP_STORED)
+                archive['checkpoint'] = time.perf_counter()
+        else:
+            info = tarfile.TarInfo(entry)
+            info.size = len(data)
+            info.mtime = time.time()
+            archive['handle'].addfile(info, io.BytesIO(data))
+            archive['handle'].fileobj.flush()
+
+        archive['manifest'].writerow(dict(manifest_row, entry=entry, bytes=len(data)))
+        archive['manifest_file'].flush()
+        self.card_count += 1
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Wait for queued cards, add the manifests and close every archive."""
+        self._queue.put(None)
+        self._writer.join()
+        for archive in self.archives.values():
+            archive['manifest_file'].close()
+            with open(archive['manifest_path'], 'rb') as f:
+                manifest_data = f.read()
+            if self.archive_format == 'zip':
+                archive['handle'].writestr(zipfile.ZipInfo('manifest.csv', date_time=time.localtime()[:6]), manifest_data)
+            else:
+                info = tarfile.TarInfo('manifest.csv')
+                info.size = len(manifest_data)
+                info.mtime = time.time()
+                archive['handle'].addfile(info, io.BytesIO(manifest_data))
+            archive['handle'].close()
+        if self._error is not None:
+            raise self._error
+
+        elapsed = time.perf_counter() - self.start_time
+        for archive in self.archives.values():
+            self.log_callback(f"🗜️ Wrote {len(archive['entries'])} card images to {os.path.basename(archive['path'])}")
+        if self.card_count:
+            self.log_callback(f"🗜️ Archived {self.card_count} card images ({format_bytes(self.bytes_written)}) "
+                              f"at {self.card_count / elapsed:.1f} cards/s")
+
+class ThumbnailCache:
+    """Small JPEG thumbnails of the rendered cards, for the GUI's results gallery.
+
+    Thumbnails are written to <output>/.thumbnails as the cards are rendered, and
+    index.json lists them in render order with their EXT_IDs. A run that appends
+    pages (watch mode) adds to the existing index; other runs start a fresh one.
+    """
+
+    def __init__(self, output_folder, append=False, log_callback=None):
+        self.folder = os.path.join(output_folder, THUMBNAIL_FOLDER)
+        self.log_callback = log_callback or (lambda x: None)
+        os.makedirs(self.folder, exist_ok=True)
+        if append:
+            self.entries = self.load(self.folder)
+        else:
+            self.entries = []
+            for name in os.listdir(self.folder):
+                if name.endswith('.jpg'):
+                    os.remove(os.path.join(self.folder, name))
+        self.added = 0
+
+    @staticmethod
+    def load(folder):
+        """Return the index entries ({'ext_id', 'file'}) of a thumbnail folder, or []."""
+        try:
+            with open(os.path.join(folder, THUMBNAIL_INDEX), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def add(self, card, ext_id):
+        """Scale a card down to THUMBNAIL_SIZE and write it."""
+        scale = min(THUMBNAIL_SIZE[0] / card.width, THUMBNAIL_SIZE[1] / card.height)
+        thumbnail = resize_for_stage(card, (max(1, int(card.width * scale)), max(1, int(card.height * scale))), 'preview', 'draft')
+        stem = re.sub(r'[^\w.-]+', '_', str(ext_id))
+        name = f"{len(self.entries):06d}_{stem}.jpg"
+        thumbnail.convert('RGB').save(os.path.join(self.folder, name), format='JPEG', quality=THUMBNAIL_QUALITY)
+        self.entries.append({'ext_id': str(ext_id), 'file': name})
+        self.added += 1
+
+    def close(self):
+        """Write the index."""
+        with open(os.path.join(self.folder, THUMBNAIL_INDEX), 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        if self.added:
+            self.log_callback(f"🖼️ Wrote {self.added} card thumbnails to {self.folder}")
+
+# One multi-resolution card output: files go to cards_<name>/, width is None for the
+# card as rendered (print resolution)
+CardOutputSpec = namedtuple('CardOutputSpec', ['name', 'format', 'width', 'quality'])
+
+def parse_output_specs(text):
+    """Parse card outputs such as "print:png:full,web:jpeg:600:85,thumb:jpeg:96".
+
+    Each output is name:format:width[:quality], where width is in pixels or 'full'.
+
+    Returns:
+        list: CardOutputSpec per output
+    """
+    specs = []
+    for item in text.split(','):
+        parts = [part.strip() for part in item.split(':')]
+        if len(parts) not in (3, 4) or not re.fullmatch(r'[\w-]+', parts[0]):
+            raise ValueError(f"Invalid card output '{item.strip()}' (use name:format:width[:quality])")
+        name, image_format, width = parts[:3]
+        if image_format not in CARD_IMAGE_FORMATS:
+            raise ValueError(f"Unknown card image format '{image_format}' (choose from {', '.join(CARD_IMAGE_FORMATS)})")
+        if any(spec.name == name for spec in specs):
+            raise ValueError(f"Card output '{name}' is listed twice")
+        if width != 'full' and not (width.isdigit() and int(width) > 0):
+            raise ValueError(f"Invalid width '{width}' for card output '{name}' (use pixels above 0 or 'full')")
+        quality = parts[3] if len(parts) == 4 else str(DEFAULT_OUTPUT_QUALITY)
+        if not (quality.isdigit() and 1 <= int(quality) <= 95):
+            raise ValueError(f"Invalid quality '{quality}' for card output '{name}' (use 1-95)")
+        specs.append(CardOutputSpec(name, image_format, None if width == 'full' else int(width), int(quality)))
+    return specs
+
+class CardOutputWriter:
+    """Write every card at several resolutions and formats from the one render.
+
+    The sizes are produced as a pyramid: each output is scaled down from the next
+    larger one rather than from the full-size card, which is much cheaper for the
+    small sizes. A card's pyramid is built and encoded in order on one thread, and
+    several cards are processed in parallel on a pool of threads (Pillow releases the
+    GIL while resizing and encoding), with a bounded number of cards in flight so a
+    slow disk throttles rendering. File names repeat the sanitised EXT_ID; a name
+    that is already taken in this run gets a _2, _3... suffix.
+    """
+
+    def __init__(self, output_folder, specs, preset=DEFAULT_RESAMPLING_PRESET, log_callback=None):
+        self.output_folder = output_folder
+        self.specs = sorted(specs, key=lambda spec: -(spec.width or float('inf')))  # Largest first
+        self.preset = preset
+        self.log_callback = log_callback or (lambda x: None)
+        for spec in self.specs:
+            os.makedirs(os.path.join(output_folder, f"cards_{spec.name}"), exist_ok=True)
+        self.files = {spec.name: 0 for spec in self.specs}
+        self.bytes_written = {spec.name: 0 for spec in self.specs}
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="card-output")
+        self._in_flight = deque()
+        self._stems = set()  # Casefolded stems in use, so no two cards share a file
+
+    def add(self, card, ext_id, side='front'):
+        """Queue a card for every output; blocks while OUTPUT_QUEUE_SIZE cards are in flight."""
+        while len(self._in_flight) >= OUTPUT_QUEUE_SIZE:
+            self._in_flight.popleft().result()
+        base = re.sub(r'[^\w.-]+', '_', str(ext_id)) + ('_back' if side == 'back' else '')
+        # Keep file names unique when an EXT_ID repeats or two IDs sanitise alike
+        stem = base
+        suffix = 2
+        while stem.casefold() in self._stems:
+            stem = f"{base}_{suffix}"
+            suffix += 1
+        self._stems.add(stem.casefold())
+        self._in_flight.append(self._pool.submit(self._write_card, card, stem))
+
+    def _write_card(self, card, stem):
+        level = card
+        for spec in self.specs:
+            if spec.width is not None and spec.width < level.width:
+                height = max(1, round(level.height * spec.width / level.width))
+                level = resize_for_stage(level, (spec.width, height), 'page', self.preset)
+            path = os.path.join(self.output_folder, f"cards_{spec.name}", f"{stem}.{'jpg' if spec.format == 'jpeg' else 'png'}")
+            if spec.format == 'jpeg':
+                level.convert('RGB').save(path, format='JPEG', quality=spec.quality)
+            else:
+                level.save(path, format='PNG')
+            with self._lock:
+                self.files[spec.name] += 1
+                self.bytes_written[spec.name] += os.path.getsize(path)
+
+    def close(self):
+        """Wait for the queued cards and log what was written."""
+        try:
+            while self._in_flight:
+                self._in_flight.popleft().result()
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        elapsed = time.perf_counter() - self.start_time
+        for spec in self.specs:
+            size = "full size" if spec.width is None else f"{spec.width}px wide"
+            self.log_callback(f"📐 Wrote {self.files[spec.name]} {spec.format.upper()} cards ({size}, "
+                              f"{format_bytes(self.bytes_written[spec.name])}) to cards_{spec.name}")
+        cards = self.files[self.specs[0].name] if self.specs else 0
+        if cards:
+            self.log_callback(f"📐 Card outputs written at {cards / elapsed:.1f} cards/s")
+
+class SharedImagePickler(pickle.Pickler):
+    """Pickle the images stored in a SharedImageBuffers block as their key."""
+
+    def __init__(self, file, keys):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.keys = keys  # id(image) -> key
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Image.Image):
+            return self.keys.get(id(obj))
+        return None
+
+class SharedImageUnpickler(pickle.Unpickler):
+    """Map the images referenced by key onto the attached block."""
+
+    def __init__(self, file, buffers):
+        super().__init__(file)
+        self.buffers = buffers
+
+    def persistent_load(self, key):
+        return self.buffers.image(key)
+
+class SharedImageBuffers:
+    """Decoded templates and masks, and slots for rendered cards, in one shared memory block.
+
+    The creating process decodes each image once and worker processes attach to the
+    block by name (see spec) and map the images onto it, so no worker keeps its own
+    decoded copy. L and RGBA images are stored as they are and RGB ones as RGBX, the
+    layout PIL keeps them in, so every stored image maps without copying; an RGB image
+    comes back as RGBX (CardLayout.new_card converts the copy it makes for each card).
+    Images of other modes are not stored.
+
+    Card slots carry rendered cards back from the workers: a worker copies a card into
+    its slot and the creating process copies it out, so cards are not pickled through
+    the pipe.
+
+    Photos are not shared. Decoding them in the creating process to fill a ring would
+    bring back the risk RenderWorkerPool isolates (a photo that hangs or crashes the
+    decoder would take down the job), and each worker is sent only a row's photo path
+    and decodes that photo once, so no photo is pickled or decoded twice.
+
+    dumps() pickles an object, e.g. a generator, with the stored images referenced by
+    key, and loads() in a worker maps them back onto the block.
+
+    Views and mapped images must be dropped before close().
+    """
+
+    def __init__(self, shm, entries, slots, owner, sources=None):
+        self.shm = shm
+        self.entries = entries  # Key -> (offset, stored mode, size)
+        self.slots = slots  # (offset, bytes per slot, slot count), or None
+        self.owner = owner
+        self.sources = sources or {}  # Key -> the creating process's image, for dumps()
+
+    @staticmethod
+    def _nbytes(mode, size):
+        return size[0] * size[1] * Image.getmodebands(mode)
+
+    @classmethod
+    def create(cls, images, card_slots=0, card_bytes=0):
+        """Copy images into a new shared memory block.
+
+        Args:
+            images (dict): Key -> PIL image, e.g. {'template_front': ..., 'photo_mask': ...};
+                           images of other modes than SHARED_IMAGE_MODES are left out
+            card_slots (int): Number of card slots
+            card_bytes (int): Size of each card slot in bytes
+        """
+        entries = {}
+        sources = {}
+        offset = 0
+        for key, image in images.items():
+            if image.mode not in SHARED_IMAGE_MODES:
+                continue
+            mode = 'RGBX' if image.mode == 'RGB' else image.mode
+            entries[key] = (offset, mode, image.size)
+            sources[key] = image
+            offset += -(-cls._nbytes(mode, image.size) // SHARED_ALIGNMENT) * SHARED_ALIGNMENT
+        slots = None
+        if card_slots and card_bytes:
+            card_bytes = -(-card_bytes // SHARED_ALIGNMENT) * SHARED_ALIGNMENT
+            slots = (offset, card_bytes, card_slots)
+            offset += card_bytes * card_slots
+
+        buffers = cls(shared_memory.SharedMemory(create=True, size=max(offset, 1)), entries, slots, owner=True, sources=sources)
+        for key, image in sources.items():
+            view = buffers.array(key)
+            view[...] = np.asarray(image.convert('RGBX') if image.mode == 'RGB' else image).reshape(view.shape)
+            del view
+        return buffers
+
+    @classmethod
+    def attach(cls, spec):
+        """Attach to a block created in another process, from its spec()."""
+        try:
+            shm = shared_memory.SharedMemory(name=spec['name'], track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with the resource tracker. A
+            # worker spawned by the creator shares the creator's tracker, where that changes
+            # nothing; a tracker of this process's own would unlink the block when the process
+            # exits, so the registration is taken back (only the creator owns the block)
+            own_tracker = os.name == 'posix' and resource_tracker._resource_tracker._fd is None
+            shm = shared_memory.SharedMemory(name=spec['name'])
+            if own_tracker:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, spec['entries'], spec['slots'], owner=False)
+
+    def spec(self):
+        """Small picklable description for worker processes to attach with."""
+        return {'name': self.shm.name, 'entries': self.entries, 'slots': self.slots}
+
+    def array(self, key):
+        """Zero-copy NumPy view of an image: (height, width) for L, else (height, width, bands)."""
+        offset, mode, (width, height) = self.entries[key]
+        bands = Image.getmodebands(mode)
+        shape = (height, width) if bands == 1 else (height, width, bands)
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+
+    def image(self, key):
+        """Read-only PIL image mapped onto the buffer (RGBX for an RGB image)."""
+        offset, mode, size = self.entries[key]
+        data = self.shm.buf[offset:offset + self._nbytes(mode, size)]
+        return Image.frombuffer(mode, size, data, 'raw', mode, 0, 1)
+
+    def write_slot(self, slot, image):
+        """Copy an image into a card slot.
+
+        Returns:
+            The (slot, mode, size, length) reference to read it back with, or the image
+            itself (None too) when there is no slot for it or it does not fit
+        """
+        if image is None or self.slots is None:
+            return image
+        offset, slot_bytes, _ = self.slots
+        data = image.tobytes()
+        if len(data) > slot_bytes:
+            return image
+        start = offset + slot * slot_bytes
+        self.shm.buf[start:start + len(data)] = data
+        return slot, image.mode, image.size, len(data)
+
+    def read_slot(self, ref):
+        """Copy an image out of its card slot, from a write_slot() reference (an image is returned as is)."""
+        if not isinstance(ref, tuple):
+            return ref
+        slot, mode, size, length = ref
+        start = self.slots[0] + slot * self.slots[1]
+        return Image.frombytes(mode, size, self.shm.buf[start:start + length])
+
+    def dumps(self, obj):
+        """Pickle obj with the stored images referenced by key instead of copied."""
+        buffer = io.BytesIO()
+        SharedImagePickler(buffer, {id(image): key for key, image in self.sources.items()}).dump(obj)
+        return buffer.getvalue()
+
+    def loads(self, data):
+        """Unpickle dumps() output, mapping the referenced images onto this block."""
+        return SharedImageUnpickler(io.BytesIO(data), self).load()
+
+    def close(self):
+        """Detach; the creating process also frees the block."""
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def render_worker_main(payload, spec, slots, connection, memory_limit=None):
+    """Worker process of RenderWorkerPool: render one row per task until the pipe closes.
+
+    The job's generator arrives pickled in payload. With a SharedImageBuffers spec its
+    templates and photo mask are mapped from the shared block, and the front and back
+    of each card go back through the worker's two card slots. Each reply carries the
+    row's log lines, so the parent can replay them in its log.
+    """
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+    buffers = SharedImageBuffers.attach(spec) if spec else None
+    generator = buffers.loads(payload) if buffers else pickle.loads(payload)
+    logs = []
+    generator.log_callback = logs.append
+    generator.error_callback = generator.warning_callback = lambda title, message: None
+    connection.send('ready')
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        entry, route = task
+        logs.clear()
+        try:
+            front, back = generator.render_cards([entry], route)[0]
+            if buffers is not None:
+                front, back = buffers.write_slot(slots[0], front), buffers.write_slot(slots[1], back)
+            connection.send(('ok', front, back, logs))
+        except MemoryError:
+            # Leave a worker that ran out of memory; the parent starts a fresh one
+            connection.send(('failed', "out of memory", logs))
+            break
+        except Exception as e:
+            connection.send(('failed', f"{type(e).__name__}: {e}", logs))
+    if buffers is not None:
+        # Drop the images mapped onto the block before detaching from it
+        generator = None
+        gc.collect()
+        buffers.close()
+
+class RenderWorkerPool:
+    """Render rows in separate worker processes, each under a time and memory limit.
+
+    A corrupt or enormous photo can hang or crash the decoder. Here that only takes
+    down its worker: a row that runs past the timeout is killed, a row that crashes
+    its worker or runs it out of memory is quarantined with the reason, the worker is
+    replaced and the other workers carry on. Every worker gets a copy of the job's
+    generator and renders one row per task, so the timeout applies per row.
+
+    The generator is pickled once for all workers. With share_images its decoded
+    templates and photo mask go into a SharedImageBuffers block instead, which every
+    worker maps rather than keeping a copy of its own, and each worker returns its
+    cards through two card slots of the block rather than pickling them.
+    """
+
+    def __init__(self, generator, workers, timeout=ROW_TIMEOUT_SECONDS, memory_limit=None, share_images=True):
+        """
+        Args:
+            generator (IDCardGenerator): Job whose rows are rendered (copied to each worker)
+            workers (int): Number of worker processes
+            timeout (float): Seconds a row may take before its worker is killed
+            memory_limit (int): Address space limit of each worker in bytes (None for no limit;
+                                needs the resource module, so it is ignored on Windows)
+            share_images (bool): Share the decoded templates and photo mask through shared memory
+        """
+        self.generator = generator
+        self.timeout = timeout
+        self.memory_limit = memory_limit if resource is not None else None
+        self.context = multiprocessing.get_context('spawn')  # Never fork a process running Tk
+        self.quarantined = []  # Report rows: ext_id, photo, reason, seconds
+        self.restarts = 0
+        self.workers = []
+        self.buffers = generator.create_shared_buffers(card_slots=2 * max(1, workers)) if share_images else None
+        try:
+            self.payload = self.buffers.dumps(generator) if self.buffers else pickle.dumps(generator, pickle.HIGHEST_PROTOCOL)
+            for slot in range(max(1, workers)):
+                self.workers.append(self._start(slot))
+            for process, connection in self.workers:
+                self._wait_ready(process, connection)
+        except BaseException:
+            self.close()
+            raise
+        if memory_limit and resource is None:
+            generator.log_callback("⚠️ Worker memory limits need the resource module (not on Windows); only the row timeout applies")
+
+    def _start(self, slot):
+        parent_end, child_end = self.context.Pipe()
+        spec = self.buffers.spec() if self.buffers else None
+        card_slots = (2 * slot, 2 * slot + 1)  # The worker's front and back slots
+        process = self.context.Process(target=render_worker_main, args=(self.payload, spec, card_slots, child_end, self.memory_limit),
+                                       name="card-render", daemon=True)
+        process.start()
+        child_end.close()
+        return process, parent_end
+
+    def _wait_ready(self, process, connection):
+        """Fail the job, rather than every row, when a worker cannot even start."""
+        try:
+            if connection.poll(WORKER_START_SECONDS) and connection.recv() == 'ready':
+                return
+        except (EOFError, OSError):
+            pass
+        process.kill()
+        process.join()
+        raise RuntimeError(f"Render worker failed to start: {self.describe_exit(process.exitcode)}")
+
+    def _restart(self, slot):
+        process, connection = self.workers[slot]
+        if process.is_alive():
+            process.kill()
+        process.join()
+        connection.close()
+        self.workers[slot] = self._start(slot)
+        self._wait_ready(*self.workers[slot])
+        self.restarts += 1
+
+    @staticmethod
+    def describe_exit(exitcode):
+        if exitcode is not None and exitcode < 0:
+            try:
+                return f"worker crashed ({signal.Signals(-exitcode).name})"
+            except ValueError:
+                pass
+        return f"worker crashed (exit code {exitcode})"
+
+    def quarantine(self, entry, reason, seconds):
+        student_data, photo_path, ext_id_key = entry
+        ext_id = str(student_data.get(ext_id_key, 'Unknown'))
+        self.quarantined.append({'ext_id': ext_id, 'photo': os.path.basename(photo_path) if photo_path else '',
+                                 'reason': reason, 'seconds': round(seconds, 2)})
+        self.generator.log_callback(f"  🚧 Quarantined {ext_id}: {reason}")
+
+    def render(self, entries, route=None):
+        """Render (student_data, photo_path, ext_id_key) entries of one route on the workers.
+
+        Returns:
+            list: (front, back) per entry, in order; (None, None) for quarantined rows
+        """
+        results = [(None, None)] * len(entries)
+        tasks = deque(range(len(entries)))
+        busy = {}  # Worker slot -> (entry index, start time)
+        while tasks or busy:
+            for slot in range(len(self.workers)):
+                if tasks and slot not in busy:
+                    i = tasks.popleft()
+                    try:
+                        self.workers[slot][1].send((entries[i], route))
+                    except (OSError, ValueError):
+                        # The worker died while idle; the row is not to blame
+                        self._restart(slot)
+                        self.workers[slot][1].send((entries[i], route))
+                    busy[slot] = (i, time.monotonic())
+
+            # Wait for a reply or a worker exit, at most until the oldest row times out
+            waitables = {}
+            for slot in busy:
+                process, connection = self.workers[slot]
+                waitables[connection] = waitables[process.sentinel] = slot
+            oldest = min(started for _, started in busy.values())
+            ready = multiprocessing.connection.wait(list(waitables), max(0, oldest + self.timeout - time.monotonic()))
+
+            for slot in {waitables[obj] for obj in ready}:
+                i, started = busy.pop(slot)
+                process, connection = self.workers[slot]
+                try:
+                    reply = connection.recv() if connection.poll() else None
+                except (EOFError, OSError):
+                    reply = None
+                if reply is None:
+                    process.join()
+                    self.quarantine(entries[i], self.describe_exit(process.exitcode), time.monotonic() - started)
+                    self._restart(slot)
+                    continue
+                for line in reply[-1]:
+                    self.generator.log_callback(line)
+                if reply[0] == 'ok':
+                    results[i] = tuple(self.buffers.read_slot(ref) for ref in reply[1:3]) if self.buffers else reply[1:3]
+                else:
+                    self.quarantine(entries[i], reply[1], time.monotonic() - started)
+                    if not process.is_alive() or reply[1] == "out of memory":
+                        self._restart(slot)
+
+            now = time.monotonic()
+            for slot, (i, started) in list(busy.items()):
+                if now - started >= self.timeout:
+                    del busy[slot]
+                    self.quarantine(entries[i], f"timed out after {self.timeout:g}s", now - started)
+                    self._restart(slot)
+        return results
+
+    def close(self):
+        """Stop the workers, killing any that do not exit promptly, and free the shared images."""
+        for process, connection in self.workers:
+            try:
+                connection.send(None)
+            except (OSError, ValueError):
+                pass
+        for process, connection in self.workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+            connection.close()
+        self.workers = []
+        if self.buffers is not None:
+            self.buffers.close()
+            self.buffers = None
+
+class CardPreview:
+    """Render one real roster row for the GUI's live preview.
+
+    The card goes through IDCardGenerator.generate_id_card like a batch, but what
+    does not change while the user drags elements or edits font sizes is kept
+    between renders: the generator with its decoded templates (rebuilt only when a
+    job setting changes), the roster rows, the fonts and the row's processed photo
+    and QR code. The card is scaled with the 'draft' preview filter.
+    """
+
+    def __init__(self, generator_factory):
+        self.generator_factory = generator_factory  # Returns a generator for the current job settings
+        self.generator = None
+        self.job_key = None
+        self.records = None
+        self.row_number = None
+        self.row = None  # (student_data, photo_path, ext_id_key) of row_number
+        self.assets = {}  # Processed photo/QR code of the row, shared by both sides
+        self.font_sizes = None
+        self.last_render_ms = 0.0
+
+    def prepare(self, job_key, font_path, font_sizes):
+        """Rebuild only what changed settings invalidate.
+
+        Args:
+            job_key (tuple): Every setting the generator is built from, except fonts
+            font_path (str): Font file, or empty for the default font
+            font_sizes (dict): Field -> font size
+        """
+        if job_key != self.job_key:
+            self.generator = self.generator_factory()
+            self.job_key = job_key
+            self.records = None
+            self.row_number = None
+            self.font_sizes = None
+        if font_path and font_sizes != self.font_sizes:
+            self.generator.set_font(font_path, font_sizes)
+            self.font_sizes = dict(font_sizes)
+
+    def select_row(self, row_number):
+        """Look up a roster row (1-based) and its photo, reading the roster once."""
+        generator = self.generator
+        if self.records is None:
+            self.records = generator.read_roster_file().to_dict('records')
+        if not 1 <= row_number <= len(self.records):
+            raise ValueError(f"Row {row_number} is outside the roster (1-{len(self.records)})")
+        if row_number != self.row_number:
+            student_data = self.records[row_number - 1]
+            ext_id_key = generator.find_ext_id_key(student_data)
+            if not ext_id_key or pd.isna(student_data.get(ext_id_key)):
+                raise ValueError(f"Row {row_number} has no EXT_ID")
+            photo_index = generator.get_photo_index()
+            photo_path = None
+            if photo_index.folder_exists:
+                photo_path = generator.find_asset(photo_index, str(student_data[ext_id_key]), student_data, "photo")
+            self.row = (student_data, photo_path, ext_id_key)
+            self.row_number = row_number
+            self.assets = {}
+        return self.row
+
+    def render(self, row_number, side, coordinates, size):
+        """Render a side of a row's card with the given coordinates, scaled to size.
+
+        Returns:
+            PIL.Image: The scaled card
+        """
+        start = time.perf_counter()
+        student_data, photo_path, ext_id_key = self.select_row(row_number)
+        layout = self.generator.back_layout if side == 'back' else self.generator.front_layout
+        if layout is None:
+            raise ValueError("No back template selected")
+        layout.set_coordinates(coordinates)
+        card = self.generator.generate_id_card(student_data, photo_path, ext_id_key, layout=layout, assets=self.assets)
+        if card is None:
+            raise ValueError(f"Nothing to draw for row {row_number}")
+        preview = resize_for_stage(card, size, 'preview', 'draft')
+        self.last_render_ms = (time.perf_counter() - start) * 1000
+        return preview
+
+class TextRunCache:
+    """Bounded LRU cache of shaped and rasterized text runs, keyed by (font, size, text).
+
+    Shaping with libraqm costs far more per string than drawing, and roster values
+    repeat (class names, validity dates, common surnames), so each run is shaped
+    and rasterized into a mask once per job and pasted in the text colour after that.
+    """
+
+    def __init__(self, max_entries=TEXT_RUN_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, font, text):
+        """Return (mask, (left, top)) of a text run, drawn at the origin like ImageDraw.text."""
+        path = getattr(font, 'path', None)
+        key = (path if isinstance(path, str) else id(font), getattr(font, 'size', None),
+               getattr(font, 'layout_engine', None), text)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        left, top, right, bottom = font.getbbox(text)
+        mask = Image.new('L', (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font)
+        value = self.entries[key] = (mask, (left, top))
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class LayoutCache:
+    """Bounded LRU cache of routed template layouts, loaded the first time a row needs one."""
+
+    def __init__(self, loader, max_entries=TEMPLATE_CACHE_SIZE):
+        self.loader = loader
+        self.max_entries = max(1, max_entries)
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()  # Grouped page files are imposed on several threads
+
+    def get(self, key):
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            value = self.entries[key] = self.loader(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return value
+
+class CardLayout:
+    """One side of a card: the template image and where the photo, QR code and text go.
+
+    The photo, QR code and barcode are only drawn on a side that has coordinates for them, so a
+    back side can hold just text, or only its template artwork. A layout also keeps
+    what is derived from its template: per-template fonts and the A4 imposition plan.
+    """
+
+    def __init__(self, template_path, coordinates=None, default_photo=None, default_qr=None, side='front'):
+        coordinates = coordinates or {}
+        self.side = side
+        self.template_path = template_path
+        self.template = Image.open(template_path)
+        self.mode = self.template.mode
+        self.width, self.height = self.template.size
+        self.default_photo = default_photo
+        self.default_qr = default_qr
+        self.set_coordinates(coordinates)
+        self.fonts = {}  # Field -> font, overriding the job's fonts for this template
+        self.page_plans = {}  # (card size, mirror) -> slot placements on an A4 page
+
+    def set_coordinates(self, coordinates):
+        """Place the photo, QR code and text fields (the live preview moves them between renders)."""
+        self.photo_coordinates = coordinates.get('Photo', self.default_photo)
+        self.qr_coordinates = coordinates.get('QR Code', self.default_qr)
+        self.barcode_coordinates = coordinates.get('Barcode')
+        self.text_coordinates = {key: coordinates[key] for key in TEXT_FIELD_LABELS if key in coordinates}
+
+    def new_card(self):
+        """A writable copy of the template to draw a card on, in the template's mode."""
+        if self.template.mode != self.mode:
+            # An RGB template mapped from SharedImageBuffers, stored as RGBX
+            return self.template.convert(self.mode)
+        return self.template.copy()
+
+class IDCardGenerator:
+    def __init__(self, template_path, photos_folder, qr_folder, excel_path, output_folder, coordinates=None, photo_size=(230, 230), qr_size=(120, 120), log_callback=None, export_as_pdf_var=None, photo_frame_style="circle", font_color="black", border_size=2, border_color="blue", fuzzy_matching=False, selection=None, error_callback=None, warning_callback=None, resampling_preset=DEFAULT_RESAMPLING_PRESET, back_template_path=None, back_coordinates=None, duplex_flip=DEFAULT_DUPLEX_FLIP, color_mode='rgb', cmyk_profile=None, page_format='pdf', max_memory=None, template_routes=None, template_cache_size=TEMPLATE_CACHE_SIZE, card_archive=None, card_image_format='png', archive_group_column=None, page_group_column=None, append_pages=False, memory_profile=None, profile_every=PROFILE_SAMPLE_EVERY, barcode_column=None, barcode_size=DEFAULT_BARCODE_SIZE, thumbnails=False, sheets=None, column_aliases=None, shaping_font=None, card_outputs=None, sort_keys=None, page_break_column=None, isolate_workers=0, row_timeout=ROW_TIMEOUT_SECONDS, worker_memory=None):
+        """
+        Initialize the ID Card Generator.
+        
+        Args:
+            template_path (str): Path to the ID card template PNG
+            photos_folder (str): Path to folder containing student photos
+            qr_folder (str): Path to folder containing QR code images
+            excel_path (str): Path to Excel file with student details
+            output_folder (str): Path to save generated ID cards
+            coordinates (dict): Dictionary of coordinates for text and photo placement
+            photo_size (tuple): Size of the photo (width, height)
+            qr_size (tuple): Size of the QR code (width, height)
+            log_callback (callable): Function to call for logging messages
+            photo_frame_style (str): Style of photo frame ("circle" or "square")
+            font_color (str): Color of the text
+            border_size (int): Size of the photo border in pixels
+            border_color (str): Color of the photo border
+            fuzzy_matching (bool): Fall back to fuzzy filename matching on EXT_ID and Name when no file contains the EXT_ID
+            selection (RowSelection): Only render these rows of the roster
+            error_callback (callable): Called with (title, message) for errors; defaults to a message box
+            warning_callback (callable): Called with (title, message) for warnings; defaults to a message box
+            resampling_preset (str): 'draft', 'proof' or 'print'; picks the resize filter per stage
+            back_template_path (str): Template for the back side; enables double-sided cards
+            back_coordinates (dict): Coordinates for the back side (photo/QR only if given)
+            duplex_flip (str): 'long' or 'short' sheet edge the printer flips on for the PDF
+            color_mode (str): 'rgb' or 'cmyk' colour mode of the A4 pages
+            cmyk_profile (str): ICC profile of the print vendor's CMYK space, used for 'cmyk'
+            page_format (str): 'pdf' or 'tiff' (multi-page, LZW-compressed) for the A4 pages
+            max_memory (int): Memory budget in bytes; renders queued cards early, spills pages to disk
+                              and refuses images too large to decode within it (None for no limit)
+            template_routes (dict): Per-row templates, {'column': 'Grade', 'templates': {'10': {'template': ...,
+                                    'coordinates': ..., 'back_template': ..., 'back_coordinates': ...,
+                                    'font_path': ..., 'font_sizes': ...}}}; other rows use template_path
+            template_cache_size (int): How many routed templates are kept loaded at once
+            card_archive (str): Also stream every card image into a 'zip' or 'tar' archive (None for no archive)
+            card_image_format (str): 'png' or 'jpeg' for archived card images
+            archive_group_column (str): Write one archive per value of this column, e.g. Grade or Section
+            page_group_column (str): Write one PDF/TIFF per value of this column, e.g. Grade or Section,
+                                     plus an index of the files and their page counts
+            append_pages (bool): Add pages to existing PDF/TIFF files instead of replacing them (watch mode)
+            memory_profile (str): Write a memory profile of each generate_all_id_cards run to this JSON path
+            profile_every (int): Cards between memory samples when profiling
+            sort_keys (list): Render rows sorted by these columns, e.g. ['Campus', 'Grade', 'Section', 'Name']
+                              (None keeps the roster order)
+            page_break_column (str): Start a new A4 page whenever this sort key (or any key before it) changes
+            isolate_workers (int): Render rows in this many worker processes, quarantining rows that
+                                   time out or crash their worker (0 renders in this process)
+            row_timeout (float): Seconds a row may take in an isolated worker
+            worker_memory (int): Address space limit of each isolated worker in bytes (None for no limit)
+        """
+        self.template_path = template_path
+        self.photos_folder = photos_folder
+        self.qr_folder = qr_folder
+        self.excel_path = excel_path
+        self.output_folder = output_folder
+        self.log_callback = log_callback or (lambda x: None)
+        self.export_as_pdf_var = export_as_pdf_var
+        self.photo_frame_style = photo_frame_style
+        self.font_color = font_color
+        self.border_size = border_size
+        self.border_color = border_color
+        self.fuzzy_matching = fuzzy_matching
+        self.selection = selection
+        if resampling_preset not in RESAMPLING_PRESETS:
+            raise ValueError(f"Unknown resampling preset '{resampling_preset}' (choose from {', '.join(RESAMPLING_PRESETS)})")
+        self.resampling_preset = resampling_preset
+        self.error_callback = error_callback or messagebox.showerror
+        self.warning_callback = warning_callback or messagebox.showwarning
+        self._photo_mask = None  # Circle alpha mask incl. border ring, built once per job
+
+        # The output folder is created when a job writes to it, so building a generator
+        # (e.g. for the live preview) does not touch the disk
+        
+        # Load the front template and coordinates (photo and QR code fall back to defaults)
+        self.coordinates = coordinates or {}
+        self.front_layout = CardLayout(template_path, coordinates, default_photo=(293, 270), default_qr=(50, 50))
+        self.template = self.front_layout.template
+        self.template_width, self.template_height = self.template.size
+        self.text_coordinates = self.front_layout.text_coordinates
+        self.photo_coordinates = self.front_layout.photo_coordinates
+        self.qr_coordinates = self.front_layout.qr_coordinates
+        self.photo_size = photo_size
+        self.qr_size = qr_size
+
+        # Optional back side, rendered in the same pass over the roster
+        self.back_layout = CardLayout(back_template_path, back_coordinates, side='back') if back_template_path else None
+        if duplex_flip not in DUPLEX_FLIP_MODES:
+            raise ValueError(f"Unknown duplex flip '{duplex_flip}' (choose from {', '.join(DUPLEX_FLIP_MODES)})")
+        self.duplex_flip = duplex_flip
+
+        # Print output colour mode, format and ICC profile
+        if color_mode not in OUTPUT_COLOR_MODES:
+            raise ValueError(f"Unknown colour mode '{color_mode}' (choose from {', '.join(OUTPUT_COLOR_MODES)})")
+        if page_format not in PAGE_FORMATS:
+            raise ValueError(f"Unknown page format '{page_format}' (choose from {', '.join(PAGE_FORMATS)})")
+        if cmyk_profile and ImageCms is None:
+            raise ValueError("ICC profiles need Pillow built with LittleCMS (PIL.ImageCms)")
+        self.color_mode = color_mode
+        self.cmyk_profile = cmyk_profile
+        self.page_format = page_format
+        self._cmyk_transform = None  # sRGB -> CMYK transform, built once per job
+
+        # Optional memory budget for the whole pipeline
+        self.memory_budget = MemoryBudget(max_memory) if max_memory else None
+
+        # Optional per-row template routing; routed layouts are loaded lazily into a bounded cache
+        self.template_routes = template_routes
+        self._route_lookup = {}  # Normalised column value -> route key
+        if template_routes:
+            if not template_routes.get('column') or not template_routes.get('templates'):
+                raise ValueError("Template routing needs a 'column' and a 'templates' mapping")
+            self._route_lookup = {self.normalize_route_value(value): value for value in template_routes['templates']}
+        self.layout_cache = LayoutCache(self.load_route_layouts, template_cache_size)
+
+        # Optional per-card image archives, opened for the duration of generate_all_id_cards
+        if card_archive and card_archive not in CARD_ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format '{card_archive}' (choose from {', '.join(CARD_ARCHIVE_FORMATS)})")
+        self.card_archive = card_archive
+        self.card_image_format = card_image_format
+        self.archive_group_column = archive_group_column
+        self.card_sink = None
+        self.card_outputs = card_outputs  # CardOutputSpec list: extra sizes/formats of every card
+        self.output_writer = None
+        self.page_group_column = page_group_column
+        self.append_pages = append_pages
+        self.memory_profile = memory_profile
+        self.profile_every = profile_every
+        self.thumbnails = thumbnails  # Write card thumbnails for the results gallery
+        self.thumbnail_cache = None
+
+        # Render order: sort keys, and the key whose change starts a new page
+        self.sort_keys = sort_keys
+        self.page_break_column = page_break_column
+
+        # Optional isolated rendering, one row at a time per worker process
+        self.isolate_workers = isolate_workers
+        self.row_timeout = row_timeout
+        self.worker_memory = worker_memory
+        self.render_workers = None
+
+        # Multi-sheet workbooks: None reads the first sheet only, 'all' or a list of names merges sheets
+        self.sheets = sheets
+        self.column_aliases = column_aliases
+
+        # Text is drawn through a cache of shaped runs; complex-script values (e.g. Devanagari
+        # names) use shaping_font when set, since most Latin fonts have no glyphs for them
+        self.shaping_font = shaping_font
+        self.text_runs = TextRunCache()
+        self._shaping_warned = False
+
+        # Code 128 barcode drawn at a 'Barcode' coordinate, encoding this column (EXT_ID by default)
+        self.barcode_column = barcode_column
+        self.barcode_size = tuple(barcode_size)
+
+        # Mapping from card labels to Excel column names (case-insensitive matching will be used)
+        # Map the label on the card to the likely column name in your Excel file.
+        # Note: The keys in this dictionary are the labels shown on the card/GUI,
+        # and the values are the corresponding column names in the Excel file.
+        # For fields like Roll No. and RegNo, we provide a list of possible column names to handle variations.
+        self.label_to_excel_column_map = {
+            'Name': 'Name',
+            'Class': 'Grade', # Map Class label on card to Grade column in Excel
+            'Contact': 'PhoneNumber', # Map Contact label on card to PhoneNumber column in Excel
+            'Address': 'Address',
+            'Guardian': 'Guardian',
+            'Validity': 'Validity',
+            'Roll No.': ['Roll No.', 'Roll No', 'RollNo', 'Roll Number', 'RollNumber'], # Multiple possible column names for Roll No.
+            'RegNo': ['RegNo', 'Reg No', 'Reg-No', 'Registration No', 'RegistrationNo'] # Added multiple possible column names for RegNo
+        }
+        
+        # Initialize font variables
+        self.font_path = None
+        self.fonts = {}  # Dictionary to store fonts for different fields
+        self.default_font = ImageFont.load_default()
+
+        # Photo/QR folder indexes, built once on first lookup
+        self.photo_index = None
+        self.qr_index = None
+
+    def __getstate__(self):
+        """Job settings, templates and folder indexes for an isolated render worker.
+
+        Callbacks, the GUI's PDF checkbox and the outputs of a running job stay behind;
+        caches are rebuilt empty in the worker.
+        """
+        state = self.__dict__.copy()
+        state.update(log_callback=None, error_callback=None, warning_callback=None, export_as_pdf_var=None,
+                     card_sink=None, thumbnail_cache=None, output_writer=None, render_workers=None,
+                     memory_budget=self.memory_budget.max_bytes if self.memory_budget else None,
+                     layout_cache=self.layout_cache.max_entries, text_runs=None, default_font=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.default_font = ImageFont.load_default()
+        self.memory_budget = MemoryBudget(self.memory_budget) if self.memory_budget else None
+        self.layout_cache = LayoutCache(self.load_route_layouts, self.layout_cache)
+        self.text_runs = TextRunCache()
+
+    def get_layouts(self):
+        """Return (side, CardLayout) for every side that is rendered."""
+        layouts = [('front', self.front_layout)]
+        if self.back_layout is not None:
+            layouts.append(('back', self.back_layout))
+        return layouts
+
+    @staticmethod
+    def normalize_route_value(value):
+        """Normalise a routing value: Excel numbers like 10.0 match '10', case is ignored."""
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip().lower()
+
+    def route_for_row(self, student_data):
+        """Return the template route key for a row, or None to use the main template."""
+        if not self._route_lookup:
+            return None
+        column = self.template_routes['column'].lower()
+        for key, value in student_data.items():
+            if str(key).lower() == column:
+                if pd.isna(value):
+                    return None
+                return self._route_lookup.get(self.normalize_route_value(value))
+        return None
+
+    def group_for_row(self, student_data):
+        """Return the page group of a row (its page_group_column value), or None."""
+        if not self.page_group_column:
+            return None
+        column = self.page_group_column.lower()
+        for key, value in student_data.items():
+            if str(key).lower() == column:
+                return self.cell_text(value)
+        return None
+
+    @staticmethod
+    def cell_text(value):
+        """A roster cell as text, e.g. for group names; None when blank."""
+        if pd.isna(value):
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)  # Excel reads 10 as 10.0
+        return str(value).strip() or None
+
+    def load_route_layouts(self, route):
+        """Load the (front, back) layouts of a routed template.
+
+        Coordinates default to the main template's; a route without its own back
+        template uses the main back side.
+        """
+        spec = self.template_routes['templates'][route]
+        front = CardLayout(spec['template'], spec.get('coordinates') or self.coordinates,
+                           default_photo=(293, 270), default_qr=(50, 50))
+        front.template.load()
+        if spec.get('back_template'):
+            back = CardLayout(spec['back_template'], spec.get('back_coordinates'), side='back')
+            back.template.load()
+        else:
+            back = self.back_layout
+
+        if spec.get('font_path'):
+            font_sizes = spec.get('font_sizes') or {field: getattr(font, 'size', 20) for field, font in self.fonts.items()}
+            for field, size in font_sizes.items():
+                try:
+                    front.fonts[field] = load_font(spec['font_path'], int(size))
+                except (OSError, ValueError) as e:
+                    self.log_callback(f"⚠️ Error loading font {spec['font_path']} for {field} on template '{route}': {e}")
+            if back is not None and back is not self.back_layout:
+                back.fonts = front.fonts
+        self.log_callback(f"🗂️ Loaded template '{route}': {os.path.basename(spec['template'])}")
+        return front, back
+
+    def get_route_layouts(self, route):
+        """Return the (front, back) layouts for a route key (None for the main template)."""
+        if route is None:
+            return self.front_layout, self.back_layout
+        return self.layout_cache.get(route)
+
+    def get_page_output_path(self, route, group=None):
+        """Path of the A4 page file for a template route and page group; each gets its own file.
+
+        The parts are labelled (all_id_cards_template-Staff_group-10.pdf) so a route and a
+        group with the same value do not share a file, and a value that is not a safe file
+        name is suffixed with a hash of it, so 'A/B' and 'A_B' do not either.
+        """
+        extension = "tif" if self.page_format == 'tiff' else "pdf"
+        parts = []
+        for label, value in (('template', route), ('group', group)):
+            if value is None:
+                continue
+            value = str(value)
+            slug = re.sub(r'[^\w.-]+', '_', value)
+            if slug != value:
+                slug += "-" + hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]
+            parts.append(f"{label}-{slug}")
+        if not parts:
+            return os.path.join(self.output_folder, f"all_id_cards.{extension}")
+        return os.path.join(self.output_folder, f"all_id_cards_{'_'.join(parts)}.{extension}")
+
+    def get_page_index_path(self):
+        return os.path.join(self.output_folder, "all_id_cards_index.csv")
+
+    def export_as_pdf(self):
+        """Whether to export the PDF; export_as_pdf_var may be a tk variable or a plain bool."""
+        var = self.export_as_pdf_var
+        return bool(var.get() if hasattr(var, 'get') else var)
+
+    def get_roster_index_path(self):
+        """Path of the on-disk roster index for the current Excel file.
+
+        The index is keyed by the Excel file's path, size and modification time, so
+        editing the workbook invalidates it automatically.
+        """
+        stat = os.stat(self.excel_path)
+        key = f"{os.path.abspath(self.excel_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        if self.sheets is not None:
+            key += f"|{self.sheets}|{json.dumps(self.column_aliases, sort_keys=True)}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(self.excel_path))[0]
+        return os.path.join(self.output_folder, ".roster_index", f"{name}-{digest}.pkl")
+
+    def load_roster(self):
+        """Load the roster DataFrame, from the on-disk roster index when it is current.
+
+        Parsing a large XLSX is the slow part of selecting rows, so the parsed roster
+        is pickled on first load and reused until the Excel file changes.
+        """
+        if not os.path.exists(self.excel_path):
+            raise FileNotFoundError(f"Excel file not found: {self.excel_path}")
+
+        index_path = self.get_roster_index_path()
+        if os.path.exists(index_path):
+            try:
+                df = pd.read_pickle(index_path)
+                self.log_callback(f"⚡ Loaded roster index: {os.path.basename(index_path)}")
+                return df
+            except Exception as e:
+                self.log_callback(f"⚠️ Could not read roster index ({str(e)}), re-reading Excel file")
+
+        self.log_callback(f"📖 Reading Excel file: {os.path.basename(self.excel_path)}")
+        df = self.read_roster_file()
+        try:
+            index_folder = os.path.dirname(index_path)
+            os.makedirs(index_folder, exist_ok=True)
+            # Remove indexes of older versions of this workbook
+            prefix = os.path.basename(index_path).rsplit('-', 1)[0] + '-'
+            for stale in os.listdir(index_folder):
+                if stale.startswith(prefix) and stale != os.path.basename(index_path):
+                    os.remove(os.path.join(index_folder, stale))
+            df.to_pickle(index_path)
+        except OSError as e:
+            self.log_callback(f"⚠️ Could not write roster index: {str(e)}")
+        return df
+
+    def read_roster_file(self):
+        """Parse the roster from the Excel file: its first sheet, or the merged sheets of a multi-sheet job."""
+        if self.sheets is None:
+            return read_roster(self.excel_path)
+        sheets = None if self.sheets == 'all' else self.sheets
+        return read_roster_sheets(self.excel_path, sheets, self.column_aliases, self.log_callback)
+
+    def select_rows(self, df):
+        """Apply the row selection, if any, to the roster DataFrame."""
+        if self.selection is None or self.selection.is_empty():
+            return df
+        ext_id_column = self.find_ext_id_key({column: None for column in df.columns})
+        selected = self.selection.apply(df, ext_id_column)
+        self.log_callback(f"🎯 Selected {len(selected)} of {len(df)} rows ({self.selection.describe()})")
+        return selected
+
+    def resolve_columns(self, df, names):
+        """Match column names case-insensitively against the roster's columns."""
+        columns = {str(column).lower(): column for column in df.columns}
+        missing = [name for name in names if name.lower() not in columns]
+        if missing:
+            raise ValueError(f"Column(s) not found in the roster: {', '.join(missing)}")
+        return [columns[name.lower()] for name in names]
+
+    @staticmethod
+    def sort_value(value):
+        """Sort key of one cell: numbers first (numeric text too, so Grade 9 comes before 10), then text, then blanks."""
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            return (2, 0.0, "")
+        try:
+            number = float(value)
+            if number == number:  # Not "nan" text
+                return (0, number, "")
+        except (TypeError, ValueError):
+            pass
+        return (1, 0.0, str(value).strip().casefold())
+
+    def row_sort_key(self, student_data, columns):
+        return tuple(self.sort_value(student_data[column]) for column in columns)
+
+    def iter_roster_rows(self, df, sort_columns=None):
+        """Yield (index, row dict) in render order: the roster's order, or sorted by sort_columns.
+
+        Ties keep their roster order (a stable sort over the loaded roster).
+        """
+        if not sort_columns:
+            for index, row in df.iterrows():
+                yield index, row.to_dict()
+            return
+        keys = [self.row_sort_key(student_data, sort_columns) for student_data in df[sort_columns].to_dict('records')]
+        order = sorted(range(len(df)), key=lambda position: (keys[position], position))
+        for index, row in df.iloc[order].iterrows():
+            yield index, row.to_dict()
+
+    def get_photo_index(self):
+        """Return the photo folder index, scanning the folder on first use."""
+        if self.photo_index is None:
+            self.photo_index = AssetIndex(self.photos_folder)
+        return self.photo_index
+
+    def get_qr_index(self):
+        """Return the QR code folder index, scanning the folder on first use."""
+        if self.qr_index is None:
+            self.qr_index = AssetIndex(self.qr_folder)
+        return self.qr_index
+
+    def get_student_name(self, student_data):
+        """Return the student's name from the roster row, or None."""
+        name_column = self.get_field_column(student_data, 'Name')
+        return student_data[name_column] if name_column else None
+
+    def prepare_fuzzy_matching(self, records):
+        """Plan fuzzy photo/QR matches for the whole roster up front.
+
+        Planning over all rows lets files that belong to another student by EXT_ID be
+        excluded, and lets students competing for the same file be detected.
+
+        Args:
+            records (list): Roster rows as dictionaries
+        """
+        students = []
+        for student_data in records:
+            ext_id_key = self.find_ext_id_key(student_data)
+            if ext_id_key and pd.notna(student_data.get(ext_id_key)):
+                students.append((str(student_data[ext_id_key]), self.get_student_name(student_data)))
+
+        for asset_label, index in (("photos", self.get_photo_index()), ("QR codes", self.get_qr_index())):
+            if not index.folder_exists:
+                continue
+            plan = index.plan_fuzzy_matches(students)
+            ambiguous = sum(1 for match in plan.values() if match.ambiguous)
+            self.log_callback(f"🔎 Fuzzy matching {asset_label}: {len(plan) - ambiguous} matched, {ambiguous} ambiguous")
+
+    def fuzzy_match_asset(self, index, ext_id, student_data):
+        """Fuzzy-match a student's EXT_ID and Name against a folder index. Returns a FuzzyMatch or None."""
+        if index.fuzzy_plan is not None:
+            return index.fuzzy_plan.get(ext_id)
+        return index.get_fuzzy_matcher().match(ext_id, self.get_student_name(student_data))
+
+    def find_asset(self, index, ext_id, student_data, asset_label):
+        """Find a student's photo or QR code file in a folder index.
+
+        When fuzzy_matching is enabled and no filename contains the EXT_ID, the
+        closest filename by EXT_ID or Name is used. Ambiguous fuzzy matches are
+        logged and skipped rather than guessed.
+
+        Args:
+            index (AssetIndex): Photo or QR code folder index
+            ext_id (str): Student EXT_ID
+            student_data (dict): Row data from the Excel file
+            asset_label (str): "photo" or "QR code", for log messages
+
+        Returns:
+            str: Full path of the file, or None
+        """
+        path = index.find(ext_id)
+        if path or not self.fuzzy_matching:
+            return path
+
+        match = self.fuzzy_match_asset(index, ext_id, student_data)
+        if match is None:
+            return None
+        if match.ambiguous:
+            runner_up, runner_up_score = match.alternatives[0]
+            self.log_callback(f"  ⚠️ Ambiguous {asset_label} match for {ext_id}: {match.filename} ({match.score:.2f}) "
+                              f"vs {runner_up} ({runner_up_score:.2f}). Not used.")
+            return None
+        self.log_callback(f"  🔎 Fuzzy-matched {asset_label} for {ext_id}: {match.filename} "
+                          f"(confidence {match.score:.2f}, matched on '{match.query}')")
+        return index.path(match.filename)
+
+    def set_font(self, font_path, font_sizes):
+        """Set custom fonts for different text fields.
+
+        Args:
+            font_path (str): Path to the .ttf or .otf font file
+            font_sizes (dict): Dictionary mapping field names to font sizes (ints or tk variables)
+        """
+        try:
+            self.font_path = font_path
+            # Create font objects for each field with their respective sizes
+            for field, size_var in font_sizes.items():
+                try:
+                    size = int(size_var.get() if hasattr(size_var, 'get') else size_var)
+                    self.fonts[field] = load_font(font_path, size)
+                    self.log_callback(f"✅ Set font size {size} for {field}")
+                except ValueError:
+                    self.log_callback(f"⚠️ Invalid font size for {field}, using default size")
+                    self.fonts[field] = load_font(font_path, 20)
+        except Exception as e:
+            self.log_callback(f"⚠️ Error loading font {font_path}: {str(e)}. Using default font.")
+            self.fonts = {field: self.default_font for field in font_sizes.keys()}
+
+    def get_font_for_field(self, field, layout=None):
+        """Get the appropriate font for a given field (a routed template's own font first)."""
+        if layout is not None and field in layout.fonts:
+            return layout.fonts[field]
+        return self.fonts.get(field, self.default_font)
+
+    def draw_text(self, card, xy, text, fill, font):
+        """Draw text like ImageDraw.text, pasting the shaped run from the text run cache.
+
+        Complex-script text is drawn with shaping_font (at the field font's size) when
+        one is set, and a missing libraqm is reported once per job.
+        """
+        if needs_shaping(text):
+            if not has_raqm() and not self._shaping_warned:
+                self._shaping_warned = True
+                self.log_callback("⚠️ Complex-script text (e.g. Devanagari) found but Pillow has no libraqm; "
+                                  "it will render without shaping. Install libraqm/FriBiDi to fix this.")
+            if self.shaping_font:
+                font = load_font(self.shaping_font, int(getattr(font, 'size', 20)))
+        if '\n' in text or card.mode not in ('RGB', 'RGBA', 'L'):
+            ImageDraw.Draw(card).text(xy, text, fill=fill, font=font)
+            return
+        mask, (left, top) = self.text_runs.get(font, text)
+        card.paste(fill, (xy[0] + left, xy[1] + top), mask)
+
+    def find_ext_id_key(self, student_data):
+        """Find the actual dictionary key for 'ext_id' case-insensitively, or None."""
+        for key in student_data.keys():
+            if str(key).lower() in EXT_ID_COLUMN_NAMES:
+                return key
+        return None
+
+    def get_field_column(self, student_data, field):
+        """Return the roster column holding a value for a card field, or None.
+
+        Args:
+            student_data (dict): Row data from the Excel file
+            field (str): Card label, e.g. 'Name' or 'Roll No.'
+        """
+        excel_column_key = self.label_to_excel_column_map.get(field)
+
+        # Handle cases where the mapping value is a list of possible column names
+        if isinstance(excel_column_key, list):
+            for possible_key in excel_column_key:
+                # Check if the possible column name exists in the student_data dictionary (from the Excel row)
+                if possible_key in student_data and pd.notna(student_data[possible_key]):
+                    return possible_key  # Found a valid column name, no need to check others
+            return None
+
+        if excel_column_key and excel_column_key in student_data and pd.notna(student_data[excel_column_key]):
+            return excel_column_key
+        return None
+
+    def format_validity(self, value):
+        """Format a Validity value as YYYY-MM-DD. Raises ValueError if it cannot be parsed."""
+        # Attempt to parse and format date, handle different input types
+        if isinstance(value, str):
+            date_value = pd.to_datetime(value)
+        elif isinstance(value, pd.Timestamp):
+            date_value = value
+        else:
+            raise ValueError("Value is not a string or Timestamp")  # Indicate failure for other types
+        return date_value.strftime('%Y-%m-%d')  # Format date as YYYY-MM-DD
+
+    def get_barcode_value(self, student_data, ext_id_key):
+        """Return the text a row's barcode encodes (its barcode_column, else EXT_ID), or None."""
+        column = ext_id_key
+        if self.barcode_column:
+            column = next((key for key in student_data if str(key).lower() == self.barcode_column.lower()), None)
+        value = student_data.get(column) if column else None
+        if value is None or pd.isna(value):
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)  # Excel reads 1001 as 1001.0
+        return str(value).strip() or None
+
+    def inspect_image_header(self, image_path, index=None):
+        """Read an image's header without decoding pixels.
+
+        Args:
+            index (AssetIndex): Index the path came from, needed for archive members
+
+        Returns:
+            dict: 'format', 'size' and 'bytes', plus 'error' if the file cannot be identified
+        """
+        info = {'format': None, 'size': None, 'bytes': None}
+        try:
+            info['bytes'] = index.getsize(image_path) if index is not None else os.path.getsize(image_path)
+            # Image.open only parses the header; pixel data is decoded lazily on load()
+            with (index.open_image(image_path) if index is not None else Image.open(image_path)) as img:
+                info['format'] = img.format
+                info['size'] = img.size
+        except (Image.UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+            info['error'] = str(e) or type(e).__name__
+        return info
+
+    def preflight_scan(self, report_path=None):
+        """Dry-run a job: cross-check every roster row against the assets without rendering.
+
+        Only the roster columns the card uses are read, and images are inspected by
+        header only. Reports empty/duplicate IDs, missing or ambiguous photos and QR
+        codes, oversized or corrupt images, unparseable Validity values, barcodes that
+        cannot be encoded or do not fit, and text that would run past the right edge
+        of the template.
+
+        Args:
+            report_path (str): Optional path to write the JSON report to
+
+        Returns:
+            dict: The report, with 'summary', 'rows' and 'assets' sections
+        """
+        start_time = time.perf_counter()
+
+        if not os.path.exists(self.excel_path):
+            raise FileNotFoundError(f"Excel file not found: {self.excel_path}")
+
+        # Only read the columns the card actually uses
+        wanted_columns = set()
+        for required_cols in self.label_to_excel_column_map.values():
+            wanted_columns.update(required_cols if isinstance(required_cols, list) else [required_cols])
+        barcode_column = (self.barcode_column or '').lower()
+        route_column = self.template_routes['column'].lower() if self._route_lookup else ''
+        use_column = lambda col: (col in wanted_columns or str(col).lower() in EXT_ID_COLUMN_NAMES
+                                  or str(col).lower() in (barcode_column, route_column))
+
+        index_path = self.get_roster_index_path()
+        if os.path.exists(index_path) or self.sheets is not None or (self.selection is not None and not self.selection.is_empty()):
+            # Row queries may use any column, merged sheets need their headings resolved first,
+            # and a current roster index is faster than the XLSX
+            df = self.load_roster()
+        else:
+            df = read_roster(self.excel_path, usecols=use_column)
+        self.log_callback(f"📖 Pre-flight: read {len(df)} rows, columns: {', '.join(map(str, df.columns))}")
+
+        photo_index = self.get_photo_index()
+        qr_index = self.get_qr_index()
+        self.log_callback(f"🗂️ Pre-flight: indexed {len(photo_index)} photos and {len(qr_index)} QR codes")
+
+        records = df.to_dict('records')
+        if self.fuzzy_matching:
+            self.prepare_fuzzy_matching(records)
+
+        selected = self.select_rows(df)
+        df = selected[[col for col in selected.columns if use_column(col)]]
+        records = df.to_dict('records')
+
+        asset_issues = {}  # Asset path -> list of issues, each asset is inspected only once
+        inspected_assets = set()
+
+        def check_asset(path, index):
+            if path in inspected_assets:
+                return asset_issues.get(path, [])
+            inspected_assets.add(path)
+            info = self.inspect_image_header(path, index)
+            issues = []
+            if 'error' in info:
+                issues.append({'type': 'corrupt_image', 'detail': info['error']})
+            else:
+                width, height = info['size']
+                if width * height > PREFLIGHT_MAX_IMAGE_PIXELS:
+                    issues.append({'type': 'oversized_image', 'detail': f"{width}x{height} pixels"})
+            if info['bytes'] is not None and info['bytes'] > PREFLIGHT_MAX_FILE_BYTES:
+                issues.append({'type': 'oversized_file', 'detail': f"{info['bytes']} bytes"})
+            if issues:
+                asset_issues[path] = issues
+            return issues
+
+        route_checks = {}  # Route -> (text fields of every side: (side, layout, field, x, template width), has a barcode)
+
+        def checks_for_route(route):
+            # Each row is checked against the template it is routed to, as when generating
+            if route not in route_checks:
+                layouts = [(side, layout) for side, layout in zip(('front', 'back'), self.get_route_layouts(route)) if layout is not None]
+                text_fields = [(side, layout, field, x, layout.width)
+                               for side, layout in layouts
+                               for field, (x, y) in layout.text_coordinates.items()]
+                route_checks[route] = text_fields, any(layout.barcode_coordinates is not None for _, layout in layouts)
+            return route_checks[route]
+
+        validity_cache = {}
+        seen_ids = {}
+        row_reports = []
+
+        for index, student_data in zip(df.index, records):
+            row_number = int(index) + 1
+            issues = []
+
+            ext_id_key = self.find_ext_id_key(student_data)
+            if not ext_id_key or pd.isna(student_data.get(ext_id_key)):
+                row_reports.append({'row': row_number, 'ext_id': None,
+                                    'issues': [{'type': 'empty_id', 'detail': "'EXT_ID' not found or is empty"}]})
+                continue
+            ext_id = str(student_data[ext_id_key])
+
+            if ext_id in seen_ids:
+                issues.append({'type': 'duplicate_id', 'detail': f"Same EXT_ID as row {seen_ids[ext_id]}"})
+            else:
+                seen_ids[ext_id] = row_number
+
+            for asset_name, index_for_asset in (('photo', photo_index), ('qr', qr_index)):
+                if not index_for_asset.folder_exists:
+                    issues.append({'type': f'missing_{asset_name}', 'detail': f"Folder not found: {index_for_asset.folder}"})
+                    continue
+                matches = index_for_asset.find_all(ext_id)
+                if not matches and self.fuzzy_matching:
+                    fuzzy = self.fuzzy_match_asset(index_for_asset, ext_id, student_data)
+                    if fuzzy:
+                        issues.append({'type': f'ambiguous_{asset_name}_match' if fuzzy.ambiguous else f'fuzzy_{asset_name}_match',
+                                       'detail': f"{fuzzy.filename} matched on '{fuzzy.query}'",
+                                       'confidence': fuzzy.score,
+                                       'alternatives': [{'file': name, 'confidence': score} for name, score in fuzzy.alternatives]})
+                        if not fuzzy.ambiguous:
+                            matches = [fuzzy.filename]
+                if not matches:
+                    issues.append({'type': f'missing_{asset_name}', 'detail': f"No file matching '{ext_id}'"})
+                    continue
+                if len(matches) > 1:
+                    issues.append({'type': f'duplicate_{asset_name}', 'detail': f"{len(matches)} files match: {', '.join(matches[:5])}"})
+                for asset_issue in check_asset(index_for_asset.path(matches[0]), index_for_asset):
+                    issues.append({'type': f"{asset_name}_{asset_issue['type']}", 'detail': f"{matches[0]}: {asset_issue['detail']}"})
+
+            route = self.route_for_row(student_data)
+            text_fields, has_barcode = checks_for_route(route)
+            validity_reported = False
+            for side, layout, field, x, template_width in text_fields:
+                column = self.get_field_column(student_data, field)
+                if not column:
+                    continue
+                value = student_data[column]
+                if field == 'Validity':
+                    # Validity dates repeat across the roster, so each distinct value is parsed once
+                    if value not in validity_cache:
+                        try:
+                            validity_cache[value] = (self.format_validity(value), None)
+                        except Exception as date_error:
+                            validity_cache[value] = (str(value), str(date_error))
+                    text_data, date_error = validity_cache[value]
+                    if date_error and not validity_reported:
+                        validity_reported = True
+                        issues.append({'type': 'bad_validity', 'field': field, 'detail': f"{value!r}: {date_error}"})
+                else:
+                    text_data = str(value)
+
+                # Measure with the font draw_text renders with: the layout's own font, or
+                # shaping_font for complex-script text
+                field_font = self.get_font_for_field(field, layout)
+                if self.shaping_font and needs_shaping(text_data):
+                    field_font = load_font(self.shaping_font, int(getattr(field_font, 'size', 20)))
+                # Skip measuring text that cannot reach the edge even if every glyph were 1.5em wide
+                font_size = getattr(field_font, 'size', None)
+                if font_size and x + len(text_data) * font_size * 1.5 <= template_width:
+                    continue
+                text_width = field_font.getlength(text_data)
+                if x + text_width > template_width:
+                    template = f"'{route}' {side}" if route is not None else side
+                    issues.append({'type': 'text_overflow', 'field': field, 'side': side,
+                                   'detail': f"'{text_data}' is {int(text_width)}px wide, "
+                                             f"{int(x + text_width - template_width)}px past the {template} template edge"})
+
+            if has_barcode:
+                barcode_value = self.get_barcode_value(student_data, ext_id_key)
+                if barcode_value is None:
+                    issues.append({'type': 'missing_barcode', 'detail': f"No value in column '{self.barcode_column or ext_id_key}'"})
+                else:
+                    try:
+                        render_code128(barcode_value, *self.barcode_size)
+                    except ValueError as e:
+                        issues.append({'type': 'bad_barcode', 'detail': str(e)})
+
+            if issues:
+                row_reports.append({'row': row_number, 'ext_id': ext_id, 'issues': issues})
+
+        issue_counts = {}
+        for row_report in row_reports:
+            for issue in row_report['issues']:
+                issue_counts[issue['type']] = issue_counts.get(issue['type'], 0) + 1
+
+        elapsed = time.perf_counter() - start_time
+        report = {
+            'summary': {
+                'excel_path': self.excel_path,
+                'rows_scanned': len(df),
+                'rows_with_issues': len(row_reports),
+                'asset_issues': len(asset_issues),
+                'assets_inspected': len(inspected_assets),
+                'issue_counts': issue_counts,
+                'elapsed_seconds': round(elapsed, 3),
+            },
+            'rows': row_reports,
+            'assets': [{'path': path, 'issues': issues} for path, issues in asset_issues.items()],
+        }
+
+        if report_path:
+            os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, default=str)
+            self.log_callback(f"📝 Pre-flight report written to: {report_path}")
+
+        self.log_callback(f"🔍 Pre-flight finished in {elapsed:.2f}s: {len(row_reports)} of {len(df)} rows have issues, "
+                          f"{len(asset_issues)} problem assets")
+        for issue_type, count in sorted(issue_counts.items()):
+            self.log_callback(f"  • {issue_type}: {count}")
+        return report
 
     def create_circular_mask(self, image):
         """Create a circular mask for the photo."""
@@ -988,37 +4190,61 @@ class IDCardGenerator:
         draw.ellipse((0, 0, image.size[0], image.size[1]), fill=255)
         return mask
 
+    def get_photo_mask(self):
+        """Return the circle photo mask with its border ring, building it on first use.
+
+        The mask only depends on the photo size and border settings, so it is shared
+        by every card in the job.
+        """
+        if self._photo_mask is None:
+            # Create a circular mask with border
+            mask = Image.new('L', self.photo_size, 0)
+            draw = ImageDraw.Draw(mask)
+
+            # Draw the main circle
+            draw.ellipse((0, 0) + self.photo_size, fill=255)
+
+            # Create border mask
+            border_mask = Image.new('L', self.photo_size, 0)
+            border_draw = ImageDraw.Draw(border_mask)
+
+            # Draw border circle
+            border_draw.ellipse((0, 0) + self.photo_size, outline=self.border_color, width=self.border_size)
+
+            # Combine masks
+            final_mask = Image.new('L', self.photo_size, 0)
+            final_mask.paste(mask, (0, 0), mask)
+            final_mask.paste(border_mask, (0, 0), border_mask)
+            self._photo_mask = final_mask
+        return self._photo_mask
+
+    def load_photo(self, photo_path):
+        """Open a photo and resize it to the photo size."""
+        photo = self.get_photo_index().open_image(photo_path)
+        if self.memory_budget is None:
+            return resize_for_stage(photo, self.photo_size, 'photo', self.resampling_preset)
+
+        # Under a memory budget, let JPEGs decode at a reduced scale (still at least twice
+        # the photo size) and refuse oversized images before decoding them
+        photo.draft(None, (self.photo_size[0] * 2, self.photo_size[1] * 2))
+        nbytes = self.memory_budget.check_decode(photo, photo_path)
+        self.memory_budget.reserve('photos', nbytes)
+        try:
+            return resize_for_stage(photo, self.photo_size, 'photo', self.resampling_preset)
+        finally:
+            self.memory_budget.release('photos', nbytes)
+
     def process_photo(self, photo_path):
         """Process a photo by resizing it and applying the selected frame style."""
         try:
             # Open and resize the photo
-            photo = Image.open(photo_path)
-            photo = photo.resize(self.photo_size, Image.Resampling.LANCZOS)
-            
+            photo = self.load_photo(photo_path)
+
             if self.photo_frame_style == "circle":
-                # Create a circular mask with border
-                mask = Image.new('L', self.photo_size, 0)
-                draw = ImageDraw.Draw(mask)
-                
-                # Draw the main circle
-                draw.ellipse((0, 0) + self.photo_size, fill=255)
-                
-                # Create border mask
-                border_mask = Image.new('L', self.photo_size, 0)
-                border_draw = ImageDraw.Draw(border_mask)
-                
-                # Draw border circle
-                border_draw.ellipse((0, 0) + self.photo_size, outline=self.border_color, width=self.border_size)
-                
-                # Combine masks
-                final_mask = Image.new('L', self.photo_size, 0)
-                final_mask.paste(mask, (0, 0), mask)
-                final_mask.paste(border_mask, (0, 0), border_mask)
-                
                 # Apply the mask
                 output = Image.new('RGBA', self.photo_size, (0, 0, 0, 0))
                 output.paste(photo, (0, 0))
-                output.putalpha(final_mask)
+                output.putalpha(self.get_photo_mask())
                 
                 return output
             else:
@@ -1035,7 +4261,7 @@ class IDCardGenerator:
                     inner_size = (self.photo_size[0] - 2 * self.border_size, 
                                 self.photo_size[1] - 2 * self.border_size)
                     # Resize photo to fit inside border
-                    inner_photo = photo.resize(inner_size, Image.Resampling.LANCZOS)
+                    inner_photo = resize_for_stage(photo, inner_size, 'photo', self.resampling_preset)
                     # Paste photo in center
                     paste_x = (self.photo_size[0] - inner_size[0]) // 2
                     paste_y = (self.photo_size[1] - inner_size[1]) // 2
@@ -1046,12 +4272,71 @@ class IDCardGenerator:
             self.log_callback(f"⚠️ Error processing photo {os.path.basename(photo_path)}: {str(e)}")
             return None
 
+    def create_shared_buffers(self, card_slots=0):
+        """Put the decoded templates and the photo mask in shared memory for worker processes.
+
+        Keys are 'template_front', 'template_back' (double-sided jobs) and 'photo_mask';
+        each card slot holds a card of the largest side (cards of bigger routed templates
+        are pickled instead).
+        """
+        layouts = self.get_layouts()
+        images = {f"template_{side}": layout.template for side, layout in layouts}
+        images['photo_mask'] = self.get_photo_mask()
+        card_bytes = max(layout.width * layout.height * 4 for _, layout in layouts)
+        buffers = SharedImageBuffers.create(images, card_slots, card_bytes)
+        self.log_callback(f"🧠 Shared {len(buffers.entries)} decoded images and {card_slots} card slots "
+                          f"({format_bytes(buffers.shm.size)}) with worker processes")
+        return buffers
+
+    def render_cards(self, entries, route=None):
+        """Render cards for a list of (student_data, photo_path, ext_id_key) entries.
+
+        All entries use the template of one route (None for the main template).
+
+        Returns:
+            list: (front, back) per entry; back is None for single-sided jobs or when
+                  the front failed. Both sides share the row's loaded photo and QR code.
+        """
+        front_layout, back_layout = self.get_route_layouts(route)
+        cards = []
+        for student_data, photo_path, ext_id_key in entries:
+            assets = {}
+            front = self.generate_id_card(student_data, photo_path, ext_id_key, layout=front_layout, assets=assets)
+            back = None
+            if front is not None and back_layout is not None:
+                back = self.generate_id_card(student_data, photo_path, ext_id_key, layout=back_layout, assets=assets)
+            cards.append((front, back))
+        return cards
+
+    def render_card_by_id(self, ext_id):
+        """Re-render one student's card at full size, e.g. for the results gallery.
+
+        Returns:
+            tuple: (front, back) as from render_cards
+
+        Raises:
+            ValueError: If no roster row has this EXT_ID
+        """
+        df = self.load_roster()
+        ext_id_column = self.find_ext_id_key({column: None for column in df.columns})
+        if ext_id_column is None:
+            raise ValueError("The roster has no EXT_ID column")
+        matches = df[df[ext_id_column].astype(str) == str(ext_id)]
+        if matches.empty:
+            raise ValueError(f"No roster row has EXT_ID {ext_id}")
+        student_data = matches.iloc[0].to_dict()
+        photo_index = self.get_photo_index()
+        photo_path = self.find_asset(photo_index, str(ext_id), student_data, "photo") if photo_index.folder_exists else None
+        return self.render_cards([(student_data, photo_path, ext_id_column)], self.route_for_row(student_data))[0]
+
     def process_qr_code(self, qr_path):
         """Process a QR code image by resizing it."""
         try:
             # Open and resize the QR code
-            qr_image = Image.open(qr_path)
-            qr_image = qr_image.resize(self.qr_size, Image.Resampling.LANCZOS)
+            qr_image = self.get_qr_index().open_image(qr_path)
+            if self.memory_budget is not None:
+                self.memory_budget.check_decode(qr_image, qr_path)
+            qr_image = resize_for_stage(qr_image, self.qr_size, 'qr', self.resampling_preset)
             return qr_image
         except Exception as e:
             self.log_callback(f"⚠️ Error processing QR code {os.path.basename(qr_path)}: {str(e)}")
@@ -1078,108 +4363,118 @@ class IDCardGenerator:
             
             # Create QR code image
             qr_image = qr.make_image(fill_color="black", back_color="white")
-            qr_image = qr_image.resize(self.qr_size, Image.Resampling.LANCZOS)
+            qr_image = resize_for_stage(qr_image, self.qr_size, 'qr', self.resampling_preset)
             return qr_image
         except Exception as e:
             self.log_callback(f"⚠️ Error generating QR code: {str(e)}")
             return None
 
-    def generate_id_card(self, student_data, photo_path, ext_id_key):
-        """Generate a single ID card."""
+    def generate_id_card(self, student_data, photo_path, ext_id_key, layout=None, assets=None):
+        """Generate a single ID card.
+
+        Args:
+            layout (CardLayout): Side to render; defaults to the front
+            assets (dict): Photo/QR code already loaded for this row by the other side, filled in as loaded
+        """
         try:
+            layout = layout or self.front_layout
+            is_back = layout.side == 'back'
+            assets = {} if assets is None else assets
             student_id = student_data.get(ext_id_key, 'Unknown')
-            self.log_callback(f"🔄 Processing student: {student_id}")
-            
-            # Create a copy of the template
-            id_card = self.template.copy()
-            
+            self.log_callback(f"🔄 Processing student: {student_id}" + (" (back side)" if is_back else ""))
+
             photo_added = False
-            # Process and paste the photo
-            if photo_path and os.path.exists(photo_path):
-                photo = self.process_photo(photo_path)
+            if layout.photo_coordinates is None:
+                # This side has no photo
+                id_card = layout.new_card()
+            elif photo_path and self.get_photo_index().exists(photo_path):
+                # Create a copy of the template
+                id_card = layout.new_card()
+
+                # Process and paste the photo (loaded once per row for both sides)
+                if 'photo' not in assets:
+                    assets['photo'] = self.process_photo(photo_path)
+                photo = assets['photo']
                 if photo:
                     # Calculate center-aligned coordinates for photo
-                    photo_x = self.photo_coordinates[0] - (self.photo_size[0] // 2)
-                    photo_y = self.photo_coordinates[1] - (self.photo_size[1] // 2)
+                    photo_x = layout.photo_coordinates[0] - (self.photo_size[0] // 2)
+                    photo_y = layout.photo_coordinates[1] - (self.photo_size[1] // 2)
                     id_card.paste(photo, (photo_x, photo_y), photo) # Use photo with alpha channel for pasting
                     self.log_callback(f"  ✅ Photo added for {student_id}")
                     photo_added = True
             else:
+                id_card = layout.new_card()
                 self.log_callback(f"  ⚠️ Photo not found for student {student_id}")
-            
+
             qr_added = False
-            # Look for and paste QR code
-            ext_id = student_data.get(ext_id_key, 'Unknown')
-            qr_path = None
-            # Search for QR code file case-insensitively in the specified folder
-            if os.path.exists(self.qr_folder):
-                for filename in os.listdir(self.qr_folder):
-                    if ext_id.lower() in filename.lower() and filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                        qr_path = os.path.join(self.qr_folder, filename)
-                        break
-            else:
-                 self.log_callback(f"  ⚠️ QR Codes Folder not found: {self.qr_folder}")
+            if layout.qr_coordinates is not None:
+                # Look for and paste QR code, searched for once per row
+                if 'qr' not in assets:
+                    ext_id = student_data.get(ext_id_key, 'Unknown')
+                    qr_path = None
+                    # Look up the QR code file case-insensitively in the folder index
+                    qr_index = self.get_qr_index()
+                    if qr_index.folder_exists:
+                        qr_path = self.find_asset(qr_index, str(ext_id), student_data, "QR code")
+                    else:
+                         self.log_callback(f"  ⚠️ QR Codes Folder not found: {self.qr_folder}")
+                    assets['qr'] = self.process_qr_code(qr_path) if qr_path and qr_index.exists(qr_path) else None
 
-            
-            if qr_path and os.path.exists(qr_path):
-                qr_image = self.process_qr_code(qr_path)
+                qr_image = assets['qr']
                 if qr_image:
                     # Calculate center-aligned coordinates for QR code
-                    qr_x = self.qr_coordinates[0] - (self.qr_size[0] // 2)
-                    qr_y = self.qr_coordinates[1] - (self.qr_size[1] // 2)
+                    qr_x = layout.qr_coordinates[0] - (self.qr_size[0] // 2)
+                    qr_y = layout.qr_coordinates[1] - (self.qr_size[1] // 2)
                     id_card.paste(qr_image, (qr_x, qr_y)) # QR images are typically RGB/L, no mask needed
                     self.log_callback(f"  ✅ QR code added for {student_id}")
                     qr_added = True
-            else:
-                self.log_callback(f"  ⚠️ QR code not found for student {student_id}")
+                else:
+                    self.log_callback(f"  ⚠️ QR code not found for student {student_id}")
+
+            barcode_added = False
+            if layout.barcode_coordinates is not None:
+                barcode_value = self.get_barcode_value(student_data, ext_id_key)
+                if barcode_value is None:
+                    self.log_callback(f"  ⚠️ No barcode value for student {student_id}")
+                else:
+                    try:
+                        # Rendered once per value at its final size, so the bars stay sharp
+                        barcode = render_code128(barcode_value, *self.barcode_size)
+                        barcode_x = layout.barcode_coordinates[0] - (barcode.width // 2)
+                        barcode_y = layout.barcode_coordinates[1] - (barcode.height // 2)
+                        id_card.paste(barcode, (barcode_x, barcode_y))
+                        self.log_callback(f"  ✅ Barcode added for {student_id}: {barcode_value}")
+                        barcode_added = True
+                    except ValueError as e:
+                        self.log_callback(f"  ⚠️ Could not add barcode for student {student_id}: {str(e)}")
             
             # Add text information
-            draw = ImageDraw.Draw(id_card)
             
             # Sort coordinates by y-axis to process text fields roughly top-to-bottom
-            sorted_coords = sorted(self.text_coordinates.items(), key=lambda item: item[1][1])
+            sorted_coords = sorted(layout.text_coordinates.items(), key=lambda item: item[1][1])
 
             text_added_count = 0
             # Draw text for each defined coordinate label
             for field, (x, y) in sorted_coords:
                 try:
                     # Check if a coordinate is set for this field label
-                    if field not in self.text_coordinates:
+                    if field not in layout.text_coordinates:
                         # This case should ideally be caught before generation, but adding a check here for robustness
                         self.log_callback(f"  ⚠️ Coordinate not set for field '{field}', skipping text placement.")
                         continue
                         
                     # Find the actual column name in the Excel file corresponding to the card label
                     excel_column_key = self.label_to_excel_column_map.get(field)
+                    actual_excel_key_in_dict = self.get_field_column(student_data, field)
 
-                    # Handle cases where the mapping value is a list of possible column names
-                    if isinstance(excel_column_key, list):
-                        found_key = None
-                        for possible_key in excel_column_key:
-                            # Check if the possible column name exists in the student_data dictionary (from the Excel row)
-                            if possible_key in student_data and pd.notna(student_data[possible_key]):
-                                found_key = possible_key
-                                break # Found a valid column name, no need to check others
-                        actual_excel_key_in_dict = found_key
-                    else:
-                        # If the mapping value is not a list, use it directly as the column name
-                        actual_excel_key_in_dict = excel_column_key
-                    
                     # If the column name was found and exists in the student data
-                    if actual_excel_key_in_dict and actual_excel_key_in_dict in student_data and pd.notna(student_data[actual_excel_key_in_dict]):
+                    if actual_excel_key_in_dict:
                         value = student_data[actual_excel_key_in_dict]
-                        
+
                         # Special handling for Validity date to format it
                         if field == 'Validity':
                             try:
-                                # Attempt to parse and format date, handle different input types
-                                if isinstance(value, str):
-                                    date_value = pd.to_datetime(value)
-                                elif isinstance(value, pd.Timestamp):
-                                     date_value = value
-                                else:
-                                    raise ValueError("Value is not a string or Timestamp") # Indicate failure for other types
-                                text_data = date_value.strftime('%Y-%m-%d') # Format date as YYYY-MM-DD
+                                text_data = self.format_validity(value)
                             except Exception as date_error:
                                 # If date conversion/formatting fails, use the original value as string and log warning
                                 text_data = str(value)
@@ -1198,10 +4493,10 @@ class IDCardGenerator:
                             self.log_callback(f"  ⚠️ Error getting font color: {color_error}. Using default black.")
 
                         # Get the appropriate font for this field
-                        field_font = self.get_font_for_field(field)
+                        field_font = self.get_font_for_field(field, layout)
                         
                         # Draw the text on the card with the field-specific font
-                        draw.text((x, y), text_data, fill=font_color, font=field_font)
+                        self.draw_text(id_card, (x, y), text_data, font_color, field_font)
                         text_added_count += 1
                         self.log_callback(f"  ✅ Added text for '{field}': '{text_data}'")
                     else:
@@ -1214,8 +4509,12 @@ class IDCardGenerator:
                     continue
 
             # Check if at least one element (text, photo, or QR) was successfully added to the card
-            if text_added_count > 0 or photo_added or qr_added:
-                self.log_callback(f"  ✅ Card generated for {student_id} with {text_added_count} text fields, Photo added: {photo_added}, QR added: {qr_added}")
+            if text_added_count > 0 or photo_added or qr_added or barcode_added:
+                self.log_callback(f"  ✅ Card generated for {student_id} with {text_added_count} text fields, Photo added: {photo_added}, QR added: {qr_added}, Barcode added: {barcode_added}")
+                return id_card
+            elif is_back:
+                # A back side may legitimately be the template artwork alone (rules, contact info)
+                self.log_callback(f"  ✅ Back side for {student_id} uses the template artwork only")
                 return id_card
             else:
                 # If nothing could be added to the card, return None
@@ -1228,16 +4527,376 @@ class IDCardGenerator:
             self.log_callback(f"  ❌ Critical error generating ID card for {student_id_for_log}: {str(e)}")
             return None # Return None if a critical error occurred
 
+    def _flush_pending_cards(self, pending, spools, route=None, group=None, rendered=None):
+        """Render queued rows of one template route and page group and hand the cards to its page spool.
+
+        Args:
+            spools (dict): (route, group) -> PageSpool, filled in as they appear; None when not exporting pages
+            rendered (list): EXT_IDs of successful cards are appended to it
+
+        Returns:
+            tuple: (successful, failed) card counts. The pending list is cleared.
+        """
+        successful = failed = 0
+        if not pending:
+            return successful, failed
+        spool = None
+        if spools is not None:
+            if (route, group) not in spools:
+                spill_name = "_".join(str(part) for part in (route, group) if part is not None) or 'main'
+                spill_folder = os.path.join(self.output_folder, ".page_spill", re.sub(r'[^\w.-]+', '_', spill_name))
+                spools[route, group] = PageSpool(self, spill_folder, route, group)
+            spool = spools[route, group]
+        back_layout = self.get_route_layouts(route)[1]
+        if self.render_workers is not None:
+            cards = self.render_workers.render(pending, route)
+        else:
+            cards = self.render_cards(pending, route)
+        for (student_data, _, ext_id_key), (generated_card_image, back_image) in zip(pending, cards):
+            ext_id = str(student_data[ext_id_key])
+            if generated_card_image:
+                if self.thumbnail_cache is not None:
+                    self.thumbnail_cache.add(generated_card_image, ext_id)
+                if self.output_writer is not None:
+                    self.output_writer.add(generated_card_image, ext_id)
+                    if back_image is not None:
+                        self.output_writer.add(back_image, ext_id, side='back')
+                if self.card_sink is not None:
+                    self.card_sink.add(generated_card_image, ext_id, student_data)
+                    if back_image is not None:
+                        self.card_sink.add(back_image, ext_id, student_data, side='back')
+                if spool is not None:
+                    if back_layout is not None and back_image is None:
+                        # Keep fronts and backs paired: fall back to the bare back template
+                        self.log_callback(f"  ⚠️ Back side failed for {ext_id}, using the plain back template")
+                        back_image = back_layout.new_card()
+                    spool.add(generated_card_image, back_image, ext_id)
+                    self.log_callback(f"  ✅ Generated image for {ext_id} (added to PDF list)")
+                else:
+                    self.log_callback(f"  ✅ Generated image for {ext_id}")
+                if rendered is not None:
+                    rendered.append(ext_id)
+                successful += 1
+            else:
+                # If generate_id_card returned None (due to error or no data added)
+                self.log_callback(f"  ❌ Failed to generate card for {ext_id} (generate_id_card returned None)")
+                failed += 1
+        pending.clear()
+        return successful, failed
+
+    def plan_a4_page(self, card_size, mirror=None):
+        """Work out where each slot's card goes on an A4 landscape page in a 5x2 grid.
+
+        Args:
+            card_size (tuple): Size of the cards (all cards of a template share it)
+            mirror (str): None for front pages; 'long' or 'short' to mirror the grid for
+                          the back pages of a duplex job flipped on that edge
+
+        Returns:
+            list: (paste_x, paste_y, width, height) per slot, in slot order
+        """
+        a4_width_px, a4_height_px = A4_PAGE_SIZE
+        num_cols, num_rows = A4_GRID
+
+        # Calculate space for each card, including padding
+        card_slot_width = a4_width_px // num_cols
+        card_slot_height = a4_height_px // num_rows
+        card_padding_px = A4_CARD_PADDING
+
+        # Resize card image to fit within the slot while maintaining aspect ratio
+        # Calculate the maximum possible dimensions for the card while fitting within the slot, considering padding
+        max_card_width = card_slot_width - 2 * card_padding_px
+        max_card_height = card_slot_height - 2 * card_padding_px
+        
+        self.log_callback(f"    📦 Max card size within padding (px): ({max_card_width}, {max_card_height})")
+
+        # Get original card image size
+        original_card_width, original_card_height = card_size
+        self.log_callback(f"    📏 Original card size (px): ({original_card_width}, {original_card_height})")
+
+        # Calculate scaling factor to fit within the slot
+        width_scale = max_card_width / original_card_width
+        height_scale = max_card_height / original_card_height
+
+        # Use the minimum scale factor to maintain aspect ratio
+        scale_factor = min(width_scale, height_scale)
+        self.log_callback(f"    🔎 Scaling factor: {scale_factor:.4f}")
+
+        # Calculate the new size for the card image
+        new_card_width = int(original_card_width * scale_factor)
+        new_card_height = int(original_card_height * scale_factor)
+        self.log_callback(f"    ✨ Resized card size (px): ({new_card_width}, {new_card_height})")
+
+        plan = []
+        for j in range(num_cols * num_rows):
+            col_index = j % num_cols
+            row_index = j // num_cols
+
+            # Calculate the top-left position of the current slot
+            slot_x = col_index * card_slot_width
+            slot_y = row_index * card_slot_height
+
+            # Calculate the paste position to center the resized card within its slot
+            paste_x = slot_x + (card_slot_width - new_card_width) // 2
+            paste_y = slot_y + (card_slot_height - new_card_height) // 2
+
+            # Back pages are mirrored so each card lands behind its front once the sheet is flipped:
+            # a long-edge flip turns the landscape sheet top-to-bottom, a short-edge flip left-to-right
+            if mirror == 'long':
+                paste_y = a4_height_px - paste_y - new_card_height
+            elif mirror == 'short':
+                paste_x = a4_width_px - paste_x - new_card_width
+            
+            self.log_callback(f"    📍 Slot ({col_index}, {row_index}) at ({slot_x}, {slot_y}): card at (px) ({paste_x}, {paste_y})")
+            plan.append((paste_x, paste_y, new_card_width, new_card_height))
+        return plan
+
+    def build_a4_page(self, cards, mirror=None, layout=None):
+        """Arrange up to one page of cards on an A4 landscape page in a 5x2 grid.
+
+        Args:
+            cards (list): Card images, in slot order
+            mirror (str): None for front pages; 'long' or 'short' to mirror the grid for
+                          the back pages of a duplex job flipped on that edge
+            layout (CardLayout): Template of the cards; its imposition plan is reused across pages
+
+        Returns:
+            PIL.Image: The A4 page
+        """
+        page_plans = layout.page_plans if layout is not None else {}
+        a4_page = Image.new('RGB', A4_PAGE_SIZE, (255, 255, 255)) # Create a blank white A4 landscape page
+
+        for j, card_img in enumerate(cards):
+            plan_key = (card_img.size, mirror)
+            if plan_key not in page_plans:
+                page_plans[plan_key] = self.plan_a4_page(card_img.size, mirror)
+            paste_x, paste_y, new_card_width, new_card_height = page_plans[plan_key][j]
+
+            # Resize the card image with the preset's page filter (LANCZOS for print)
+            resized_card = resize_for_stage(card_img, (new_card_width, new_card_height), 'page', self.resampling_preset)
+
+            # Paste the resized card image onto the A4 page
+            # Check if the resized_card has an alpha channel before pasting with mask
+            if resized_card.mode == 'RGBA':
+                 a4_page.paste(resized_card, (paste_x, paste_y), resized_card)
+            else:
+                 a4_page.paste(resized_card, (paste_x, paste_y))
+
+        return a4_page
+
+    def get_cmyk_transform(self):
+        """Build the sRGB -> CMYK ICC transform once per job; None without a profile."""
+        if self._cmyk_transform is None and self.cmyk_profile:
+            self._cmyk_transform = ImageCms.buildTransform(
+                ImageCms.createProfile('sRGB'), self.cmyk_profile, 'RGB', 'CMYK',
+                renderingIntent=ImageCms.Intent.RELATIVE_COLORIMETRIC)
+            self.log_callback(f"🎨 Built RGB → CMYK transform from {os.path.basename(self.cmyk_profile)}")
+        return self._cmyk_transform
+
+    def convert_page(self, page):
+        """Convert one A4 page to the output colour mode.
+
+        Returns:
+            tuple: (converted page, seconds taken)
+        """
+        start = time.perf_counter()
+        page = page.convert('RGB')
+        if self.color_mode == 'cmyk':
+            transform = self.get_cmyk_transform()
+            # Without an ICC profile Pillow's uncalibrated conversion is used
+            page = ImageCms.applyTransform(page, transform) if transform else page.convert('CMYK')
+        return page, time.perf_counter() - start
+
+    def convert_pages(self, pages, workers):
+        """Colour-convert pages on a thread pool, yielding (page, seconds) in order.
+
+        Pages are submitted as they are consumed, so at most workers + 1 are in flight.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            for page in pages:
+                in_flight.append(executor.submit(self.convert_page, page))
+                if len(in_flight) > workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def save_pages(self, pages, output_path, workers=None, count=None):
+        """Write A4 pages one at a time to a multi-page PDF or TIFF in the output colour mode.
+
+        Args:
+            pages (iterable): Page images; consumed lazily so pages need not all be in memory
+            workers (int): Colour conversion threads (default: up to OUTPUT_MAX_WORKERS)
+            count (int): Number of pages, needed up front for a PDF when pages is not a list
+
+        Returns:
+            int: Number of pages written
+        """
+        if self.color_mode == 'cmyk' and self.get_cmyk_transform() is None:
+            self.log_callback("⚠️ No CMYK ICC profile set; using Pillow's uncalibrated CMYK conversion")
+
+        start = time.perf_counter()
+        workers = workers or max(1, min(OUTPUT_MAX_WORKERS, os.cpu_count() or 1))
+        page_count = 0
+        convert_seconds = 0.0
+        append = self.append_pages and os.path.exists(output_path)
+        count = len(pages) if count is None else count
+
+        def converted():
+            nonlocal page_count, convert_seconds
+            for page, seconds in self.convert_pages(pages, workers):
+                page_count += 1
+                convert_seconds += seconds
+                yield page
+
+        if self.page_format == 'tiff':
+            tiff_writer = TiffImagePlugin.AppendingTiffWriter(output_path, new=not append)
+            try:
+                for page in converted():
+                    page.save(tiff_writer, format='TIFF', compression='tiff_lzw', dpi=(300, 300))
+                    tiff_writer.newFrame()
+            finally:
+                tiff_writer.close()
+        elif count:
+            # One save_all for the whole file: appending page by page makes Pillow re-parse the growing PDF each time
+            page_sequence_class()(converted(), count).save(output_path, format='PDF', save_all=True, append=append)
+
+        if page_count:
+            elapsed = time.perf_counter() - start
+            self.log_callback(f"🎨 Wrote {page_count} {self.color_mode.upper()} pages to {os.path.basename(output_path)} in {elapsed:.2f}s "
+                              f"({elapsed / page_count * 1000:.0f} ms/page, {page_count / elapsed:.1f} pages/s; colour conversion "
+                              f"{convert_seconds / page_count * 1000:.0f} ms/page on {workers} workers)")
+        return page_count
+
+    def write_page_file(self, spool, workers=None):
+        """Impose a spool's remaining cards and write its pages to the spool's own file.
+
+        Returns:
+            dict: Index row with the group, template, file name, card and page counts
+        """
+        output_path = self.get_page_output_path(spool.route, spool.group)
+        spool.flush()
+        notes = [f"template '{spool.route}'" if spool.route is not None else None,
+                 f"group '{spool.group}'" if spool.group is not None else None]
+        note = " for " + ", ".join(n for n in notes if n) if any(notes) else ""
+        self.log_callback(f"📦 Arranged {spool.card_count} cards{note} onto {len(spool)} A4 pages"
+                          + (f" (back pages mirrored for {self.duplex_flip}-edge duplex printing)" if self.get_route_layouts(spool.route)[1] is not None else ""))
+        page_count = 0
+        if len(spool):
+            page_count = self.save_pages(spool.drain(), output_path, workers, count=len(spool))
+            self.log_callback(f"🎉 Successfully saved A4 {self.page_format.upper()} to: {os.path.basename(output_path)}")
+        else:
+            self.log_callback("⚠️ No A4 pages were generated to save as PDF.")
+        return {'group': '' if spool.group is None else spool.group, 'template': '' if spool.route is None else spool.route,
+                'file': os.path.basename(output_path) if page_count else '', 'cards': spool.card_count, 'pages': page_count}
+
+    def write_page_files(self, spools):
+        """Write every spool's page file, several files at a time when there is more than one.
+
+        Each file is imposed and encoded on its own thread (with one colour conversion
+        thread each). Log messages from the writer threads are passed to log_callback
+        on the calling thread, which keeps the GUI log single-threaded.
+
+        Returns:
+            tuple: (index rows of the files written, in the order the groups first appeared,
+                    spools whose file could not be written)
+        """
+        spools = [spool for spool in spools.values() if spool.card_count]
+        if len(spools) == 1:
+            try:
+                return [self.write_page_file(spools[0])], []
+            except Exception as e:
+                self.log_callback(f"❌ Error saving PDF: {str(e)}")
+                self.error_callback("PDF Save Error", f"Error saving PDF: {str(e)}")
+                return [], spools
+
+        # Built once here rather than racing on the writer threads
+        self.get_cmyk_transform()
+        workers = max(1, min(OUTPUT_MAX_WORKERS, os.cpu_count() or 1, len(spools)))
+        self.log_callback(f"🧵 Writing {len(spools)} page files on {workers} threads")
+        start = time.perf_counter()
+        main_log = self.log_callback
+        messages = queue.Queue()
+        self.log_callback = messages.put
+        rows = {}
+        failed = []
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(self.write_page_file, spool, 1): i for i, spool in enumerate(spools)}
+                not_done = set(futures)
+                while not_done:
+                    done, not_done = wait(not_done, timeout=PAGE_GROUP_LOG_INTERVAL)
+                    while not messages.empty():
+                        main_log(messages.get())
+                    for future in done:
+                        spool = spools[futures[future]]
+                        try:
+                            rows[futures[future]] = future.result()
+                        except Exception as e:
+                            path = os.path.basename(self.get_page_output_path(spool.route, spool.group))
+                            main_log(f"❌ Error saving {path}: {str(e)}")
+                            self.error_callback("PDF Save Error", f"Error saving {path}: {str(e)}")
+                            failed.append(spool)
+        finally:
+            self.log_callback = main_log
+            while not messages.empty():
+                main_log(messages.get())
+
+        elapsed = time.perf_counter() - start
+        pages = sum(row['pages'] for row in rows.values())
+        if pages:
+            self.log_callback(f"🧵 Wrote {len(rows)} page files, {pages} pages in {elapsed:.2f}s ({pages / elapsed:.1f} pages/s)")
+        return [rows[i] for i in sorted(rows)], failed
+
+    def write_page_index(self, rows):
+        """Write a CSV index of the page files with their groups and page counts."""
+        index_path = self.get_page_index_path()
+        with open(index_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['group', 'template', 'file', 'cards', 'pages'])
+            writer.writeheader()
+            writer.writerows(rows)
+        self.log_callback(f"🧾 Wrote page index for {len(rows)} files to: {os.path.basename(index_path)}")
+        return index_path
+
+    def write_quarantine_report(self, rows):
+        """Write a CSV of the rows isolated rendering gave up on, with the reason for each."""
+        report_path = os.path.join(self.output_folder, QUARANTINE_REPORT)
+        with open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['ext_id', 'photo', 'reason', 'seconds'])
+            writer.writeheader()
+            writer.writerows(rows)
+        self.log_callback(f"🚧 Wrote {len(rows)} quarantined rows to: {os.path.basename(report_path)}")
+        return report_path
+
+    def log_memory_summary(self):
+        """Log peak memory use, and for a budgeted run the peak in-flight work, early renders and spilled pages."""
+        peak_rss = MemoryBudget.peak_rss()
+        budget = self.memory_budget
+        if peak_rss is not None:
+            budget_note = f" (budget {format_bytes(budget.max_bytes)})" if budget is not None else ""
+            self.log_callback(f"  • Peak memory (RSS): {format_bytes(peak_rss)}{budget_note}")
+        if budget is not None:
+            peaks = ", ".join(f"{kind} {format_bytes(budget.peak_in_flight[kind])}" for kind in ('cards', 'pages', 'photos'))
+            self.log_callback(f"  • Peak in flight: {peaks}")
+            self.log_callback(f"  • Rendered queued cards early {budget.early_flushes} times, {budget.spilled_pages} pages spilled to disk")
+
     def generate_all_id_cards(self):
-        """Generate ID cards for all students."""
+        """Generate ID cards for all students.
+
+        Returns:
+            list: EXT_IDs of the cards written; empty when the run failed before its pages were saved
+        """
+        profiler = None
+        if self.memory_profile:
+            profiler = MemoryProfiler(self.memory_profile, self.profile_every, log_callback=self.log_callback)
+            profiler.start()
         try:
-            if not os.path.exists(self.excel_path):
-                raise FileNotFoundError(f"Excel file not found: {self.excel_path}")
-                
-            self.log_callback(f"📖 Reading Excel file: {os.path.basename(self.excel_path)}")
-            # Read student data from Excel
-            df = pd.read_excel(self.excel_path)
-            
+            # Create output folder if it doesn't exist
+            os.makedirs(self.output_folder, exist_ok=True)
+
+            # Read student data from Excel (or its on-disk index)
+            df = self.load_roster()
+
             if df.empty:
                 raise ValueError("Excel file is empty")
                 
@@ -1256,24 +4915,81 @@ class IDCardGenerator:
                     self.log_callback(f"⚠️ Optional field '{required_cols}' not found in Excel columns.")
 
             
+            if self.fuzzy_matching:
+                # Plan over the whole roster so files owned by unselected students are not reused
+                self.prepare_fuzzy_matching(df.to_dict('records'))
+
+            # Narrow down to the selected rows before any asset lookup
+            df = self.select_rows(df)
+            total_students = len(df)
+
+            # Render order and page breaks; a break column that is a sort key also breaks on the keys before it
+            sort_columns = self.resolve_columns(df, self.sort_keys) if self.sort_keys else None
+            break_columns = None
+            if self.page_break_column:
+                break_columns = self.resolve_columns(df, [self.page_break_column])
+                if sort_columns and break_columns[0] in sort_columns:
+                    break_columns = sort_columns[:sort_columns.index(break_columns[0]) + 1]
+            if sort_columns:
+                self.log_callback(f"🔃 Rendering cards sorted by {' → '.join(map(str, sort_columns))}")
+            if profiler is not None:
+                profiler.stage('roster', 0, rows=total_students, dataframe_bytes=int(df.memory_usage(deep=True).sum()))
+
             successful_cards = 0
             failed_cards = 0
+            rendered_ids = []
             
-            generated_images = [] # List to store generated images for PDF export
+            # Cards are imposed onto A4 pages as they are rendered (only when exporting pages),
+            # with one spool and output file per template route and page group
+            spools = None
+            if self.export_as_pdf():
+                spools = {}
+                self.log_callback(f"📏 A4 Landscape size (px): {A4_PAGE_SIZE}, {A4_GRID[0]}x{A4_GRID[1]} grid, "
+                                  f"padding around each card (px): {A4_CARD_PADDING}")
+
+            # Card images are streamed into archives as they are rendered
+            if self.card_archive:
+                self.card_sink = CardArchiveSink(self.output_folder, self.card_archive, self.card_image_format,
+                                                 self.archive_group_column, self.log_callback)
+            if self.thumbnails:
+                self.thumbnail_cache = ThumbnailCache(self.output_folder, self.append_pages, self.log_callback)
+            if self.card_outputs:
+                self.output_writer = CardOutputWriter(self.output_folder, self.card_outputs, self.resampling_preset, self.log_callback)
+
+            # Rows are queued per template route and page group, and rendered in blocks for the isolated workers
+            pending = {}
+            batch_size = 1
+            workers = None
+            if self.isolate_workers:
+                self.render_workers = RenderWorkerPool(self, self.isolate_workers, self.row_timeout, self.worker_memory)
+                limit = f", {format_bytes(self.worker_memory)} each" if self.worker_memory else ""
+                self.log_callback(f"🛡️ Rendering rows in {self.isolate_workers} isolated worker processes "
+                                  f"({self.row_timeout:g}s per row{limit})")
+                # Queue enough rows to keep every worker busy
+                batch_size = self.isolate_workers * ISOLATED_ROWS_PER_WORKER
 
             try:
                 # Process each student
-                for index, row in df.iterrows():
+                break_group = None
+                for index, student_data in self.iter_roster_rows(df, sort_columns):
                     self.log_callback(f"\n--- Processing Row {index + 1} ---")
-                    student_data = row.to_dict()
                     self.log_callback(f"Raw row data: {student_data}")
 
+                    if break_columns:
+                        row_group = self.row_sort_key(student_data, break_columns)
+                        if break_group is not None and row_group != break_group:
+                            # Render what is queued and close the part-filled pages, so the group starts a new page
+                            for (route, group), rows_queue in pending.items():
+                                successful, failed = self._flush_pending_cards(rows_queue, spools, route, group, rendered_ids)
+                                successful_cards += successful
+                                failed_cards += failed
+                            for spool in (spools or {}).values():
+                                spool.flush()
+                            self.log_callback(f"📑 Page break: {', '.join(f'{column} {self.cell_text(student_data[column])}' for column in break_columns)}")
+                        break_group = row_group
+
                     # Find the actual dictionary key for 'ext_id' case-insensitively
-                    ext_id_key_in_dict = None
-                    for key in student_data.keys():
-                        if key.lower() in ['ext_id', 'ext-id', 'extid', 'id']:
-                            ext_id_key_in_dict = key
-                            break
+                    ext_id_key_in_dict = self.find_ext_id_key(student_data)
 
                     # If the key is not found in any case, or if the value is empty, skip the row
                     if not ext_id_key_in_dict or pd.isna(student_data.get(ext_id_key_in_dict)):
@@ -1287,13 +5003,10 @@ class IDCardGenerator:
 
                     # Look for matching photo by checking if ext_id is in the filename
                     photo_path = None
-                    # Search for photo file case-insensitively in the specified folder
-                    if os.path.exists(self.photos_folder):
-                         for filename in os.listdir(self.photos_folder):
-                             # Check if ext_id (as string) is a substring of the lowercased filename
-                             if ext_id.lower() in filename.lower() and filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                                 photo_path = os.path.join(self.photos_folder, filename)
-                                 break # Found a match, no need to check other files
+                    # Look up the photo file case-insensitively in the folder index
+                    photo_index = self.get_photo_index()
+                    if photo_index.folder_exists:
+                        photo_path = self.find_asset(photo_index, ext_id, student_data, "photo")
                     else:
                         self.log_callback(f"  ⚠️ Photos Folder not found: {self.photos_folder}. No photo search performed.")
 
@@ -1302,162 +5015,482 @@ class IDCardGenerator:
                     else:
                         self.log_callback(f"  ⚠️ No photo found for EXT_ID: {ext_id} in {self.photos_folder}")
 
-                    # Pass the student_data and the discovered ext_id_key to generate_id_card
-                    generated_card_image = self.generate_id_card(student_data, photo_path, ext_id_key_in_dict)
+                    # Queue the student_data and the discovered ext_id_key for generate_id_card
+                    route = self.route_for_row(student_data)
+                    group = self.group_for_row(student_data)
+                    rows_queue = pending.setdefault((route, group), [])
+                    rows_queue.append((student_data, photo_path, ext_id_key_in_dict))
+                    near_limit = self.memory_budget is not None and self.memory_budget.near_limit()
+                    if near_limit:
+                        # Render what is queued now instead of filling the batch, so its cards can be imposed and released
+                        self.memory_budget.early_flushes += 1
+                        self.log_callback(f"⏳ Memory at {format_bytes(self.memory_budget.usage())} of "
+                                          f"{format_bytes(self.memory_budget.max_bytes)}; rendering queued cards early")
+                    if len(rows_queue) >= batch_size or near_limit:
+                        successful, failed = self._flush_pending_cards(rows_queue, spools, route, group, rendered_ids)
+                        successful_cards += successful
+                        failed_cards += failed
+                        if profiler is not None:
+                            profiler.tick(successful_cards + failed_cards, spools)
 
-                    if generated_card_image:
-                        generated_images.append(generated_card_image)
-                        self.log_callback(f"  ✅ Generated image for {ext_id} (added to PDF list)")
-                        successful_cards += 1
-                    else:
-                        # If generate_id_card returned None (due to error or no data added)
-                        self.log_callback(f"  ❌ Failed to generate card for {ext_id} (generate_id_card returned None)")
-                        failed_cards += 1
+                for (route, group), rows_queue in pending.items():
+                    successful, failed = self._flush_pending_cards(rows_queue, spools, route, group, rendered_ids)
+                    successful_cards += successful
+                    failed_cards += failed
 
             except KeyboardInterrupt:
                 self.log_callback("\n⚠️ ID card generation was interrupted by user.")
-                messagebox.showwarning("Generation Interrupted", 
+                self.warning_callback("Generation Interrupted", 
                                      f"ID card generation was interrupted.\n\nProgress:\n• {successful_cards} cards generated\n• {failed_cards} failed")
                 # Continue to final summary and PDF saving based on images collected so far
                 pass # Allow execution to continue to the final summary and PDF save
+            finally:
+                if self.card_sink is not None:
+                    sink, self.card_sink = self.card_sink, None
+                    sink.close()
+                if self.thumbnail_cache is not None:
+                    thumbnails, self.thumbnail_cache = self.thumbnail_cache, None
+                    thumbnails.close()
+                if self.output_writer is not None:
+                    writer, self.output_writer = self.output_writer, None
+                    writer.close()
+                if self.render_workers is not None:
+                    workers, self.render_workers = self.render_workers, None
+                    workers.close()
+
+            if profiler is not None:
+                profiler.stage('render', successful_cards + failed_cards, spools,
+                               successful_cards=successful_cards, pages_in_spools=sum(len(spool) for spool in (spools or {}).values()))
 
             # Final summary
             self.log_callback(f"\n🎯 Generation Summary:")
             self.log_callback(f"  • Total students processed: {total_students}")
             self.log_callback(f"  • Successful cards: {successful_cards}")
             self.log_callback(f"  • Failed cards: {failed_cards}")
+            if self.template_routes:
+                cache = self.layout_cache
+                self.log_callback(f"  • Template cache: {cache.misses} loads, {cache.hits} hits, {cache.evictions} evictions")
+            if workers is None:
+                runs = self.text_runs
+                self.log_callback(f"  • Text run cache: {runs.misses} runs shaped, {runs.hits} reused (hit rate {runs.hit_rate():.0%})")
+            else:
+                self.log_callback(f"  • Quarantined rows: {len(workers.quarantined)} ({workers.restarts} worker restarts)")
+                if workers.quarantined:
+                    self.write_quarantine_report(workers.quarantined)
 
             # --- PDF Export Logic ---
-            if generated_images and self.export_as_pdf_var.get():
+            if spools and any(spool.card_count for spool in spools.values()):
                 self.log_callback("✅ 'Export as single PDF (A4 Landscape)' is checked. Preparing PDF...")
                 # Ensure output folder exists
                 os.makedirs(self.output_folder, exist_ok=True)
 
-                pdf_output_path = os.path.join(self.output_folder, "all_id_cards.pdf")
-                self.log_callback(f"📦 Arranging {len(generated_images)} cards onto A4 pages for PDF export...")
+                index_rows, failed_spools = self.write_page_files(spools)
+                if failed_spools:
+                    # Cards on pages that were not saved do not count as rendered
+                    unsaved = {ext_id for spool in failed_spools for ext_id in spool.ext_ids}
+                    rendered_ids = [ext_id for ext_id in rendered_ids if ext_id not in unsaved]
+                if self.page_group_column and index_rows:
+                    self.write_page_index(index_rows)
+                if profiler is not None:
+                    profiler.stage('pages', successful_cards + failed_cards, spools,
+                                   pages=sum(row['pages'] for row in index_rows))
+
+            # Log if PDF export was skipped because the option was not selected or no images were generated
+            elif not self.export_as_pdf():
+                 self.log_callback("⏭️ PDF export option not selected. Skipping PDF generation.")
+            else:
+                 self.log_callback("⚠️ No cards generated. Skipping PDF save.")
+            self.log_memory_summary()
+            return rendered_ids
+
+        except FileNotFoundError as e:
+            self.log_callback(f"❌ File not found error: {str(e)}")
+            self.error_callback("File Not Found Error", f"Error: {str(e)}")
+        except ValueError as e:
+             self.log_callback(f"❌ Data error: {str(e)}")
+             self.error_callback("Data Error", f"Error: {str(e)}")
+        except Exception as e:
+            self.log_callback(f"❌ Critical error during bulk generation: {str(e)}")
+            self.error_callback("Generation Error", f"Critical error during generation: {str(e)}")
+        finally:
+            if profiler is not None:
+                profiler.finish()
+        return []
+
+class WatchFolderJob:
+    """Keep generating cards while photos, QR codes and roster rows trickle in.
 
-                a4_images = [] # List to store the final A4 pages
+    The roster and the photo/QR folders are polled. A file is only used once its size
+    and modification time have stayed the same for settle_seconds, so half-copied
+    photos and a roster that is still being saved are picked up on a later poll.
+    Rows whose photo (and QR code, when the layout shows one) are in place are
+    rendered with only those rows selected, and their pages are appended to the
+    day's output folder, <output>/<YYYY-MM-DD>. A row is rendered again only when its
+    roster values or files change; the fingerprints of rendered rows are kept in
+    <output>/.watch_state.json so a restart carries on where it stopped.
+    """
 
-                # Define A4 dimensions in pixels at 300 DPI (approx 3508x2480 portrait, so 2480x3508 landscape)
-                # Using common A4 aspect ratio scaled for reasonable pixel dimensions
-                a4_width_px = 3508 # Landscape width at 300 DPI (approx 11.69 inches * 300 DPI)
-                a4_height_px = 2480 # Landscape height at 300 DPI (approx 8.27 inches * 300 DPI)
-                a4_size = (a4_width_px, a4_height_px)
+    def __init__(self, generator, interval=WATCH_POLL_SECONDS, settle_seconds=WATCH_SETTLE_SECONDS):
+        self.generator = generator
+        self.log_callback = generator.log_callback
+        self.interval = interval
+        self.settle_seconds = settle_seconds
+        self.output_root = generator.output_folder
+        self.selection = generator.selection  # The user's --ids/--query/--rows; passes only render rows within it
+        self.state_path = os.path.join(self.output_root, WATCH_STATE_FILE)
+        self.state = self.load_state()
+        self.snapshot = {}  # Path -> (size, mtime_ns) at the latest poll
+        self.previous_snapshot = {}  # ... and at the poll before it
+        self.dirty = True  # Something changed (or is still settling) since the last pass
 
-                self.log_callback(f"📏 A4 Landscape size (px): {a4_size}")
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self.log_callback(f"👀 Resuming watch: {len(state.get('rows', {}))} rows already rendered")
+                return state
+            except (OSError, ValueError) as e:
+                self.log_callback(f"⚠️ Could not read watch state {self.state_path}: {e}; starting fresh")
+        return {'rows': {}}
 
-                # Define grid layout (5 columns, 2 rows) based on user's example image
-                num_cols = 5
-                num_rows = 2
-                cards_per_page = num_cols * num_rows
+    def save_state(self):
+        os.makedirs(self.output_root, exist_ok=True)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
 
-                # Calculate space for each card, including padding
-                card_slot_width = a4_width_px // num_cols
-                card_slot_height = a4_height_px // num_rows
+    def poll_files(self):
+        """Stat the roster and every file in the photo/QR folders."""
+        snapshot = {}
+        try:
+            stat = os.stat(self.generator.excel_path)
+            snapshot[self.generator.excel_path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+        for folder in (self.generator.photos_folder, self.generator.qr_folder):
+            if folder and os.path.isfile(folder):
+                # A ZIP archive source
+                stat = os.stat(folder)
+                snapshot[folder] = (stat.st_size, stat.st_mtime_ns)
+                continue
+            if not folder or not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        snapshot[os.path.join(folder, entry.name)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
 
-                self.log_callback(f"📐 Card slot size (px): ({card_slot_width}, {card_slot_height}) for {num_cols}x{num_rows} grid")
-                
-                # Define padding around each card within its slot
-                card_padding_px = 30 # Adjust this value to control the gap
-                self.log_callback(f"Padding around each card (px): {card_padding_px}")
+    def is_settled(self, path, now):
+        """Whether a file looked the same at the last two polls and was not written to recently."""
+        current = self.snapshot.get(path)
+        return (current is not None and self.previous_snapshot.get(path) == current
+                and now - current[1] / 1e9 >= self.settle_seconds)
 
-                # Process images in batches of cards_per_page
-                for i in range(0, len(generated_images), cards_per_page):
-                    self.log_callback(f"📄 Creating A4 page {len(a4_images) + 1} for batch starting at index {i}")
-                    a4_page = Image.new('RGB', a4_size, (255, 255, 255)) # Create a blank white A4 landscape page
-                    draw = ImageDraw.Draw(a4_page)
+    def fingerprint(self, student_data, assets):
+        """Hash of a row's values and the signatures of its (index, path) files."""
+        key = json.dumps({str(column): str(value) for column, value in student_data.items()}, sort_keys=True)
+        key += "|" + "|".join(f"{path}:{index.signature(path)}" for index, path in assets if path)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
 
-                    # Optional: Draw faint guide lines for debugging layout
-                    # for col in range(num_cols + 1): draw.line([(col*card_slot_width, 0), (col*card_slot_width, a4_height_px)], fill=(200,200,200), width=1)
-                    # for row in range(num_rows + 1): draw.line([(0, row*card_slot_height), (a4_width_px, row*card_slot_height)], fill=(200,200,200), width=1)
+    def run_pass(self, now):
+        """Render the rows that are complete and new or changed.
 
-                    batch = generated_images[i : i + cards_per_page]
+        Returns:
+            bool: True when nothing is waiting on a file that is still being written
+        """
+        generator = self.generator
+        if not self.is_settled(generator.excel_path, now):
+            return False
+        try:
+            generator.output_folder = self.output_root
+            df = generator.load_roster()
+        except Exception as e:
+            # e.g. a workbook that is still being saved
+            self.log_callback(f"⏳ Roster not readable yet: {e}")
+            return False
 
-                    for j, card_img in enumerate(batch):
-                        col_index = j % num_cols
-                        row_index = j // num_cols
+        ext_id_column = generator.find_ext_id_key({column: None for column in df.columns})
+        if ext_id_column is None:
+            self.log_callback("⚠️ Roster has no EXT_ID column; waiting for it to change")
+            return True
+        need_photo = generator.front_layout.photo_coordinates is not None
+        need_qr = any(layout.qr_coordinates is not None for _, layout in generator.get_layouts())
 
-                        # Calculate the top-left position of the current slot
-                        slot_x = col_index * card_slot_width
-                        slot_y = row_index * card_slot_height
-                        
-                        self.log_callback(f"    🖼️ Processing card {j+1} in batch, slot ({col_index}, {row_index}) at position ({slot_x}, {slot_y})")
+        # Rescan the folders; asset lookups for every row are not logged
+        for index in (generator.photo_index, generator.qr_index):
+            if index is not None:
+                index.close()
+        generator.photo_index = generator.qr_index = None
+        records = df.to_dict('records')
+        if self.selection is not None and not self.selection.is_empty():
+            selected = self.selection.apply(df, ext_id_column).to_dict('records')
+        else:
+            selected = records
+        generator.log_callback = lambda message: None
+        ready, waiting, settling = {}, 0, False
+        try:
+            if generator.fuzzy_matching:
+                generator.prepare_fuzzy_matching(records)
+            for student_data in selected:
+                if pd.isna(student_data.get(ext_id_column)):
+                    continue
+                ext_id = str(student_data[ext_id_column])
+                photo_path = generator.find_asset(generator.get_photo_index(), ext_id, student_data, "photo") if need_photo else None
+                qr_path = generator.find_asset(generator.get_qr_index(), ext_id, student_data, "QR code") if need_qr else None
+                if (need_photo and not photo_path) or (need_qr and not qr_path):
+                    waiting += 1
+                    continue
+                assets = ((generator.get_photo_index(), photo_path), (generator.get_qr_index(), qr_path))
+                if not all(self.is_settled(index.source_file(path), now) for index, path in assets if path):
+                    settling = True
+                    waiting += 1
+                    continue
+                fingerprint = self.fingerprint(student_data, assets)
+                if self.state['rows'].get(ext_id) != fingerprint:
+                    ready[ext_id] = fingerprint
+        finally:
+            generator.log_callback = self.log_callback
 
-                        # Resize card image to fit within the slot while maintaining aspect ratio
-                        # Calculate the maximum possible dimensions for the card while fitting within the slot, considering padding
-                        max_card_width = card_slot_width - 2 * card_padding_px
-                        max_card_height = card_slot_height - 2 * card_padding_px
-                        
-                        self.log_callback(f"    📦 Max card size within padding (px): ({max_card_width}, {max_card_height})")
+        if ready:
+            day_folder = os.path.join(self.output_root, time.strftime("%Y-%m-%d"))
+            self.log_callback(f"👀 {len(ready)} new or changed rows ready; adding them to {day_folder}")
+            generator.output_folder = day_folder
+            generator.selection = RowSelection(ids=list(ready))
+            # Only rows whose card and page file were written are remembered; failed ones are retried on the next pass
+            rendered = [ext_id for ext_id in generator.generate_all_id_cards() if ext_id in ready]
+            self.state['rows'].update((ext_id, ready[ext_id]) for ext_id in rendered)
+            self.state['updated'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            self.save_state()
+            if len(rendered) < len(ready):
+                self.log_callback(f"⚠️ {len(ready) - len(rendered)} row(s) failed; they will be retried on the next pass")
+        if ready or waiting:
+            self.log_callback(f"👀 {len(ready)} rows ready, {waiting} waiting for their photo/QR code, "
+                              f"{len(self.state['rows'])} rendered in total")
+        return not settling
 
-                        # Get original card image size
-                        original_card_width, original_card_height = card_img.size
-                        self.log_callback(f"    📏 Original card size (px): ({original_card_width}, {original_card_height})")
+    def run(self, stop_event=None):
+        """Poll until stop_event is set (or Ctrl+C)."""
+        self.log_callback(f"👀 Watching {self.generator.excel_path}, {self.generator.photos_folder} and "
+                          f"{self.generator.qr_folder} every {self.interval:g}s")
+        try:
+            while stop_event is None or not stop_event.is_set():
+                snapshot = self.poll_files()
+                if snapshot != self.snapshot:
+                    self.dirty = True
+                self.previous_snapshot, self.snapshot = self.snapshot, snapshot
+                if self.dirty:
+                    self.dirty = not self.run_pass(time.time())
+                if stop_event is not None:
+                    stop_event.wait(self.interval)
+                else:
+                    time.sleep(self.interval)
+        except KeyboardInterrupt:
+            self.log_callback("👋 Stopped watching")
 
-                        # Calculate scaling factor to fit within the slot
-                        width_scale = max_card_width / original_card_width
-                        height_scale = max_card_height / original_card_height
+def load_layout(layout_path):
+    """Load a JSON layout file for command-line runs.
 
-                        # Use the minimum scale factor to maintain aspect ratio
-                        scale_factor = min(width_scale, height_scale)
-                        self.log_callback(f"    🔎 Scaling factor: {scale_factor:.4f}")
+    The file holds the same settings as the GUI, e.g.
+    {"coordinates": {"Photo": [293, 270], "Name": [120, 520]}, "photo_frame_style": "circle",
+     "font_color": "black", "border_size": 2, "border_color": "blue",
+     "font_path": "fonts/Arial.ttf", "font_sizes": {"Name": 24}}
+    Double-sided jobs add "back_coordinates" for the back template, and multi-sheet
+    jobs may add "column_aliases", e.g. {"Name": ["Pupil"]}. "shaping_font" names a
+    font (e.g. Noto Sans Devanagari) for values in complex scripts. A "Barcode"
+    coordinate adds a Code 128 barcode of "barcode_column" (default EXT_ID) that
+    fits "barcode_size", e.g. [360, 90].
+    """
+    with open(layout_path, 'r', encoding='utf-8') as f:
+        layout = json.load(f)
+    layout['coordinates'] = {label: tuple(xy) for label, xy in layout.get('coordinates', {}).items()}
+    layout['back_coordinates'] = {label: tuple(xy) for label, xy in layout.get('back_coordinates', {}).items()}
+    return layout
 
-                        # Calculate the new size for the card image
-                        new_card_width = int(original_card_width * scale_factor)
-                        new_card_height = int(original_card_height * scale_factor)
-                        self.log_callback(f"    ✨ Resized card size (px): ({new_card_width}, {new_card_height})")
+def load_template_routing(routing_path):
+    """Load a per-row template routing file, e.g.
+    {"column": "Grade", "templates": {"10": {"template": "grade10.png"},
+                                     "Staff": {"template": "staff.png", "coordinates": {"Photo": [293, 270]}}}}
+    Each template may also set back_template, back_coordinates, font_path and font_sizes.
+    """
+    with open(routing_path, 'r', encoding='utf-8') as f:
+        routing = json.load(f)
+    for spec in routing.get('templates', {}).values():
+        for key in ('coordinates', 'back_coordinates'):
+            if key in spec:
+                spec[key] = {label: tuple(xy) for label, xy in spec[key].items()}
+    return routing
 
-                        # Resize the card image using LANCZOS for quality
-                        resized_card = card_img.resize((new_card_width, new_card_height), Image.Resampling.LANCZOS)
+def parse_column_list(text):
+    """Parse comma-separated column names, e.g. "Campus, Grade, Section, Name"; None when empty."""
+    columns = [name.strip() for name in (text or '').split(',') if name.strip()]
+    return columns or None
 
-                        # Calculate the paste position to center the resized card within its slot
-                        paste_x = slot_x + (card_slot_width - new_card_width) // 2
-                        paste_y = slot_y + (card_slot_height - new_card_height) // 2
-                        
-                        self.log_callback(f"    📍 Pasting resized card at (px): ({paste_x}, {paste_y})")
+def parse_sheet_list(text):
+    """Parse a sheets option: None/empty for the first sheet only, 'all', or comma-separated names."""
+    if not text or not text.strip():
+        return None
+    if text.strip().lower() == 'all':
+        return 'all'
+    return [name.strip() for name in text.split(',') if name.strip()]
 
-                        # Paste the resized card image onto the A4 page
-                        # Check if the resized_card has an alpha channel before pasting with mask
-                        if resized_card.mode == 'RGBA':
-                             a4_page.paste(resized_card, (paste_x, paste_y), resized_card)
-                        else:
-                             a4_page.paste(resized_card, (paste_x, paste_y))
+def build_arg_parser():
+    """Command-line options. Without any options the GUI is started."""
+    parser = argparse.ArgumentParser(description="Bulk ID Card Generator")
+    parser.add_argument('--template', help="ID card template image")
+    parser.add_argument('--cards-archive', choices=list(CARD_ARCHIVE_FORMATS),
+                        help="Also stream every card image into a ZIP (stored) or TAR archive with a manifest")
+    parser.add_argument('--card-format', choices=list(CARD_IMAGE_FORMATS), default='png', help="Image format of archived cards")
+    parser.add_argument('--outputs', type=parse_output_specs, help="Also write every card at several sizes from the one render, as "
+                        "name:format:width[:quality] items, e.g. print:png:full,web:jpeg:600:85,thumb:jpeg:96")
+    parser.add_argument('--archive-by', help="Write one card archive per value of this column, e.g. Grade")
+    parser.add_argument('--group-by', help="Write one PDF/TIFF per value of this column, e.g. Grade or Section, "
+                        "plus all_id_cards_index.csv listing the files and page counts")
+    parser.add_argument('--sheets', help="Merge several sheets of the workbook: 'all' or comma-separated sheet names "
+                        "(default: first sheet only)")
+    parser.add_argument('--per-sheet', action='store_true',
+                        help="With --sheets: one PDF/TIFF per sheet plus the all_id_cards_index.csv summary")
+    parser.add_argument('--template-routing', help="JSON file choosing a template per row from a column value")
+    parser.add_argument('--back-template', help="Back side template image for double-sided cards")
+    parser.add_argument('--duplex-flip', choices=list(DUPLEX_FLIP_MODES), default=DEFAULT_DUPLEX_FLIP,
+                        help="Sheet edge the printer flips on; back pages in the PDF are mirrored to match")
+    parser.add_argument('--photos', help="Folder or ZIP archive containing student photos")
+    parser.add_argument('--qr', help="Folder or ZIP archive containing QR code images")
+    parser.add_argument('--excel', help="Excel roster file")
+    parser.add_argument('--output', help="Output folder")
+    parser.add_argument('--layout', help="JSON layout file with coordinates, fonts and frame options")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running: render new or changed rows as their photos/QR codes arrive, "
+                        "appending pages to <output>/<date>")
+    parser.add_argument('--watch-interval', type=float, default=WATCH_POLL_SECONDS, help="Seconds between polls in --watch mode")
+    parser.add_argument('--settle', type=float, default=WATCH_SETTLE_SECONDS,
+                        help="Seconds a file must stay unchanged before --watch uses it")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Validate the job without rendering and write a JSON pre-flight report")
+    parser.add_argument('--report', help="Pre-flight report path (default: <output>/preflight_report.json)")
+    parser.add_argument('--fuzzy-match', action='store_true',
+                        help="Fuzzy-match photo/QR filenames on EXT_ID and Name when no file contains the EXT_ID")
+    parser.add_argument('--pdf', action='store_true', help="Export the cards as a single A4 PDF")
+    parser.add_argument('--page-format', choices=list(PAGE_FORMATS), default='pdf',
+                        help="File format of the A4 pages; tiff implies --pdf export")
+    parser.add_argument('--color', choices=list(OUTPUT_COLOR_MODES), default='rgb', help="Colour mode of the A4 pages")
+    parser.add_argument('--max-rss', type=parse_byte_size,
+                        help="Memory budget, e.g. 2G: renders queued cards early, spills pages to disk and refuses oversized images")
+    parser.add_argument('--sort-by', help="Render cards sorted by these columns, e.g. \"Campus,Grade,Section,Name\"")
+    parser.add_argument('--page-break-on', help="Start a new A4 page when this column (or a --sort-by key before it) changes")
+    parser.add_argument('--isolate', type=int, default=0, metavar='WORKERS',
+                        help=f"Render rows in this many worker processes; rows that time out or crash their worker "
+                        f"are skipped and listed in <output>/{QUARANTINE_REPORT}")
+    parser.add_argument('--row-timeout', type=float, default=ROW_TIMEOUT_SECONDS, help="Seconds a row may take with --isolate")
+    parser.add_argument('--worker-memory', type=parse_byte_size,
+                        help="Address space limit of each --isolate worker, e.g. 1G (not on Windows)")
+    parser.add_argument('--profile-memory', metavar='REPORT',
+                        help="Profile memory (RSS and tracemalloc) per stage and every --profile-every cards into a JSON report")
+    parser.add_argument('--profile-every', type=int, default=PROFILE_SAMPLE_EVERY, help="Cards between memory samples")
+    parser.add_argument('--thumbnails', action='store_true',
+                        help=f"Write card thumbnails to <output>/{THUMBNAIL_FOLDER} for the GUI's results gallery")
+    parser.add_argument('--icc-profile', help="CMYK ICC profile from the print vendor, used with --color cmyk")
+    parser.add_argument('--quality', choices=list(RESAMPLING_PRESETS), default=DEFAULT_RESAMPLING_PRESET,
+                        help="Resampling preset: draft (fastest), proof or print (default)")
+    selection = parser.add_argument_group("row selection (reprints)")
+    selection.add_argument('--ids', help="Comma-separated EXT_IDs to render")
+    selection.add_argument('--ids-file', help="Text file with one EXT_ID per line")
+    selection.add_argument('--query', help="Row filter over roster columns, e.g. \"Grade == 10 and Section == 'A'\"")
+    selection.add_argument('--rows', help="Row numbers/ranges as shown in the log, e.g. 1-50,75")
+    return parser
 
-                    a4_images.append(a4_page)
-                    self.log_callback(f"  ✅ Finished creating A4 page {len(a4_images)}")
+def build_selection(args):
+    """Build a RowSelection from the command-line options, or None."""
+    ids = args.ids.split(',') if args.ids else []
+    if args.ids_file:
+        with open(args.ids_file, 'r', encoding='utf-8') as f:
+            ids.extend(line.strip() for line in f if line.strip())
+    selection = RowSelection(ids=ids or None, query=args.query, rows=args.rows)
+    return None if selection.is_empty() else selection
 
-                try:
-                    if a4_images:
-                        # Convert A4 page images to RGB mode before saving as PDF
-                        rgb_a4_images = [img.convert('RGB') for img in a4_images]
+def run_cli(args):
+    """Run a job from the command line. Returns the process exit code."""
+    missing = [name for name in ('template', 'photos', 'qr', 'excel', 'output', 'layout') if not getattr(args, name)]
+    if missing:
+        logging.error(f"Missing required options: {', '.join('--' + name for name in missing)}")
+        return 2
+    if args.per_sheet and not args.sheets:
+        logging.error("--per-sheet needs --sheets")
+        return 2
+    if args.watch and args.cards_archive:
+        logging.error("--cards-archive cannot be used with --watch; archives are written per job")
+        return 2
 
-                        # Save the first A4 image, then append the rest
-                        rgb_a4_images[0].save(pdf_output_path, save_all=True, append_images=rgb_a4_images[1:], format='PDF')
-                        self.log_callback(f"🎉 Successfully saved A4 PDF to: {os.path.basename(pdf_output_path)}")
-                    else:
-                        self.log_callback("⚠️ No A4 pages were generated to save as PDF.")
+    layout = load_layout(args.layout)
+    generator = IDCardGenerator(
+        template_path=args.template,
+        photos_folder=args.photos,
+        qr_folder=args.qr,
+        excel_path=args.excel,
+        output_folder=args.output,
+        coordinates=layout['coordinates'],
+        log_callback=logging.info,
+        photo_frame_style=layout.get('photo_frame_style', 'circle'),
+        font_color=layout.get('font_color', 'black'),
+        border_size=int(layout.get('border_size', 2)),
+        border_color=layout.get('border_color', 'blue'),
+        export_as_pdf_var=args.pdf or args.page_format == 'tiff' or bool(args.group_by) or args.per_sheet or args.watch,
+        append_pages=args.watch,
+        memory_profile=args.profile_memory,
+        profile_every=args.profile_every,
+        thumbnails=args.thumbnails,
+        color_mode=args.color,
+        cmyk_profile=args.icc_profile,
+        page_format=args.page_format,
+        max_memory=args.max_rss,
+        sort_keys=parse_column_list(args.sort_by),
+        page_break_column=args.page_break_on,
+        isolate_workers=args.isolate,
+        row_timeout=args.row_timeout,
+        worker_memory=args.worker_memory,
+        template_routes=load_template_routing(args.template_routing) if args.template_routing else None,
+        card_archive=args.cards_archive,
+        card_image_format=args.card_format,
+        card_outputs=args.outputs,
+        archive_group_column=args.archive_by,
+        page_group_column=args.group_by or (SHEET_COLUMN if args.per_sheet else None),
+        sheets=parse_sheet_list(args.sheets),
+        column_aliases=layout.get('column_aliases'),
+        resampling_preset=args.quality,
+        fuzzy_matching=args.fuzzy_match,
+        selection=build_selection(args),
+        back_template_path=args.back_template,
+        back_coordinates=layout['back_coordinates'],
+        duplex_flip=args.duplex_flip,
+        barcode_column=layout.get('barcode_column'),
+        shaping_font=layout.get('shaping_font'),
+        barcode_size=layout.get('barcode_size', DEFAULT_BARCODE_SIZE),
+        error_callback=lambda title, message: logging.error(f"{title}: {message}"),
+        warning_callback=lambda title, message: logging.warning(f"{title}: {message}")
+    )
+    if layout.get('font_path'):
+        generator.set_font(layout['font_path'], layout.get('font_sizes', {}))
 
-                except Exception as e:
-                    self.log_callback(f"❌ Error saving PDF: {str(e)}")
-                    messagebox.showerror("PDF Save Error", f"Error saving PDF: {str(e)}")
+    if args.dry_run:
+        report_path = args.report or os.path.join(args.output, "preflight_report.json")
+        report = generator.preflight_scan(report_path)
+        summary = report['summary']
+        return 1 if summary['rows_with_issues'] or summary['asset_issues'] else 0
 
-            # Log if PDF export was skipped because the option was not selected or no images were generated
-            elif not self.export_as_pdf_var.get():
-                 self.log_callback("⏭️ PDF export option not selected. Skipping PDF generation.")
-            elif not generated_images:
-                 self.log_callback("⚠️ No cards generated. Skipping PDF save.")
+    if args.watch:
+        WatchFolderJob(generator, interval=args.watch_interval, settle_seconds=args.settle).run()
+        return 0
 
-        except FileNotFoundError as e:
-            self.log_callback(f"❌ File not found error: {str(e)}")
-            messagebox.showerror("File Not Found Error", f"Error: {str(e)}")
-        except ValueError as e:
-             self.log_callback(f"❌ Data error: {str(e)}")
-             messagebox.showerror("Data Error", f"Error: {str(e)}")
-        except Exception as e:
-            self.log_callback(f"❌ Critical error during bulk generation: {str(e)}")
-            messagebox.showerror("Generation Error", f"Critical error during generation: {str(e)}")
+    generator.generate_all_id_cards()
+    return 0
 
 def main():
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(build_arg_parser().parse_args()))
+
     root = tk.Tk()
     app = IDCardGeneratorGUI(root)
     root.mainloop()
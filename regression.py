@@ -0,0 +1,308 @@
+"""Golden-image regression checks for card rendering and A4 imposition.
+
+Renders fixed synthetic fixtures (no roster, photos, fonts or network needed),
+compares the cards and pages with the PNGs stored in golden/, checks that isolated
+rendering quarantines a row that hangs and one that kills its worker, and times each
+stage against the throughput baseline in golden/timings.json:
+
+    python regression.py check
+    python regression.py check --tolerance 4 --max-regression 0.5
+    python regression.py update                  # after an intended rendering change
+    python regression.py update --timings-only   # new machine: re-record the baseline only
+
+Failed comparisons write <case>_actual.png and <case>_diff.png (pixels over the
+tolerance in red) to the output folder. Timing baselines are machine-specific, so
+record them on the machine that runs the check.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import PIL
+from id_generator import IDCardGenerator, RenderWorkerPool
+from benchmark import FIXTURE_TEMPLATE_SIZE, FIXTURE_COORDINATES, make_fixture_template, make_fixture_photo, make_fixture_qr
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+TIMINGS_FILE = 'timings.json'
+
+# Back side of the double-sided fixture: QR code and two text fields
+FIXTURE_BACK_COORDINATES = {'QR Code': (319, 300), 'Guardian': (80, 500), 'Contact': (80, 550)}
+
+# Generator options per rendering case
+CARD_CASES = {
+    'card_circle': dict(photo_frame_style="circle"),
+    'card_square': dict(photo_frame_style="square", border_size=4, border_color="red", font_color="navy"),
+    'card_draft': dict(photo_frame_style="circle", resampling_preset='draft'),
+}
+GOLDEN_CARD_ROWS = 2  # Cards per case stored as golden images
+FIXTURE_ROWS = 10  # One full A4 page
+
+# Isolated rendering check: row timeout in seconds, and the rows whose photo hangs
+# past it or kills the worker process
+ISOLATION_TIMEOUT = 2.0
+ISOLATION_FAULTS = {'S1002': 'hang', 'S1005': 'crash'}
+
+
+def make_fixture_rows(count):
+    """Roster rows with every card field filled in."""
+    return [{
+        'EXT_ID': f"S{1000 + i}", 'Name': f"Student {i} Example", 'Grade': 9 + i % 3,
+        'PhoneNumber': f"98{i:08d}", 'Address': "Kathmandu", 'Guardian': f"Guardian {i}",
+        'Validity': "2026-12-31", 'RegNo': str(i),
+    } for i in range(count)]
+
+
+def make_fixture_job(workdir, rows):
+    """Write the template, back template, photos and QR codes for rows into workdir."""
+    os.makedirs(os.path.join(workdir, 'photos'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'qr'), exist_ok=True)
+    make_fixture_template(os.path.join(workdir, 'template.png'))
+    back = Image.new('RGB', FIXTURE_TEMPLATE_SIZE, (245, 245, 235))
+    ImageDraw.Draw(back).rectangle((0, FIXTURE_TEMPLATE_SIZE[1] - 120, FIXTURE_TEMPLATE_SIZE[0], FIXTURE_TEMPLATE_SIZE[1]), fill=(20, 60, 160))
+    back.save(os.path.join(workdir, 'back.png'))
+    entries = []
+    for i, row in enumerate(rows):
+        photo_path = os.path.join(workdir, 'photos', f"{row['EXT_ID']}.png")
+        make_fixture_photo(i).save(photo_path)
+        make_fixture_qr(21 + 4 * (i % 3), 4).save(os.path.join(workdir, 'qr', f"{row['EXT_ID']}.png"))
+        entries.append((row, photo_path, 'EXT_ID'))
+    return entries
+
+
+class FaultyGenerator(IDCardGenerator):
+    """Generator whose photo processing hangs or kills the process for the ISOLATION_FAULTS rows."""
+
+    def process_photo(self, photo_path):
+        fault = ISOLATION_FAULTS.get(os.path.splitext(os.path.basename(photo_path))[0])
+        if fault == 'hang':
+            time.sleep(ISOLATION_TIMEOUT * 30)
+        elif fault == 'crash':
+            os._exit(70)
+        return super().process_photo(photo_path)
+
+
+def make_generator(workdir, double_sided=False, generator_class=IDCardGenerator, **kwargs):
+    return generator_class(
+        template_path=os.path.join(workdir, 'template.png'),
+        photos_folder=os.path.join(workdir, 'photos'),
+        qr_folder=os.path.join(workdir, 'qr'),
+        excel_path=os.path.join(workdir, 'roster.xlsx'),
+        output_folder=os.path.join(workdir, 'output'),
+        coordinates=FIXTURE_COORDINATES,
+        back_template_path=os.path.join(workdir, 'back.png') if double_sided else None,
+        back_coordinates=FIXTURE_BACK_COORDINATES if double_sided else None,
+        **kwargs
+    )
+
+
+def render_cases(workdir, entries):
+    """Render every case; returns {golden name: image}."""
+    images = {}
+    for case, options in CARD_CASES.items():
+        generator = make_generator(workdir, **options)
+        for i, (front, _) in enumerate(generator.render_cards(entries[:GOLDEN_CARD_ROWS])):
+            images[f"{case}_{i}"] = front
+
+    generator = make_generator(workdir, double_sided=True, photo_frame_style="circle")
+    cards = generator.render_cards(entries)
+    images['card_back_0'] = cards[0][1]
+    fronts = [front for front, _ in cards]
+    backs = [back for _, back in cards]
+    images['page_front'] = generator.build_a4_page(fronts, layout=generator.front_layout)
+    images['page_back_long'] = generator.build_a4_page(backs, mirror='long', layout=generator.back_layout)
+    images['page_back_short'] = generator.build_a4_page(backs, mirror='short', layout=generator.back_layout)
+    return images
+
+
+def compare_images(actual, expected, tolerance):
+    """Compare two images channel by channel.
+
+    Returns:
+        tuple: (pixels over the tolerance, largest channel difference, diff image);
+               the count is None when the sizes or modes differ
+    """
+    if actual.size != expected.size or actual.mode != expected.mode:
+        return None, None, None
+    a = np.asarray(actual, dtype=np.int16).reshape(actual.height, actual.width, -1)
+    e = np.asarray(expected, dtype=np.int16).reshape(expected.height, expected.width, -1)
+    difference = np.abs(a - e).max(axis=2)
+    over = difference > tolerance
+
+    # Faded expected image with the differences on top: red over the tolerance, amber within it
+    diff = (np.asarray(expected.convert('RGB'), dtype=np.uint16) // 3 + 170).astype(np.uint8)
+    diff[(difference > 0) & ~over] = (255, 190, 0)
+    diff[over] = (255, 0, 0)
+    return int(over.sum()), int(difference.max()), Image.fromarray(diff, 'RGB')
+
+
+def check_images(images, golden_dir, output_dir, tolerance, max_mismatch):
+    """Compare rendered images with the golden PNGs; returns True when all match."""
+    ok = True
+    print(f"Golden images (tolerance {tolerance} per channel, up to {max_mismatch:.3%} of pixels over it):")
+    for case, image in images.items():
+        golden_path = os.path.join(golden_dir, f"{case}.png")
+        if not os.path.exists(golden_path):
+            print(f"  MISSING {case}: no {os.path.relpath(golden_path)} (run 'python regression.py update')")
+            ok = False
+            continue
+        with Image.open(golden_path) as expected:
+            expected.load()
+        mismatched, max_diff, diff = compare_images(image, expected, tolerance)
+        if mismatched is None:
+            print(f"  FAIL    {case}: {image.mode} {image.size} vs golden {expected.mode} {expected.size}")
+            passed = False
+        else:
+            passed = mismatched <= max_mismatch * image.width * image.height
+            status = "ok     " if passed else "FAIL   "
+            print(f"  {status} {case}: max diff {max_diff}, {mismatched} pixels over tolerance")
+        if not passed:
+            ok = False
+            os.makedirs(output_dir, exist_ok=True)
+            image.save(os.path.join(output_dir, f"{case}_actual.png"))
+            if diff is not None:
+                diff.save(os.path.join(output_dir, f"{case}_diff.png"))
+    if not ok:
+        print(f"  Actual and diff images written to {output_dir}")
+    return ok
+
+
+def check_isolation(workdir, entries, workers=2):
+    """Render the fixtures on isolated workers with a hanging and a crashing row; returns True when
+    exactly those rows are quarantined and every other card matches in-process rendering."""
+    print(f"Isolated rendering ({workers} workers, {ISOLATION_TIMEOUT:g}s row timeout):")
+    expected = make_generator(workdir, photo_frame_style="circle").render_cards(entries)
+    generator = make_generator(workdir, generator_class=FaultyGenerator, photo_frame_style="circle")
+    pool = RenderWorkerPool(generator, workers, timeout=ISOLATION_TIMEOUT)
+    try:
+        start = time.perf_counter()
+        cards = pool.render(entries)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+
+    ok = True
+    reasons = {row['ext_id']: row['reason'] for row in pool.quarantined}
+    for ext_id, fault in ISOLATION_FAULTS.items():
+        reason = reasons.pop(ext_id, None)
+        passed = reason is not None and reason.startswith("timed out" if fault == 'hang' else "worker crashed")
+        ok = ok and passed
+        print(f"  {'ok     ' if passed else 'FAIL   '} {ext_id} ({fault}): {reason or 'not quarantined'}")
+    for ext_id, reason in reasons.items():
+        ok = False
+        print(f"  FAIL    {ext_id}: quarantined unexpectedly ({reason})")
+
+    rendered = mismatched = 0
+    for (student_data, _, _), (front, _), (expected_front, _) in zip(entries, cards, expected):
+        if student_data['EXT_ID'] in ISOLATION_FAULTS:
+            continue
+        if front is None or not np.array_equal(np.asarray(front), np.asarray(expected_front)):
+            mismatched += 1
+        else:
+            rendered += 1
+    passed = mismatched == 0
+    ok = ok and passed
+    print(f"  {'ok     ' if passed else 'FAIL   '} other rows: {rendered} cards match in-process rendering, "
+          f"{mismatched} missing or different ({pool.restarts} worker restarts, {elapsed:.1f}s)")
+    return ok
+
+
+def time_stages(workdir, entries, repeat):
+    """Best-of-repeat throughput per stage, in items per second."""
+    generator = make_generator(workdir, double_sided=True, photo_frame_style="circle")
+    generator.render_cards(entries[:1])  # Warm up template, fonts and folder indexes
+    photo_paths = [photo_path for _, photo_path, _ in entries]
+    cards = generator.render_cards(entries)
+    fronts = [front for front, _ in cards]
+
+    stages = {
+        'process_photo': (len(photo_paths), lambda: [generator.process_photo(path) for path in photo_paths]),
+        'generate_id_card': (len(entries), lambda: generator.render_cards(entries)),
+        'build_a4_page': (1, lambda: generator.build_a4_page(fronts, layout=generator.front_layout)),
+    }
+    throughput = {}
+    for stage, (items, run) in stages.items():
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        throughput[stage] = items / best
+    return throughput
+
+
+def check_timings(throughput, baseline, max_regression):
+    """Compare stage throughput with the baseline; returns True when none regressed too far."""
+    ok = True
+    print(f"Stage throughput (fail below {1 - max_regression:.0%} of the baseline):")
+    for stage, per_second in throughput.items():
+        expected = baseline.get('stages', {}).get(stage)
+        if expected is None:
+            print(f"  {stage:18} {per_second:9.1f}/s   (no baseline)")
+            continue
+        ratio = per_second / expected
+        passed = ratio >= 1 - max_regression
+        ok = ok and passed
+        print(f"  {stage:18} {per_second:9.1f}/s   baseline {expected:9.1f}/s   {ratio:6.0%}  {'ok' if passed else 'FAIL'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Golden-image and throughput regression checks")
+    parser.add_argument('command', choices=['check', 'update'])
+    parser.add_argument('--golden-dir', default=GOLDEN_DIR)
+    parser.add_argument('--output-dir', default='regression_output', help="Where actual and diff images of failures go")
+    parser.add_argument('--tolerance', type=int, default=2, help="Largest per-channel difference that still matches")
+    parser.add_argument('--max-mismatch', type=float, default=0.0,
+                        help="Fraction of pixels allowed over the tolerance (default: none)")
+    parser.add_argument('--max-regression', type=float, default=0.3,
+                        help="Fail when a stage is slower than the baseline by more than this fraction")
+    parser.add_argument('--repeat', type=int, default=5, help="Timing runs per stage (best is kept)")
+    parser.add_argument('--skip-timings', action='store_true', help="Skip the throughput check")
+    parser.add_argument('--skip-isolation', action='store_true', help="Skip the isolated rendering check")
+    parser.add_argument('--timings-only', action='store_true', help="With update: re-record only the timing baseline")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    timings_path = os.path.join(args.golden_dir, TIMINGS_FILE)
+    with tempfile.TemporaryDirectory() as workdir:
+        entries = make_fixture_job(workdir, make_fixture_rows(FIXTURE_ROWS))
+
+        if args.command == 'update':
+            os.makedirs(args.golden_dir, exist_ok=True)
+            if not args.timings_only:
+                images = render_cases(workdir, entries)
+                for case, image in images.items():
+                    image.save(os.path.join(args.golden_dir, f"{case}.png"), optimize=True)
+                print(f"Wrote {len(images)} golden images to {args.golden_dir}")
+            baseline = {
+                'stages': time_stages(workdir, entries, args.repeat),
+                'python': platform.python_version(), 'pillow': PIL.__version__, 'machine': platform.machine(),
+            }
+            with open(timings_path, 'w', encoding='utf-8') as f:
+                json.dump(baseline, f, indent=2)
+            print(f"Wrote timing baseline to {timings_path}")
+            return 0
+
+        ok = check_images(render_cases(workdir, entries), args.golden_dir, args.output_dir, args.tolerance, args.max_mismatch)
+        if not args.skip_isolation:
+            ok = check_isolation(workdir, entries) and ok
+        if not args.skip_timings:
+            if os.path.exists(timings_path):
+                with open(timings_path, 'r', encoding='utf-8') as f:
+                    baseline = json.load(f)
+                ok = check_timings(time_stages(workdir, entries, args.repeat), baseline, args.max_regression) and ok
+            else:
+                print(f"No timing baseline at {timings_path}; run 'python regression.py update --timings-only'")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())